@@ -0,0 +1,276 @@
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from joblib import load
+
+from ingesta import guardar_atomico
+from prediccion import ejecutar_pipeline
+import expert_system
+from puntuacion_lotes import get_perfiles
+from tabla_decision import calcular_huella_reglas
+from utils import map_values
+from validacion import validar_perfiles
+from versiones import cargar_version, ruta_datos_cannabis, ruta_datos_psilocibina, ruta_modelo_cannabis, ruta_modelo_psilocibina
+
+
+# Directorio del almacén de variables codificadas por paciente
+ruta_almacen = '../almacen_caracteristicas'
+
+# Versión del formato del almacén; cambiarla obliga a reconstruirlo
+version_esquema = 1
+
+sustancias = ['Cannabis', 'Psilocibina']
+
+
+def calcular_huella_perfil(perfil):
+    # Huella de las respuestas originales, para detectar perfiles que cambiaron desde la última codificación
+    return hashlib.sha256(json.dumps(perfil, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def calcular_huella_codificacion(reglas=expert_system):
+    # Huella de lo que determina las variables almacenadas: la versión del esquema, las columnas de los datos de entrenamiento
+    # (columnas de los modelos) y las reglas (qué perfiles llegan a cada modelo). No incluye los modelos, para que un modelo
+    # nuevo pueda puntuar el almacén sin volver a codificar los perfiles.
+    columnas = [list(pd.read_csv(ruta, nrows=0).columns) for ruta in (ruta_datos_cannabis, ruta_datos_psilocibina)]
+    contenido = json.dumps([version_esquema, columnas, calcular_huella_reglas(reglas)], ensure_ascii=False)
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()[:12]
+
+
+def get_ruta_matriz(directorio, sustancia):
+    return os.path.join(directorio, f'{sustancia.lower()}.npy')
+
+
+def cargar_almacen(directorio=ruta_almacen):
+    # Las matrices se abren con 'mmap_mode' para leer solo las filas y columnas que se usan
+    ruta_esquema = os.path.join(directorio, 'esquema.json')
+    if not os.path.exists(ruta_esquema):
+        return None
+    with open(ruta_esquema, encoding='utf-8') as archivo:
+        esquema = json.load(archivo)
+    df_pacientes = pd.read_csv(os.path.join(directorio, 'pacientes.csv'), dtype={'Paciente': str, 'Huella': str}, keep_default_na=False)
+    matrices = {sustancia: np.load(get_ruta_matriz(directorio, sustancia), mmap_mode='r') for sustancia in sustancias}
+
+    if any(matriz.shape != (len(df_pacientes), len(esquema['Columnas'][sustancia])) for sustancia, matriz in matrices.items()):
+        raise ValueError(f'El almacén {directorio} está incompleto: las matrices no corresponden al índice de pacientes')
+    return esquema, df_pacientes, matrices
+
+
+def codificar_perfiles(perfiles, version, target_cols):
+    # Ejecutar el preprocesamiento y el sistema experto; si el lote falla se divide a la mitad hasta aislar los perfiles con error
+    try:
+        df_test, modelos = ejecutar_pipeline(perfiles, version)
+    except Exception as e:
+        if len(perfiles) == 1:
+            return [(pd.DataFrame({'Error': [str(e)]}), None)]
+        mitad = len(perfiles) // 2
+        return codificar_perfiles(perfiles[:mitad], version, target_cols) + codificar_perfiles(perfiles[mitad:], version, target_cols)
+
+    df_indice = pd.DataFrame(index=df_test.index)
+    matrices = {}
+    for sustancia, target_col in zip(sustancias, target_cols):
+        df_test_encoded_model = modelos[sustancia][0]
+        df_indice[target_col] = df_test[target_col]
+        df_indice[f'Modelo {sustancia}'] = df_indice.index.isin(df_test_encoded_model.index)
+        # Los perfiles sin nivel de riesgo conocido no pasan por el modelo y quedan con ceros
+        matrices[sustancia] = df_test_encoded_model.reindex(df_indice.index, fill_value=0).to_numpy(dtype=np.float32)
+    df_indice['Error'] = ''
+    return [(df_indice, (matrices, {sustancia: list(modelos[sustancia][0].columns) for sustancia in sustancias}))]
+
+
+def actualizar_almacen(ruta_entrada, directorio=ruta_almacen, col_paciente='Paciente', lote=5000, reconstruir=False):
+    # Codificar solo los pacientes nuevos o con respuestas distintas a las almacenadas; el resto conserva sus variables
+    load_dotenv()
+    target_cols = [os.getenv("TARGET_COL_CANNABIS"), os.getenv("TARGET_COL_PSILOCIBINA")]
+    inicio = perf_counter()
+
+    df_entrada = pd.read_csv(ruta_entrada, dtype=str, keep_default_na=False)
+    if df_entrada[col_paciente].duplicated().any():
+        raise ValueError(f'La columna {col_paciente} tiene pacientes repetidos: {df_entrada.loc[df_entrada[col_paciente].duplicated(), col_paciente].head().tolist()}')
+    pacientes = df_entrada[col_paciente].tolist()
+    perfiles = get_perfiles(df_entrada)
+    huellas = [calcular_huella_perfil(perfil) for perfil in perfiles]
+
+    version = cargar_version(os.getenv("USAR_TABLA_DECISION", "1") == "1")
+    huella_codificacion = calcular_huella_codificacion(version.reglas)
+    almacen = None if reconstruir else cargar_almacen(directorio)
+
+    # Los niveles de riesgo, las filas que pasan por cada modelo y sus columnas dependen de las reglas y de los datos de entrenamiento:
+    # si cambiaron, el almacén se reconstruye por completo. Un cambio solo de los modelos no obliga a volver a codificar.
+    if almacen is not None and almacen[0].get('Huella Codificación') != huella_codificacion:
+        print(f'Las reglas o las columnas de los datos de entrenamiento cambiaron ({almacen[0].get("Huella Codificación")} -> {huella_codificacion}): se reconstruye el almacén')
+        almacen = None
+
+    # Codificar los perfiles pendientes por lotes
+    if almacen is not None:
+        esquema, df_pacientes, matrices = almacen
+        huellas_almacenadas = dict(zip(df_pacientes['Paciente'], df_pacientes['Huella']))
+        pendientes = [i for i, (paciente, huella) in enumerate(zip(pacientes, huellas)) if huellas_almacenadas.get(paciente) != huella]
+    else:
+        pendientes = list(range(len(perfiles)))
+
+    indices, bloques, columnas = [], {sustancia: [] for sustancia in sustancias}, None
+
+    # Los perfiles con respuestas no válidas no se codifican y quedan con el error de validación, como en 'puntuacion_lotes.py'
+    _, errores = validar_perfiles([perfiles[i] for i in pendientes])
+    if errores:
+        filas_error = [pendientes[i] for i in errores]
+        indices.append(pd.DataFrame({'Error': [json.dumps(errores[i], ensure_ascii=False) for i in errores]}, index=filas_error))
+        for sustancia in sustancias:
+            bloques[sustancia].append(None)
+        pendientes = [i for posicion, i in enumerate(pendientes) if posicion not in errores]
+
+    for posicion in range(0, len(pendientes), lote):
+        filas = pendientes[posicion:posicion + lote]
+        desplazamiento = 0
+        for df_indice, codificacion in codificar_perfiles([perfiles[i] for i in filas], version, target_cols):
+            df_indice.index = filas[desplazamiento:desplazamiento + len(df_indice)]
+            desplazamiento += len(df_indice)
+            indices.append(df_indice)
+            if codificacion is None:
+                for sustancia in sustancias:
+                    bloques[sustancia].append(None)
+                continue
+            matrices_lote, columnas = codificacion
+            for sustancia in sustancias:
+                bloques[sustancia].append(matrices_lote[sustancia])
+
+    # Si las columnas de los datos de entrenamiento cambiaron (ver 'ingesta.py'), el almacén se reconstruye por completo
+    if almacen is not None and columnas is not None and columnas != esquema['Columnas']:
+        print('Las columnas de los datos de entrenamiento cambiaron: se reconstruye el almacén')
+        return actualizar_almacen(ruta_entrada, directorio, col_paciente, lote, reconstruir=True)
+    if columnas is None:
+        if almacen is None:
+            raise ValueError('No se pudo codificar ningún perfil de la entrada')
+        columnas = esquema['Columnas']
+
+    # Los perfiles con error quedan sin nivel de riesgo, sin variables (ceros) y sin modelo
+    df_nuevos = pd.concat(indices) if indices else pd.DataFrame()
+    df_nuevos = df_nuevos.reindex(columns=[*target_cols, *[f'Modelo {sustancia}' for sustancia in sustancias], 'Error'])
+    df_nuevos[target_cols] = df_nuevos[target_cols].fillna('')
+    df_nuevos.insert(0, 'Paciente', [pacientes[i] for i in df_nuevos.index])
+    df_nuevos.insert(1, 'Huella', [huellas[i] for i in df_nuevos.index])
+    for sustancia in sustancias:
+        bloques[sustancia] = [np.zeros((len(df_indice), len(columnas[sustancia])), dtype=np.float32) if bloque is None else bloque
+                              for df_indice, bloque in zip(indices, bloques[sustancia])]
+        df_nuevos[f'Modelo {sustancia}'] = df_nuevos[f'Modelo {sustancia}'].eq(True)
+
+    # Conservar el orden de la entrada (los perfiles con errores de validación se agregaron primero)
+    orden = np.argsort(df_nuevos.index.to_numpy(), kind='stable')
+    df_nuevos = df_nuevos.iloc[orden]
+    matrices_nuevas = {sustancia: np.concatenate(bloques[sustancia])[orden] if bloques[sustancia] else np.zeros((0, len(columnas[sustancia])), dtype=np.float32)
+                       for sustancia in sustancias}
+
+    # Reemplazar las filas de los pacientes que cambiaron y agregar los nuevos al final
+    if almacen is not None:
+        posiciones = {paciente: i for i, paciente in enumerate(df_pacientes['Paciente'])}
+        cambiados = df_nuevos['Paciente'].map(posiciones)
+        es_nuevo = cambiados.isna().to_numpy()
+        df_pacientes = df_pacientes.copy()
+        df_pacientes.iloc[cambiados[~es_nuevo].astype(int).to_numpy()] = df_nuevos[~es_nuevo].to_numpy()
+        df_pacientes = pd.concat([df_pacientes, df_nuevos[es_nuevo]], ignore_index=True)
+        for sustancia in sustancias:
+            matriz_nueva = matrices_nuevas[sustancia]
+            matriz = np.array(matrices[sustancia])
+            matriz[cambiados[~es_nuevo].astype(int).to_numpy()] = matriz_nueva[~es_nuevo]
+            matrices[sustancia] = np.concatenate([matriz, matriz_nueva[es_nuevo]])
+    else:
+        es_nuevo = np.ones(len(df_nuevos), dtype=bool)
+        df_pacientes = df_nuevos.reset_index(drop=True)
+        matrices = matrices_nuevas
+
+    # Guardar las matrices y el índice antes del esquema, que es lo último que se reemplaza
+    os.makedirs(directorio, exist_ok=True)
+    for sustancia in sustancias:
+        def escribir(ruta_temporal, matriz=matrices[sustancia]):
+            with open(ruta_temporal, 'wb') as archivo:
+                np.save(archivo, matriz)
+        guardar_atomico(get_ruta_matriz(directorio, sustancia), escribir)
+    guardar_atomico(os.path.join(directorio, 'pacientes.csv'), lambda ruta_temporal: df_pacientes.to_csv(ruta_temporal, index=False))
+
+    esquema = {
+        'Versión Esquema': version_esquema,
+        'Huella Codificación': huella_codificacion,
+        'Pacientes': len(df_pacientes),
+        'Columnas': columnas,
+        'Actualizado': datetime.now().isoformat(timespec='seconds')
+    }
+
+    def escribir_esquema(ruta_temporal):
+        with open(ruta_temporal, 'w', encoding='utf-8') as archivo:
+            json.dump(esquema, archivo, ensure_ascii=False, indent=2)
+    guardar_atomico(os.path.join(directorio, 'esquema.json'), escribir_esquema)
+
+    return {
+        'Pacientes': len(df_pacientes),
+        'Codificados': len(df_nuevos),
+        'Nuevos': int(es_nuevo.sum()),
+        'Actualizados': int((~es_nuevo).sum()),
+        'Errores': int((df_nuevos['Error'] != '').sum()),
+        'Tiempo (s)': round(perf_counter() - inicio, 3)
+    }
+
+
+def puntuar_almacen(modelos, directorio=ruta_almacen, lote=100000):
+    # Puntuar todos los pacientes almacenados con los modelos indicados, sin repetir el preprocesamiento
+    almacen = cargar_almacen(directorio)
+    if almacen is None:
+        raise ValueError(f'No existe un almacén en {directorio}')
+    esquema, df_pacientes, matrices = almacen
+    if esquema['Versión Esquema'] != version_esquema:
+        raise ValueError(f'El almacén tiene la versión de esquema {esquema["Versión Esquema"]} y se requiere la {version_esquema}: se debe reconstruir')
+    huella_codificacion = calcular_huella_codificacion()
+    if esquema.get('Huella Codificación') != huella_codificacion:
+        raise ValueError(f'El almacén se codificó con otras reglas o datos de entrenamiento ({esquema.get("Huella Codificación")}, actual {huella_codificacion}): se debe actualizar')
+
+    df_resultados = df_pacientes[['Paciente']].copy()
+    for sustancia, modelo in modelos.items():
+        columnas = esquema['Columnas'][sustancia]
+        columnas_modelo = list(getattr(modelo, 'feature_names_in_', columnas))
+        faltantes = [col for col in columnas_modelo if col not in columnas]
+        if faltantes:
+            raise ValueError(f'El modelo de {sustancia} usa columnas que no están en el almacén ({faltantes[:5]}): se debe reconstruir con los datos de entrenamiento nuevos')
+        posiciones_columnas = [columnas.index(col) for col in columnas_modelo]
+
+        filas = np.flatnonzero(df_pacientes[f'Modelo {sustancia}'].to_numpy())
+        y_pred = np.zeros(len(df_pacientes), dtype=int)
+        for inicio in range(0, len(filas), lote):
+            filas_lote = filas[inicio:inicio + lote]
+            X = pd.DataFrame(matrices[sustancia][filas_lote][:, posiciones_columnas], columns=columnas_modelo)
+            y_pred[filas_lote] = modelo.predict(X)
+        # Los perfiles con error no tienen predicción
+        df_resultados[f'Predicción Modelo Gradient Boosting {sustancia}'] = np.where(df_pacientes['Error'] == '', map_values(y_pred), None)
+    return df_resultados
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Almacén de variables codificadas por paciente para volver a puntuar sin repetir el preprocesamiento.')
+    parser.add_argument('accion', choices=['actualizar', 'puntuar'])
+    parser.add_argument('--entrada', help='CSV con la columna del paciente y las columnas de los perfiles (para actualizar)')
+    parser.add_argument('--directorio', default=ruta_almacen)
+    parser.add_argument('--paciente', default='Paciente', help='Columna que identifica a cada paciente')
+    parser.add_argument('--lote', type=int, default=5000)
+    parser.add_argument('--reconstruir', action='store_true', help='Volver a codificar todos los perfiles de la entrada')
+    parser.add_argument('--modelo-cannabis', default=ruta_modelo_cannabis)
+    parser.add_argument('--modelo-psilocibina', default=ruta_modelo_psilocibina)
+    parser.add_argument('--salida', help='Ruta del CSV con las predicciones (para puntuar)')
+    args = parser.parse_args()
+
+    if args.accion == 'actualizar':
+        if args.entrada is None:
+            parser.error('Se debe indicar --entrada para actualizar el almacén')
+        print(json.dumps(actualizar_almacen(args.entrada, args.directorio, args.paciente, args.lote, args.reconstruir), ensure_ascii=False, indent=2))
+
+    else:
+        inicio = perf_counter()
+        df_resultados = puntuar_almacen({'Cannabis': load(args.modelo_cannabis), 'Psilocibina': load(args.modelo_psilocibina)}, args.directorio)
+        print(f'{len(df_resultados)} pacientes puntuados en {perf_counter() - inicio:.3f} s')
+        if args.salida:
+            df_resultados.to_csv(args.salida, index=False)
+            print(f'Predicciones guardadas en {args.salida}')
@@ -0,0 +1,209 @@
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlparse
+
+import numpy as np
+
+from test_data import generar_perfiles_sinteticos, sujeto1, sujeto2, sujeto3, sujeto4, sujeto5, sujeto6, sujeto7, sujeto8, sujeto9, sujeto10
+
+
+sujetos = [sujeto1, sujeto2, sujeto3, sujeto4, sujeto5, sujeto6, sujeto7, sujeto8, sujeto9, sujeto10]
+
+
+def iniciar_servidor(directorio, puerto, entorno=None):
+    # Iniciar la API con uvicorn en un proceso separado (un solo worker), desde el directorio API de la versión a medir
+    proceso = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(puerto), '--log-level', 'warning'],
+        cwd=directorio, env={**os.environ, **(entorno or {})}, stdout=subprocess.DEVNULL
+    )
+    url = f'http://127.0.0.1:{puerto}'
+    esperar_servidor(url, proceso)
+    return proceso, url
+
+
+def esperar_servidor(url, proceso=None, tiempo_maximo=120):
+    destino = urlparse(url)
+    limite = time.monotonic() + tiempo_maximo
+    while time.monotonic() < limite:
+        if proceso is not None and proceso.poll() is not None:
+            raise RuntimeError('El servidor terminó antes de quedar disponible')
+        try:
+            conexion = http.client.HTTPConnection(destino.hostname, destino.port, timeout=2)
+            conexion.request('GET', '/')
+            if conexion.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError(f'El servidor {url} no respondió en {tiempo_maximo} s')
+
+
+def enviar_solicitud(conexion, cuerpo):
+    inicio = time.perf_counter()
+    conexion.request('POST', '/predict-risk', body=cuerpo, headers={'Content-Type': 'application/json'})
+    respuesta = conexion.getresponse()
+    respuesta.read()
+    return time.perf_counter() - inicio, respuesta.status
+
+
+def ejecutar_punto(url, perfiles, concurrencia, lote, duracion):
+    # Cada cliente mantiene una conexión y envía solicitudes de forma continua durante 'duracion' segundos
+    destino = urlparse(url)
+    latencias, errores = [], []
+    lock = threading.Lock()
+    limite = time.perf_counter() + duracion
+
+    def cliente(numero):
+        conexion = http.client.HTTPConnection(destino.hostname, destino.port, timeout=60)
+        latencias_cliente, errores_cliente = [], 0
+        i = numero * lote
+        while time.perf_counter() < limite:
+            cuerpo = json.dumps({'data_to_predict': [perfiles[(i + j) % len(perfiles)] for j in range(lote)]})
+            i += lote * concurrencia
+            try:
+                latencia, estado = enviar_solicitud(conexion, cuerpo)
+                if estado == 200:
+                    latencias_cliente.append(latencia)
+                else:
+                    errores_cliente += 1
+            except (OSError, http.client.HTTPException):
+                errores_cliente += 1
+                conexion.close()
+                conexion = http.client.HTTPConnection(destino.hostname, destino.port, timeout=60)
+        conexion.close()
+        with lock:
+            latencias.extend(latencias_cliente)
+            errores.append(errores_cliente)
+
+    inicio = time.perf_counter()
+    clientes = [threading.Thread(target=cliente, args=(numero,)) for numero in range(concurrencia)]
+    for hilo in clientes:
+        hilo.start()
+    for hilo in clientes:
+        hilo.join()
+    duracion_real = time.perf_counter() - inicio
+
+    latencias_ms = np.array(latencias) * 1000
+    return {
+        'Concurrencia': concurrencia,
+        'Lote': lote,
+        'Solicitudes': len(latencias),
+        'Errores': sum(errores),
+        'Solicitudes por Segundo': round(len(latencias) / duracion_real, 2),
+        'Perfiles por Segundo': round(len(latencias) * lote / duracion_real, 2),
+        'p50 (ms)': round(float(np.percentile(latencias_ms, 50)), 2) if len(latencias_ms) else None,
+        'p90 (ms)': round(float(np.percentile(latencias_ms, 90)), 2) if len(latencias_ms) else None,
+        'p99 (ms)': round(float(np.percentile(latencias_ms, 99)), 2) if len(latencias_ms) else None
+    }
+
+
+def barrer(url, perfiles, concurrencias, lotes, duracion, calentamiento=2):
+    resultados = []
+    for lote in lotes:
+        # Calentar el servidor antes de cada tamaño de lote
+        ejecutar_punto(url, perfiles, 1, lote, calentamiento)
+        for concurrencia in concurrencias:
+            resultado = ejecutar_punto(url, perfiles, concurrencia, lote, duracion)
+            print(formatear_punto(resultado), flush=True)
+            resultados.append(resultado)
+    return resultados
+
+
+def formatear_punto(resultado):
+    return (f'{resultado["Concurrencia"]:>12} {resultado["Lote"]:>5} {resultado["Solicitudes por Segundo"]:>10} {resultado["Perfiles por Segundo"]:>10} '
+            f'{resultado["p50 (ms)"]!s:>9} {resultado["p90 (ms)"]!s:>9} {resultado["p99 (ms)"]!s:>9} {resultado["Errores"]:>8}')
+
+
+def comparar(ruta_a, ruta_b):
+    # Comparar dos barridos (por ejemplo, dos versiones de la API) en los puntos de concurrencia y lote que tienen en común
+    with open(ruta_a, encoding='utf-8') as archivo:
+        reporte_a = json.load(archivo)
+    with open(ruta_b, encoding='utf-8') as archivo:
+        reporte_b = json.load(archivo)
+
+    puntos_b = {(punto['Concurrencia'], punto['Lote']): punto for punto in reporte_b['Resultados']}
+    lineas = [f'A: {reporte_a.get("Etiqueta")} ({ruta_a})', f'B: {reporte_b.get("Etiqueta")} ({ruta_b})',
+              f'{"Concurrencia":>12} {"Lote":>5} {"Sol/s A":>9} {"Sol/s B":>9} {"Cambio":>8} {"p50 A":>8} {"p50 B":>8} {"p99 A":>8} {"p99 B":>8} {"Cambio p99":>10}']
+    for punto_a in reporte_a['Resultados']:
+        punto_b = puntos_b.get((punto_a['Concurrencia'], punto_a['Lote']))
+        if punto_b is None:
+            continue
+        cambio = (punto_b['Solicitudes por Segundo'] / punto_a['Solicitudes por Segundo'] - 1) * 100 if punto_a['Solicitudes por Segundo'] else float('nan')
+        cambio_p99 = (punto_b['p99 (ms)'] / punto_a['p99 (ms)'] - 1) * 100 if punto_a['p99 (ms)'] and punto_b['p99 (ms)'] else float('nan')
+        lineas.append(f'{punto_a["Concurrencia"]:>12} {punto_a["Lote"]:>5} {punto_a["Solicitudes por Segundo"]:>9} {punto_b["Solicitudes por Segundo"]:>9} {cambio:>7.1f}% '
+                      f'{punto_a["p50 (ms)"]!s:>8} {punto_b["p50 (ms)"]!s:>8} {punto_a["p99 (ms)"]!s:>8} {punto_b["p99 (ms)"]!s:>8} {cambio_p99:>9.1f}%')
+    return '\n'.join(lineas)
+
+
+def graficar(resultados, ruta):
+    # Importación diferida: matplotlib solo está en las dependencias de investigación
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    figura, ejes = plt.subplots(figsize=(8, 5))
+    for lote in sorted({resultado['Lote'] for resultado in resultados}):
+        puntos = [resultado for resultado in resultados if resultado['Lote'] == lote]
+        rendimiento = [punto['Perfiles por Segundo'] for punto in puntos]
+        ejes.plot(rendimiento, [punto['p50 (ms)'] for punto in puntos], marker='o', label=f'p50 lote {lote}')
+        ejes.plot(rendimiento, [punto['p99 (ms)'] for punto in puntos], marker='x', linestyle='--', label=f'p99 lote {lote}')
+    ejes.set_xlabel('Perfiles por segundo')
+    ejes.set_ylabel('Latencia (ms)')
+    ejes.set_title('Latencia vs rendimiento de /predict-risk')
+    ejes.legend()
+    figura.savefig(ruta, bbox_inches='tight')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prueba de carga de /predict-risk con barrido de concurrencia y tamaño de lote.')
+    parser.add_argument('--url', help='URL de una API ya iniciada; si no se indica, se inicia una con uvicorn')
+    parser.add_argument('--directorio', default=os.path.dirname(os.path.abspath(__file__)), help='Directorio API de la versión a iniciar')
+    parser.add_argument('--puerto', type=int, default=8765)
+    parser.add_argument('--entorno', action='append', default=[], metavar='VARIABLE=VALOR', help='Variables de entorno para la API iniciada (ej. USAR_TABLA_DECISION=0)')
+    parser.add_argument('--concurrencias', default='1,2,4,8,16')
+    parser.add_argument('--lotes', default='1,10', help='Cantidad de perfiles por solicitud')
+    parser.add_argument('--duracion', type=float, default=10, help='Segundos por punto del barrido')
+    parser.add_argument('--perfiles', type=int, default=500, help='Cantidad de perfiles sintéticos (además de los sujetos de prueba)')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--etiqueta', default='', help='Nombre de la versión medida, para la comparación')
+    parser.add_argument('--salida', help='Ruta del archivo JSON donde guardar el barrido')
+    parser.add_argument('--grafico', help='Ruta de la imagen con las curvas de latencia vs rendimiento (requiere matplotlib)')
+    parser.add_argument('--comparar', nargs=2, metavar=('BARRIDO_A', 'BARRIDO_B'), help='Comparar dos barridos guardados y terminar')
+    args = parser.parse_args()
+
+    if args.comparar:
+        print(comparar(*args.comparar))
+        sys.exit(0)
+
+    perfiles = sujetos + generar_perfiles_sinteticos(args.perfiles, semilla=args.semilla)
+    concurrencias = [int(valor) for valor in args.concurrencias.split(',')]
+    lotes = [int(valor) for valor in args.lotes.split(',')]
+
+    proceso = None
+    url = args.url
+    if url is None:
+        proceso, url = iniciar_servidor(args.directorio, args.puerto, dict(variable.split('=', 1) for variable in args.entorno))
+
+    try:
+        print(f'{"Concurrencia":>12} {"Lote":>5} {"Sol/s":>10} {"Perfiles/s":>10} {"p50 (ms)":>9} {"p90 (ms)":>9} {"p99 (ms)":>9} {"Errores":>8}')
+        resultados = barrer(url, perfiles, concurrencias, lotes, args.duracion)
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            proceso.wait()
+
+    reporte = {'Etiqueta': args.etiqueta, 'Fecha': datetime.now().isoformat(timespec='seconds'), 'URL': url, 'Directorio': None if args.url else args.directorio, 'Entorno': args.entorno,
+               'Duración por Punto (s)': args.duracion, 'Perfiles': len(perfiles), 'Resultados': resultados}
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            json.dump(reporte, archivo, ensure_ascii=False, indent=2)
+        print(f'Barrido guardado en {args.salida}')
+    if args.grafico:
+        graficar(resultados, args.grafico)
+        print(f'Gráfico guardado en {args.grafico}')
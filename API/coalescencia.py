@@ -0,0 +1,74 @@
+import json
+import threading
+from concurrent.futures import Future
+
+from definitions import columnas_df, columnas_categoricas
+
+
+# Posición de las preguntas de selección múltiple dentro de cada perfil
+indices_categoricas = [columnas_df.index(col) for col in columnas_categoricas]
+
+
+def normalizar_perfiles(list_data):
+    # Generar una clave equivalente para perfiles que producen exactamente la misma predicción.
+    # El orden y las repeticiones de las opciones de selección múltiple no afectan la codificación One Hot.
+    perfiles = []
+    for perfil in list_data:
+        perfil = list(perfil)
+        for i in indices_categoricas:
+            if i < len(perfil) and isinstance(perfil[i], str):
+                perfil[i] = ';'.join(sorted(set(perfil[i].split(';'))))
+        perfiles.append(perfil)
+    return json.dumps(perfiles, ensure_ascii=False, sort_keys=True, default=str)
+
+
+class CoalescedorSolicitudes:
+    # Agrupa las solicitudes idénticas que llegan al mismo tiempo para que el cálculo se haga una sola vez.
+    # La primera solicitud calcula el resultado y las solicitudes concurrentes con la misma clave esperan el mismo Future.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.en_vuelo = {}
+        self.solicitudes = 0
+        self.calculadas = 0
+        self.coalescidas = 0
+        self.errores = 0
+
+    def ejecutar(self, clave, funcion, *args):
+        with self.lock:
+            self.solicitudes += 1
+            future = self.en_vuelo.get(clave)
+            es_lider = future is None
+            if es_lider:
+                future = Future()
+                self.en_vuelo[clave] = future
+                self.calculadas += 1
+            else:
+                self.coalescidas += 1
+
+        if not es_lider:
+            return future.result()
+
+        try:
+            future.set_result(funcion(*args))
+        except Exception as e:
+            with self.lock:
+                self.errores += 1
+            future.set_exception(e)
+        finally:
+            # Las solicitudes que lleguen después de terminar el cálculo generan uno nuevo
+            with self.lock:
+                del self.en_vuelo[clave]
+
+        return future.result()
+
+    def get_metricas(self):
+        with self.lock:
+            return {
+                'Solicitudes': self.solicitudes,
+                'Calculadas': self.calculadas,
+                'Coalescidas': self.coalescidas,
+                'Errores': self.errores,
+                'En Vuelo': len(self.en_vuelo),
+                'Porcentaje Ahorrado': round(self.coalescidas / self.solicitudes * 100, 2) if self.solicitudes else 0.0
+            }
@@ -0,0 +1,160 @@
+import argparse
+import copy
+import io
+import json
+import os
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+from joblib import dump, load
+from dotenv import load_dotenv
+
+from ingesta import guardar_atomico
+from utils import setup_training_data
+from versiones import ruta_datos_cannabis, ruta_datos_psilocibina, ruta_modelo_cannabis, ruta_modelo_psilocibina, ruta_modelo_compacto_cannabis, ruta_modelo_compacto_psilocibina
+
+
+ruta_reporte_compactacion = '../modelos/reporte_compactacion.json'
+
+# Variantes evaluadas: fracción de etapas que se conservan del modelo original, y profundidad y cantidad de etapas del modelo destilado
+fracciones_etapas = [0.25, 0.5, 0.75]
+parametros_destilacion = [{'max_depth': 2, 'n_estimators': 50}, {'max_depth': 2, 'n_estimators': 100}, {'max_depth': 3, 'n_estimators': 50}]
+
+# Repeticiones para medir la latencia de un perfil individual
+repeticiones_latencia = 200
+
+
+def podar_etapas(modelo, n_etapas):
+    # El Gradient Boosting suma las etapas en orden, por lo que conservar las primeras equivale a haber detenido el entrenamiento antes
+    variante = copy.deepcopy(modelo)
+    variante.estimators_ = variante.estimators_[:n_etapas]
+    variante.train_score_ = variante.train_score_[:n_etapas]
+    variante.n_estimators = n_etapas
+    variante.n_estimators_ = n_etapas
+    return variante
+
+
+def destilar(modelo, X_train, parametros, random_state):
+    # Entrenar un modelo menos profundo sobre las predicciones del modelo original en el conjunto de entrenamiento
+    from sklearn.ensemble import GradientBoostingClassifier
+
+    variante = GradientBoostingClassifier(**parametros, learning_rate=0.1, random_state=random_state)
+    variante.fit(X_train, modelo.predict(X_train))
+    return variante
+
+
+def medir_modelo(modelo, X_test, y_test, X_riesgo, y_pred_original=None, y_pred_original_completo=None):
+    from sklearn.metrics import accuracy_score
+
+    # Latencia de un perfil individual (como en '/predict-risk') y de todo el conjunto de prueba
+    perfil = X_test.iloc[[0]]
+    modelo.predict(perfil)
+    duraciones = []
+    for _ in range(repeticiones_latencia):
+        inicio = perf_counter()
+        modelo.predict(perfil)
+        duraciones.append(perf_counter() - inicio)
+
+    inicio = perf_counter()
+    y_pred = modelo.predict(X_test)
+    duracion_lote = perf_counter() - inicio
+
+    archivo = io.BytesIO()
+    dump(modelo, archivo)
+
+    # El conjunto de prueba es pequeño, por lo que el acuerdo también se mide sobre todos los perfiles codificados
+    y_pred_completo = modelo.predict(X_riesgo)
+
+    return y_pred, y_pred_completo, {
+        'Etapas': int(modelo.n_estimators_),
+        'Profundidad': int(modelo.max_depth),
+        'Tamaño (KB)': round(archivo.tell() / 1024, 1),
+        'Latencia Perfil p50 (ms)': round(float(np.median(duraciones)) * 1000, 3),
+        'Latencia Lote (ms / 1000 filas)': round(duracion_lote * 1000 / len(X_test) * 1000, 3),
+        'Accuracy Prueba': round(float(accuracy_score(y_test, y_pred)), 4),
+        'Acuerdo Modelo Original': round(float(np.mean(y_pred == y_pred_original)), 4) if y_pred_original is not None else 1.0,
+        'Acuerdo Datos Completos': round(float(np.mean(y_pred_completo == y_pred_original_completo)), 4) if y_pred_original_completo is not None else 1.0
+    }
+
+
+def compactar_sustancia(sustancia, ruta_datos, ruta_modelo, target_col, random_state, tolerancia_accuracy, acuerdo_minimo):
+    # Evaluar las variantes sobre el conjunto de prueba de 'setup_training_data' (el mismo de 'entrenamiento.py')
+    df_encoded = pd.read_csv(ruta_datos)
+    X_riesgo, _, X_train, X_test, y_train, y_test = setup_training_data(df_encoded, target_col, random_state)
+    modelo = load(ruta_modelo)
+
+    y_pred_original, y_pred_original_completo, metricas_original = medir_modelo(modelo, X_test, y_test, X_riesgo)
+
+    variantes = {f'Etapas {fraccion:.0%}': podar_etapas(modelo, max(1, int(modelo.n_estimators_ * fraccion))) for fraccion in fracciones_etapas}
+    for parametros in parametros_destilacion:
+        variantes[f'Destilado profundidad {parametros["max_depth"]}, {parametros["n_estimators"]} etapas'] = destilar(modelo, X_train, parametros, random_state)
+
+    # Una variante se acepta si no pierde más de la tolerancia de accuracy y coincide con el modelo original en la proporción mínima,
+    # tanto en el conjunto de prueba como en todos los perfiles codificados
+    resultados = {}
+    for nombre, variante in variantes.items():
+        _, _, metricas = medir_modelo(variante, X_test, y_test, X_riesgo, y_pred_original, y_pred_original_completo)
+        metricas['Aceptada'] = (metricas['Accuracy Prueba'] >= metricas_original['Accuracy Prueba'] - tolerancia_accuracy
+                                and metricas['Acuerdo Modelo Original'] >= acuerdo_minimo
+                                and metricas['Acuerdo Datos Completos'] >= acuerdo_minimo)
+        resultados[nombre] = metricas
+
+    # Entre las aceptadas, elegir la más pequeña: con tan pocas filas la latencia depende sobre todo del costo fijo de 'predict'
+    # y varía entre mediciones, mientras que el tamaño es proporcional a la cantidad de nodos que se recorren
+    aceptadas = [nombre for nombre, metricas in resultados.items() if metricas['Aceptada']]
+    elegida = min(aceptadas, key=lambda nombre: resultados[nombre]['Tamaño (KB)']) if aceptadas else None
+
+    resultado = {
+        'Sustancia': sustancia,
+        'Filas Prueba': len(X_test),
+        'Modelo Original': metricas_original,
+        'Variantes': resultados,
+        'Variante Elegida': elegida
+    }
+    return resultado, variantes.get(elegida)
+
+
+def formatear_fila(nombre, metricas):
+    return (f'{nombre:<40} {metricas["Etapas"]:>6} {metricas["Profundidad"]:>4} {metricas["Tamaño (KB)"]:>9} {metricas["Latencia Perfil p50 (ms)"]:>10} '
+            f'{metricas["Latencia Lote (ms / 1000 filas)"]:>10} {metricas["Accuracy Prueba"]:>9} {metricas["Acuerdo Modelo Original"]:>8} {metricas["Acuerdo Datos Completos"]:>9}  {"Sí" if metricas.get("Aceptada", True) else "No"}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Genera variantes compactas de los modelos y guarda, por sustancia, la más pequeña que conserve la precisión del modelo original.')
+    parser.add_argument('--tolerancia-accuracy', type=float, default=0.01, help='Pérdida máxima de accuracy en el conjunto de prueba respecto al modelo original')
+    parser.add_argument('--acuerdo-minimo', type=float, default=0.98, help='Proporción mínima de predicciones iguales a las del modelo original')
+    parser.add_argument('--reporte', default=ruta_reporte_compactacion)
+    parser.add_argument('--simular', action='store_true', help='Mostrar el reporte sin guardar los modelos compactos')
+    args = parser.parse_args()
+
+    load_dotenv()
+    sustancias = [
+        ('cannabis', ruta_datos_cannabis, ruta_modelo_cannabis, ruta_modelo_compacto_cannabis, os.getenv("TARGET_COL_CANNABIS"), int(os.getenv("RANDOM_STATE_CANNABIS"))),
+        ('psilocibina', ruta_datos_psilocibina, ruta_modelo_psilocibina, ruta_modelo_compacto_psilocibina, os.getenv("TARGET_COL_PSILOCIBINA"), int(os.getenv("RANDOM_STATE_PSILOCIBINA")))
+    ]
+
+    reporte = {'Fecha': datetime.now().isoformat(timespec='seconds'), 'Tolerancia Accuracy': args.tolerancia_accuracy, 'Acuerdo Mínimo': args.acuerdo_minimo, 'Sustancias': []}
+    for sustancia, ruta_datos, ruta_modelo, ruta_compacto, target_col, random_state in sustancias:
+        resultado, variante = compactar_sustancia(sustancia, ruta_datos, ruta_modelo, target_col, random_state, args.tolerancia_accuracy, args.acuerdo_minimo)
+
+        print(f'\n{sustancia} ({resultado["Filas Prueba"]} filas de prueba)')
+        print(f'{"Variante":<40} {"Etapas":>6} {"Prof":>4} {"KB":>9} {"Perfil ms":>10} {"ms/1000":>10} {"Accuracy":>9} {"Acuerdo":>8} {"Completos":>9}  Aceptada')
+        print(formatear_fila('Modelo original', resultado['Modelo Original']))
+        for nombre, metricas in resultado['Variantes'].items():
+            print(formatear_fila(nombre, metricas))
+
+        if variante is None:
+            print('Ninguna variante cumple la tolerancia; no se guarda un modelo compacto')
+        elif not args.simular:
+            # Con escritura atómica, la API y la vigilancia de artefactos nunca leen un modelo a medio escribir
+            guardar_atomico(ruta_compacto, lambda ruta_temporal: dump(variante, ruta_temporal))
+            resultado['Modelo Guardado'] = ruta_compacto
+            print(f'Variante elegida: {resultado["Variante Elegida"]}, guardada en {ruta_compacto}')
+        reporte['Sustancias'].append(resultado)
+
+    if not args.simular:
+        with open(args.reporte, 'w', encoding='utf-8') as archivo:
+            json.dump(reporte, archivo, ensure_ascii=False, indent=2)
+        print(f'\nReporte guardado en {args.reporte}')
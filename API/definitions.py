@@ -19,6 +19,7 @@ dict_renombrar_respuestas = {
     'Historial Familiar_Adicción a medicamentos recetados': 'Historial Familiar_Adicción Medicamentos Recetados',
     'Historial Familiar_Adicción al alcohol': 'Historial Familiar_Adicción Alcohol',
     'Historial Familiar_Trastorno Bipolar (I, II)': 'Historial Familiar_Trastorno Bipolar',
+    'Historial Familiar_Trastorno Bipolar (I , II)': 'Historial Familiar_Trastorno Bipolar',
     'Historial Familiar_No hay condiciones relevantes en mi familia': 'Historial Familiar_Sin Condición Relevante',
     'Condición_Adicción a juegos o apuestas': 'Condición_Adicción Juegos o Apuestas',
     'Condición_Adicción a la nicotina': 'Condición_Adicción Nicotina',
@@ -26,6 +27,7 @@ dict_renombrar_respuestas = {
     'Condición_Adicción a medicamentos recetados': 'Condición_Adicción Medicamentos Recetados',
     'Condición_Adicción al alcohol': 'Condición_Adicción Alcohol',
     'Condición_Trastorno Bipolar (I, II)': 'Condición_Trastorno Bipolar',
+    'Condición_Trastorno Bipolar (I , II)': 'Condición_Trastorno Bipolar',
     'Condición_No sufro de ninguna condición relevante': 'Condición_Sin Condición Relevante',
     'Efectos Positivos Cannabis_Alivio de dolores crónicos': 'Efectos Positivos Cannabis_Alivio Dolores Crónicos',
     'Efectos Positivos Cannabis_Aumento de apetito': 'Efectos Positivos Cannabis_Aumento Apetito',
@@ -89,6 +91,14 @@ dict_encoder_cantidad_tratamientos = {
     "Más de tres": 3
 }
 
+dict_encoder_duracion_microdosis = {
+    "Sin Dato": 0,
+    "Menos de un mes": 1,
+    "1-3 meses": 2,
+    "3-6 meses": 3,
+    "Otros": 4
+}
+
 
 # Diccionarios de mapeo para codificar el nivel de riesgo del tratamiento
 dict_encoder_riesgo_tratamiento = {
@@ -104,3 +114,95 @@ dict_encoder_riesgo_tres_niveles = {
     "Riesgo Alto": 3
 }
 
+
+
+# Opciones de respuesta validas para cada pregunta del perfil (las preguntas de selección múltiple separan sus opciones con ';')
+opciones_frecuencia = ['Diario', 'Varias veces a la semana', 'Cada semana', 'Varias veces al mes', 'Cada mes', 'Varias veces al año', 'Cada año', 'N/A']
+opciones_proposito = ['Fines recreativos', 'Fines terapéuticos', 'Ambos', 'N/A']
+opciones_si_no = ['Si', 'No', 'N/A']
+
+# Respuestas que equivalen a no responder la pregunta (además de los valores nulos); el preprocesamiento las reemplaza por 'Sin Dato'
+respuestas_sin_dato = ['N/A', 'NA']
+
+opciones_condiciones = [
+    'Adicción a juegos o apuestas',
+    'Adicción a la nicotina',
+    'Adicción a las sustancias sintéticas o drogas ilegales',
+    'Adicción a medicamentos recetados',
+    'Adicción al alcohol',
+    'Demencia con cuerpos de Lewy',
+    'Enfermedad de Alzheimer',
+    'Epilepsia',
+    'Esquizofrenia',
+    'Psicosis',
+    'Paranoia',
+    'Trastorno Bipolar',
+    'Trastorno Bipolar (I, II)',
+    # Forma en que aparece la opción en la encuesta
+    'Trastorno Bipolar (I , II)',
+    'Trastorno Depresivo Mayor o Persistente',
+    'Trastorno de Ansiedad Generalizada (TAG)',
+    'Trastorno esquizoafectivo',
+    'Otros'
+]
+
+opciones_respuesta = {
+    'Frecuencia Cannabis': opciones_frecuencia,
+    'Frecuencia Psilocibina': opciones_frecuencia,
+    'Propósito Cannabis': opciones_proposito,
+    'Propósito Psilocibina': opciones_proposito,
+    'Dependencia Cannabis': opciones_si_no,
+    'Dependencia Psilocibina': opciones_si_no,
+    'Abuso Cannabis': opciones_si_no,
+    'Abuso Psilocibina': opciones_si_no,
+    'Cantidad Tratamientos': ['Uno', 'Dos', 'Más de tres', 'N/A'],
+    'Tipo de Dosis': ['Microdosis', 'Macrodosis', 'Ambos', 'No estoy seguro', 'N/A'],
+    'Sesiones Macrodosis': ['Una sesión de un día', '1-5 sesiones de un día', 'Más de 10 sesiones de un día', 'Otros', 'N/A'],
+    'Calificación Tratamiento': [1, 2, 3, 4, 5, 'N/A'],
+    'Historial Familiar': opciones_condiciones + ['No hay condiciones relevantes en mi familia'],
+    'Condición': opciones_condiciones + ['No sufro de ninguna condición relevante'],
+    'Efectos Positivos Cannabis': [
+        'Alivio de dolores crónicos',
+        'Aumento de apetito',
+        'Aumento de creatividad',
+        'Mejora del sueño',
+        'Mejora en el estado de animo',
+        'Mejora en el estado de ánimo',
+        'Mejora en la introspección / conexión con el ser',
+        'Reducción de ansiedad',
+        'Reducción de inflamación o espasmos',
+        'No tuvo ningún efecto positivo',
+        'Otros'
+    ],
+    'Efectos Negativos Cannabis': [
+        'Aislamiento',
+        'Falta de apetito',
+        'Problemas cognitivos',
+        'Problemas de memoria o atención',
+        'Problemas respiratorios',
+        'Psicosis',
+        'Trastornos del sueño',
+        'No tuvo ningún efecto negativo',
+        'Otros'
+    ],
+    'Efectos Positivos Psilocibina': [
+        'Alivio de dolores crónicos',
+        'Aumento de apetito',
+        'Aumento de introspección',
+        'Mayor sentido de propósito o satisfacción con la vida',
+        'Mejora del sueño',
+        'Reducción de ansiedad',
+        'Reducción de sintomas de depresión',
+        'Reducción de Sintomas de depresión',
+        'No tuvo ningún efecto positivo',
+        'Otros'
+    ],
+    'Efectos Negativos Psilocibina': [
+        'Cambios de humor',
+        'Intoxicación',
+        'Problemas de memoria o atención',
+        'Psicosis',
+        'No tuvo ningún efecto negativo',
+        'Otros'
+    ]
+}
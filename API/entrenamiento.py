@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+from datetime import datetime
+from time import perf_counter
+
+import pandas as pd
+from joblib import Memory, dump, load, cpu_count
+from dotenv import load_dotenv
+
+from ingesta import guardar_atomico
+from utils import setup_training_data, train_model
+from versiones import calcular_huella_artefactos, ruta_datos_cannabis, ruta_datos_psilocibina, ruta_modelo_cannabis, ruta_modelo_psilocibina
+
+
+# Directorio donde se guardan los conjuntos de entrenamiento y los folds de validación cruzada ya preparados
+ruta_cache_entrenamiento = '../.cache_entrenamiento'
+ruta_reporte_entrenamiento = '../modelos/reporte_entrenamiento.json'
+# Los modelos reentrenados se guardan aparte para evaluarlos (por ejemplo, en sombra) antes de reemplazar los de producción
+ruta_candidatos = '../modelos/candidatos'
+
+# Espacio de búsqueda de hiperparámetros del Gradient Boosting Classifier
+parametros_busqueda = {
+    'learning_rate': [0.05, 0.1, 0.2],
+    'max_depth': [3, 4, 5],
+    'n_estimators': [50, 100, 200],
+    'subsample': [0.8, 1.0]
+}
+
+memoria = Memory(ruta_cache_entrenamiento, verbose=0)
+
+
+@memoria.cache
+def preparar_datos_entrenamiento(ruta_datos, huella_datos, target_col, random_state, n_folds):
+    # La huella del archivo forma parte de la llave de la caché, por lo que un CSV modificado se vuelve a preparar
+    from sklearn.model_selection import StratifiedKFold
+
+    df_encoded = pd.read_csv(ruta_datos)
+    _, _, X_train, X_test, y_train, y_test = setup_training_data(df_encoded, target_col, random_state)
+
+    # Generar los folds de validación cruzada una sola vez para reutilizarlos en todas las búsquedas
+    folds = list(StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=random_state).split(X_train, y_train))
+
+    return X_train, X_test, y_train, y_test, folds
+
+
+def entrenar_sustancia(sustancia, ruta_datos, ruta_modelo_actual, target_col, random_state, n_folds, n_jobs):
+    from sklearn.model_selection import GridSearchCV
+    from sklearn.ensemble import GradientBoostingClassifier
+    from sklearn.metrics import accuracy_score
+
+    tiempos = {}
+    inicio = perf_counter()
+    X_train, X_test, y_train, y_test, folds = preparar_datos_entrenamiento(ruta_datos, calcular_huella_artefactos([ruta_datos]), target_col, random_state, n_folds)
+    tiempos['Preparación de Datos (s)'] = perf_counter() - inicio
+
+    # Búsqueda de hiperparámetros con los folds guardados
+    inicio = perf_counter()
+    busqueda = GridSearchCV(GradientBoostingClassifier(random_state=random_state), parametros_busqueda, cv=folds, scoring='accuracy', n_jobs=n_jobs)
+    busqueda.fit(X_train, y_train)
+    tiempos['Búsqueda (s)'] = perf_counter() - inicio
+
+    # Reentrenar el mejor modelo sobre todo el conjunto de entrenamiento
+    inicio = perf_counter()
+    modelo = train_model(X_train, y_train, 'Gradient Boosting Classifier', {**busqueda.best_params_, 'random_state': random_state})
+    tiempos['Entrenamiento Final (s)'] = perf_counter() - inicio
+
+    # Comparar con el modelo actual sobre el mismo conjunto de prueba (el modelo actual pudo haber visto estos datos al entrenarse)
+    accuracy_actual = None
+    if os.path.exists(ruta_modelo_actual):
+        try:
+            accuracy_actual = accuracy_score(y_test, load(ruta_modelo_actual).predict(X_test))
+        except Exception as e:
+            print(f'No se pudo evaluar el modelo actual de {sustancia}: {e}')
+
+    resultado = {
+        'Sustancia': sustancia,
+        'Mejores Parámetros': busqueda.best_params_,
+        'Accuracy Validación Cruzada': round(float(busqueda.best_score_), 4),
+        'Accuracy Prueba': round(float(accuracy_score(y_test, modelo.predict(X_test))), 4),
+        'Accuracy Prueba Modelo Actual': round(float(accuracy_actual), 4) if accuracy_actual is not None else None,
+        'Combinaciones Evaluadas': len(busqueda.cv_results_['params']),
+        'Folds': len(folds),
+        'Tiempos': {etapa: round(duracion, 3) for etapa, duracion in tiempos.items()}
+    }
+    return resultado, modelo
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reentrena los modelos de ambas sustancias en paralelo y guarda los mejores modelos.')
+    parser.add_argument('--salida', default=ruta_candidatos, help='Directorio donde guardar los modelos best_model_*.joblib. '
+                        'En el directorio de los modelos de producción solo se reemplazan los que mejoran la accuracy del modelo actual')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--n-jobs', type=int, default=-1, help='Núcleos disponibles para el entrenamiento (-1 para usar todos)')
+    parser.add_argument('--reporte', default=ruta_reporte_entrenamiento)
+    args = parser.parse_args()
+
+    load_dotenv()
+    sustancias = [
+        ('cannabis', ruta_datos_cannabis, ruta_modelo_cannabis, os.getenv("TARGET_COL_CANNABIS"), int(os.getenv("RANDOM_STATE_CANNABIS"))),
+        ('psilocibina', ruta_datos_psilocibina, ruta_modelo_psilocibina, os.getenv("TARGET_COL_PSILOCIBINA"), int(os.getenv("RANDOM_STATE_PSILOCIBINA")))
+    ]
+
+    # Las sustancias se entrenan una tras otra y cada búsqueda reparte sus combinaciones y folds en procesos con todos los núcleos.
+    # Un único nivel de paralelismo: dentro de un proceso de joblib, una búsqueda con n_jobs > 1 se ejecutaría en hilos.
+    nucleos = cpu_count() if args.n_jobs == -1 else args.n_jobs
+
+    inicio = perf_counter()
+    resultados = [
+        entrenar_sustancia(sustancia, ruta_datos, ruta_modelo, target_col, random_state, args.folds, nucleos)
+        for sustancia, ruta_datos, ruta_modelo, target_col, random_state in sustancias
+    ]
+    tiempo_total = perf_counter() - inicio
+
+    os.makedirs(args.salida, exist_ok=True)
+    reporte = {'Fecha': datetime.now().isoformat(timespec='seconds'), 'Núcleos': nucleos, 'Tiempo Total (s)': round(tiempo_total, 3), 'Sustancias': []}
+
+    for (resultado, modelo), (_, _, ruta_modelo_actual, _, _) in zip(resultados, sustancias):
+        ruta_modelo = os.path.join(args.salida, f'best_model_{resultado["Sustancia"]}.joblib')
+        # Con la vigilancia de artefactos activa, un modelo escrito en producción se activa automáticamente
+        reemplaza_actual = os.path.abspath(ruta_modelo) == os.path.abspath(ruta_modelo_actual)
+        if reemplaza_actual and resultado['Accuracy Prueba Modelo Actual'] is not None and resultado['Accuracy Prueba'] <= resultado['Accuracy Prueba Modelo Actual']:
+            resultado['Modelo Guardado'] = None
+        else:
+            # Con escritura atómica, la vigilancia de artefactos nunca lee un modelo a medio escribir
+            guardar_atomico(ruta_modelo, lambda ruta_temporal: dump(modelo, ruta_temporal))
+            resultado['Modelo Guardado'] = ruta_modelo
+
+        reporte['Sustancias'].append(resultado)
+        guardado = resultado['Modelo Guardado'] or 'no se guardó, no mejora al modelo actual'
+        print(f'{resultado["Sustancia"]}: accuracy prueba {resultado["Accuracy Prueba"]} (actual: {resultado["Accuracy Prueba Modelo Actual"]}), '
+              f'CV {resultado["Accuracy Validación Cruzada"]}, {resultado["Tiempos"]}, guardado en: {guardado}')
+
+    with open(args.reporte, 'w', encoding='utf-8') as archivo:
+        json.dump(reporte, archivo, ensure_ascii=False, indent=2)
+    print(f'Tiempo total: {tiempo_total:.1f} s. Reporte guardado en {args.reporte}')
@@ -26,417 +26,477 @@ def get_columns(df, cols, default_value=False):
 
 
 
-# Conjuntos de Reglas para Nivel de Riesgo - Cannabis
-def get_low_risk_cannabis(df_test):
-    riesgo_bajo_cannabis = (
-    (        
-        # El consumo de cannabis no es frecuente.
+# Instrumentación opcional de las reglas (ver 'perfil_reglas.py'). Si es None, las reglas se evalúan sin medición.
+instrumentacion_reglas = None
+
+
+# Evalúa una sub-regla con nombre, registrando su tiempo y sus coincidencias si la instrumentación está activa
+def evaluar_regla(nombre, regla, df_test):
+    if instrumentacion_reglas is None:
+        return regla(df_test)
+    return instrumentacion_reglas.medir_regla(nombre, regla, df_test)
+
+
+
+# Sub-reglas para Nivel de Riesgo Bajo - Cannabis
+def get_low_risk_cannabis_consumo_no_frecuente(df_test):
+    # El consumo de cannabis no es frecuente.
+    return (
+        (~df_test['Frecuencia Cannabis'].isin(['Diario', 'Varias veces por semana', 'Cada semana'])) &
+        (
             (
-                (~df_test['Frecuencia Cannabis'].isin(['Diario', 'Varias veces por semana', 'Cada semana'])) &
+                # No reporta dependencia a la sustancia ni consumo abusivo
                 (
-                    (
-                        # No reporta dependencia a la sustancia ni consumo abusivo
-                        (
-                            (df_test['Dependencia Cannabis'] == False) &
-                            (df_test['Abuso Cannabis'] == False)
-                        ) &
-                        # No presenta adicciones ni condiciones médicas riesgosas
-                        (
-                            get_columns(df_test, condiciones_medicas_adicciones).eq(False).all(axis=1) &
-                            get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1)
-                        )
-                    ) &
-                    # Ha experimentado efectos positivos con la sustancia y ningún efecto negativo determinante, como psicosis
-                    get_columns(df_test, efectos_positivos_cannabis).eq(True).any(axis=1) &
-                    get_columns(df_test, efectos_negativos_determinantes_cannabis).eq(False).all(axis=1) 
-                    
+                    (df_test['Dependencia Cannabis'] == False) &
+                    (df_test['Abuso Cannabis'] == False)
+                ) &
+                # No presenta adicciones ni condiciones médicas riesgosas
+                (
+                    get_columns(df_test, condiciones_medicas_adicciones).eq(False).all(axis=1) &
+                    get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1)
                 )
-            ) |
-            # El consumo de cannabis es frecuente pero ni el participante ni su familia cumplen con ninguna condición riesgosa ni moderada
+            ) &
+            # Ha experimentado efectos positivos con la sustancia y ningún efecto negativo determinante, como psicosis
+            get_columns(df_test, efectos_positivos_cannabis).eq(True).any(axis=1) &
+            get_columns(df_test, efectos_negativos_determinantes_cannabis).eq(False).all(axis=1) 
+            
+        )
+    )
+
+def get_low_risk_cannabis_consumo_frecuente(df_test):
+    # El consumo de cannabis es frecuente pero ni el participante ni su familia cumplen con ninguna condición riesgosa ni moderada
+    return (
+        (df_test['Frecuencia Cannabis'].isin(['Diario', 'Varias veces por semana', 'Cada semana'])) &
+        (
+            # No reporta dependencia a la sustancia ni consumo abusivo
+            (
+                (df_test['Dependencia Cannabis'] == False) &
+                (df_test['Abuso Cannabis'] == False)
+            ) &
+            # No presenta adicciones ni condiciones médicas riesgosas
+            (
+                get_columns(df_test, condiciones_medicas_adicciones).eq(False).all(axis=1) &
+                get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1)
+            ) &
+            # Su familia no presenta adicciones ni condiciones médicas riesgosas
+            (
+                get_columns(df_test, historial_familiar_adicciones).eq(False).all(axis=1) &
+                get_columns(df_test, historial_familiar_condiciones_riesgosas).eq(False).all(axis=1)
+            )
+        )
+    )
+
+def get_sin_condiciones_riesgo_cannabis(df_test):
+    # No presenta condiciones de riesgo
+    return (
+        get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1) &
+        (df_test['Dependencia Cannabis'] == False) 
+    )
+
+
+# Sub-reglas para Nivel de Riesgo Medio - Cannabis
+def get_medium_risk_cannabis_consumo_no_muy_frecuente(df_test):
+    # El consumo no es muy frecuente
+    return (
+        (~df_test['Frecuencia Cannabis'].isin(['Diario', 'Varias veces por semana'])) &
+
+        (     
             (
-                (df_test['Frecuencia Cannabis'].isin(['Diario', 'Varias veces por semana', 'Cada semana'])) &
-                (
                     # No reporta dependencia a la sustancia ni consumo abusivo
                     (
-                        (df_test['Dependencia Cannabis'] == False) &
+                        (df_test['Dependencia Cannabis'] == False) |
                         (df_test['Abuso Cannabis'] == False)
                     ) &
-                    # No presenta adicciones ni condiciones médicas riesgosas
+
+                    # No presenta adicciones, ni condiciones medicas riesgosas 
                     (
                         get_columns(df_test, condiciones_medicas_adicciones).eq(False).all(axis=1) &
-                        get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1)
-                    ) &
-                    # Su familia no presenta adicciones ni condiciones médicas riesgosas
-                    (
-                        get_columns(df_test, historial_familiar_adicciones).eq(False).all(axis=1) &
-                        get_columns(df_test, historial_familiar_condiciones_riesgosas).eq(False).all(axis=1)
-                    )
-                )
-            )
-        ) &
-        # No presenta condiciones de riesgo
-        (
-            get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1) &
-            (df_test['Dependencia Cannabis'] == False) 
-        )
-    )
-    
-    return riesgo_bajo_cannabis
-
-def get_medium_risk_cannabis(df_test):
-    riesgo_medio_cannabis = (
-    (            
-        # El consumo no es muy frecuente
-        (~df_test['Frecuencia Cannabis'].isin(['Diario', 'Varias veces por semana'])) &
+                        get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1) 
+                    ) |
 
-            (     
-                (
-                        # No reporta dependencia a la sustancia ni consumo abusivo
+                    # Alguien de su familia presenta una adicción o alguna condición riesgosa pero el participante no
+                    (
                         (
-                            (df_test['Dependencia Cannabis'] == False) |
-                            (df_test['Abuso Cannabis'] == False)
+                            get_columns(df_test, historial_familiar_condiciones_riesgosas).eq(True).any(axis=1) |
+                            get_columns(df_test, historial_familiar_adicciones).eq(True).any(axis=1) 
                         ) &
-
-                        # No presenta adicciones, ni condiciones medicas riesgosas 
                         (
                             get_columns(df_test, condiciones_medicas_adicciones).eq(False).all(axis=1) &
                             get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1) 
-                        ) |
+                        ) 
+                    )
+                ) &
 
-                        # Alguien de su familia presenta una adicción o alguna condición riesgosa pero el participante no
-                        (
-                            (
-                                get_columns(df_test, historial_familiar_condiciones_riesgosas).eq(True).any(axis=1) |
-                                get_columns(df_test, historial_familiar_adicciones).eq(True).any(axis=1) 
-                            ) &
-                            (
-                                get_columns(df_test, condiciones_medicas_adicciones).eq(False).all(axis=1) &
-                                get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1) 
-                            ) 
-                        )
-                    ) &
+                # Experimenta efectos positivos con la sustancia y ningún efecto negativo determinante, como psicosis
+                get_columns(df_test, efectos_positivos_cannabis).eq(True).any(axis=1) &
+                get_columns(df_test, efectos_negativos_determinantes_cannabis).eq(False).all(axis=1) 
+                
+        )
+    )
 
-                    # Experimenta efectos positivos con la sustancia y ningún efecto negativo determinante, como psicosis
-                    get_columns(df_test, efectos_positivos_cannabis).eq(True).any(axis=1) &
-                    get_columns(df_test, efectos_negativos_determinantes_cannabis).eq(False).all(axis=1) 
-                    
-                ) |
+def get_medium_risk_cannabis_consumo_frecuente(df_test):
+    # El consumo es frecuente pero no presenta condiciones riesgosas
+    return (
+        (df_test['Frecuencia Cannabis'].isin(['Diario', 'Varias veces por semana', 'Cada semana'])) &
 
-            # El consumo es frecuente pero no presenta condiciones riesgosas
-            (df_test['Frecuencia Cannabis'].isin(['Diario', 'Varias veces por semana', 'Cada semana'])) &
+        (
+            # No reporta dependencia a la sustancia ni consumo abusivo
+            (
+                (df_test['Dependencia Cannabis'] == False) &
+                (df_test['Abuso Cannabis'] == False)
+            ) &
 
+            # No presenta adicciones, ni condiciones medicas riesgosas 
+            (
+                get_columns(df_test, condiciones_medicas_adicciones).eq(False).all(axis=1) &
+                get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1) 
+            ) |
+
+            # Alguien de su familia presenta una adicción o alguna condición riesgosa pero el participante no
             (
-                # No reporta dependencia a la sustancia ni consumo abusivo
                 (
-                    (df_test['Dependencia Cannabis'] == False) &
-                    (df_test['Abuso Cannabis'] == False)
+                    get_columns(df_test, historial_familiar_condiciones_riesgosas).eq(True).any(axis=1) |
+                    get_columns(df_test, historial_familiar_adicciones).eq(True).any(axis=1) 
                 ) &
-
-                # No presenta adicciones, ni condiciones medicas riesgosas 
                 (
                     get_columns(df_test, condiciones_medicas_adicciones).eq(False).all(axis=1) &
                     get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1) 
-                ) |
-
-                # Alguien de su familia presenta una adicción o alguna condición riesgosa pero el participante no
-                (
-                    (
-                        get_columns(df_test, historial_familiar_condiciones_riesgosas).eq(True).any(axis=1) |
-                        get_columns(df_test, historial_familiar_adicciones).eq(True).any(axis=1) 
-                    ) &
-                    (
-                        get_columns(df_test, condiciones_medicas_adicciones).eq(False).all(axis=1) &
-                        get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1) 
-                    ) 
-                ) |
+                ) 
+            ) |
 
-                # Reporta consumo abusivo o dependencia a la sustancia pero nunca ha experimentado efectos negativos determinantes ni tiene condiciones riesgosas
+            # Reporta consumo abusivo o dependencia a la sustancia pero nunca ha experimentado efectos negativos determinantes ni tiene condiciones riesgosas
+            (
                 (
-                    (
-                        (df_test['Dependencia Cannabis'] == True) |
-                        (df_test['Abuso Cannabis'] == True)
-                    ) & 
-                    
-                    get_columns(df_test, efectos_negativos_determinantes_cannabis).eq(False).all(axis=1) &
-                    get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1) 
-                )
+                    (df_test['Dependencia Cannabis'] == True) |
+                    (df_test['Abuso Cannabis'] == True)
+                ) & 
+                
+                get_columns(df_test, efectos_negativos_determinantes_cannabis).eq(False).all(axis=1) &
+                get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1) 
+            )
 
-            )     
-        ) &
-        
-        # No presenta condiciones de riesgo
-        (
-            get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1) &
-            (df_test['Dependencia Cannabis'] == False) 
         )
-    
     )
 
-    return riesgo_medio_cannabis
 
-def get_high_risk_cannabis(df_test):
-    riesgo_alto_cannabis = (
-        # El consumo es frecuente y reporta condiciones riesgosas
-        (    
-            (df_test['Frecuencia Cannabis'].isin(['Diario', 'Varias veces a la semana', 'Cada semana'])) &
+# Sub-reglas para Nivel de Riesgo Alto - Cannabis
+def get_high_risk_cannabis_consumo_frecuente(df_test):
+    # El consumo es frecuente y reporta condiciones riesgosas
+    return (
+        (df_test['Frecuencia Cannabis'].isin(['Diario', 'Varias veces a la semana', 'Cada semana'])) &
 
+            (
+                # Reporta dependencia 
                 (
-                    # Reporta dependencia 
-                    (
-                        (df_test['Dependencia Cannabis'] == True) |
+                    (df_test['Dependencia Cannabis'] == True) |
 
-                        # Presenta efectos negativos moderados y adicciones o condiciones medicas riesgosas
-                        (
-                            get_columns(df_test, efectos_moderados_cannabis).eq(True).any(axis=1) &
-                            get_columns(df_test, condiciones_medicas_adicciones).eq(True).any(axis=1) |
-                            get_columns(df_test, condiciones_medicas_riesgosas).eq(True).any(axis=1) 
-                        ) |
+                    # Presenta efectos negativos moderados y adicciones o condiciones medicas riesgosas
+                    (
+                        get_columns(df_test, efectos_moderados_cannabis).eq(True).any(axis=1) &
+                        get_columns(df_test, condiciones_medicas_adicciones).eq(True).any(axis=1) |
+                        get_columns(df_test, condiciones_medicas_riesgosas).eq(True).any(axis=1) 
+                    ) |
 
-                        # Ha experimentado efectos negativos determinantes como psicosis y presenta condiciones riesgosas
-                        (
-                            get_columns(df_test, efectos_negativos_determinantes_cannabis).eq(True).any(axis=1) &
-                            get_columns(df_test, condiciones_medicas_riesgosas).eq(True).any(axis=1) 
-                        )
+                    # Ha experimentado efectos negativos determinantes como psicosis y presenta condiciones riesgosas
+                    (
+                        get_columns(df_test, efectos_negativos_determinantes_cannabis).eq(True).any(axis=1) &
+                        get_columns(df_test, condiciones_medicas_riesgosas).eq(True).any(axis=1) 
                     )
                 )
-        )  |
+            )
+    )
 
-        # El consumo no es muy frecuente
-        (    
-            (~df_test['Frecuencia Cannabis'].isin(['Diario', 'Varias veces a la semana', 'Cada semana'])) &
+def get_high_risk_cannabis_consumo_no_frecuente(df_test):
+    # El consumo no es muy frecuente
+    return (
+        (~df_test['Frecuencia Cannabis'].isin(['Diario', 'Varias veces a la semana', 'Cada semana'])) &
 
+            (
+                # Reporta dependencia o abuso
                 (
-                    # Reporta dependencia o abuso
+                    (df_test['Dependencia Cannabis'] == True) |
+                    (df_test['Abuso Cannabis'] == True)
+                ) &
+
                     (
-                        (df_test['Dependencia Cannabis'] == True) |
-                        (df_test['Abuso Cannabis'] == True)
-                    ) &
+                        # Presenta adicciones y su familia presenta adicciones, condiciones riesgosas o condiciones moderadas
+                        (   
+                            get_columns(df_test, condiciones_medicas_adicciones).eq(True).any(axis=1) &
+                            get_columns(df_test, historial_familiar_adicciones).eq(True).any(axis=1) |
+                            get_columns(df_test, historial_familiar_condiciones_riesgosas).eq(True).any(axis=1) 
+                        ) |
 
-                        (
-                            # Presenta adicciones y su familia presenta adicciones, condiciones riesgosas o condiciones moderadas
-                            (   
-                                get_columns(df_test, condiciones_medicas_adicciones).eq(True).any(axis=1) &
-                                get_columns(df_test, historial_familiar_adicciones).eq(True).any(axis=1) |
-                                get_columns(df_test, historial_familiar_condiciones_riesgosas).eq(True).any(axis=1) 
-                            ) |
-
-                            # Ha experimentado efectos negativos determinantes y presenta condiciones moderadas 
-                            # Y su familia presenta adicciones, condiciones riesgosas o condiciones moderadas
-                            (   
-                                get_columns(df_test, efectos_negativos_determinantes_cannabis).eq(True).any(axis=1) &
-                                get_columns(df_test, historial_familiar_adicciones).eq(True).any(axis=1) |
-                                get_columns(df_test, historial_familiar_condiciones_riesgosas).eq(True).any(axis=1) 
-                            )
-                        )      
-                ) |
-                # Reporta una condición riesgosa o ha experimentado un efecto negativo determinante
-                (
-                    get_columns(df_test, condiciones_medicas_riesgosas).eq(True).any(axis=1)  |
-                    get_columns(df_test, efectos_negativos_determinantes_cannabis).eq(True).any(axis=1)  
-                )
-        ) 
-    )  
+                        # Ha experimentado efectos negativos determinantes y presenta condiciones moderadas 
+                        # Y su familia presenta adicciones, condiciones riesgosas o condiciones moderadas
+                        (   
+                            get_columns(df_test, efectos_negativos_determinantes_cannabis).eq(True).any(axis=1) &
+                            get_columns(df_test, historial_familiar_adicciones).eq(True).any(axis=1) |
+                            get_columns(df_test, historial_familiar_condiciones_riesgosas).eq(True).any(axis=1) 
+                        )
+                    )      
+            )
+    )
+
+def get_high_risk_cannabis_condicion_determinante(df_test):
+    # Reporta una condición riesgosa o ha experimentado un efecto negativo determinante
+    return (
+        get_columns(df_test, condiciones_medicas_riesgosas).eq(True).any(axis=1)  |
+        get_columns(df_test, efectos_negativos_determinantes_cannabis).eq(True).any(axis=1)  
+    )
 
-    return riesgo_alto_cannabis  
 
 
 # Conjuntos de Reglas para Nivel de Riesgo - Cannabis
-def get_low_risk_psilocibina(df_test):
-    riesgo_bajo_psilocibina = (
-        (    
-            # Ha consumido psilocibina en macrodosis
-            (    
-                (df_test['Tipo de Dosis'] == 'Macrodosis') &
+def get_low_risk_cannabis(df_test):
+    riesgo_bajo_cannabis = (
+        (
+            evaluar_regla('Riesgo Bajo Cannabis - Consumo no frecuente', get_low_risk_cannabis_consumo_no_frecuente, df_test) |
+            evaluar_regla('Riesgo Bajo Cannabis - Consumo frecuente sin condiciones', get_low_risk_cannabis_consumo_frecuente, df_test)
+        ) &
+        evaluar_regla('Riesgo Bajo Cannabis - Sin condiciones de riesgo', get_sin_condiciones_riesgo_cannabis, df_test)
+    )
+    
+    return riesgo_bajo_cannabis
 
-                    (    
-                        (     
-                            # Ha realizado dos o más tratamiento 
-                            (
-                                (df_test['Cantidad Tratamientos'].isin(['Dos', 'Más de tres'])) &
-                                    (
-                                        # La calificación dada al tratamiento es de 4 o 5
-                                        (df_test['Calificación Tratamiento'].isin([4,5]))
-                                    )
-                            ) |
+def get_medium_risk_cannabis(df_test):
+    riesgo_medio_cannabis = (
+        (
+            evaluar_regla('Riesgo Medio Cannabis - Consumo no muy frecuente', get_medium_risk_cannabis_consumo_no_muy_frecuente, df_test) |
+            evaluar_regla('Riesgo Medio Cannabis - Consumo frecuente sin condiciones', get_medium_risk_cannabis_consumo_frecuente, df_test)
+        ) &
+        evaluar_regla('Riesgo Medio Cannabis - Sin condiciones de riesgo', get_sin_condiciones_riesgo_cannabis, df_test)
+    )
 
-                            (
-                                # Ha consumido psilocibina con fines terapeuticos
-                                (df_test['Propósito Psilocibina'].isin(['Fines terapéuticos', 'Ambos']))
-                            ) 
+    return riesgo_medio_cannabis
 
-                        ) &
+def get_high_risk_cannabis(df_test):
+    riesgo_alto_cannabis = (
+        evaluar_regla('Riesgo Alto Cannabis - Consumo frecuente con condiciones', get_high_risk_cannabis_consumo_frecuente, df_test) |
+        evaluar_regla('Riesgo Alto Cannabis - Consumo no frecuente con dependencia o abuso', get_high_risk_cannabis_consumo_no_frecuente, df_test) |
+        evaluar_regla('Riesgo Alto Cannabis - Condición o efecto determinante', get_high_risk_cannabis_condicion_determinante, df_test)
+    )
 
-                        (    
-                            # Ni el participante ni su familia presentan adicciones o condiciones medicas riesgosas
-                            (
-                                get_columns(df_test, condiciones_medicas_adicciones).eq(False).all(axis=1)  &
-                                get_columns(df_test, historial_familiar_adicciones).eq(False).all(axis=1)  &
-                                get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1)  &
-                                get_columns(df_test, historial_familiar_condiciones_riesgosas).eq(False).all(axis=1)  
-                            )  &
-                            # No reporta dependencia a la sustancia ni consumo abusivo
-                            (
-                                (df_test['Dependencia Psilocibina'] == False) &
-                                (df_test['Abuso Psilocibina'] == False) 
-                            ) &
-                            # Ha experimentado efectos positivos con la sustancia y ningún efecto negativo determinante, como psicosis
+    return riesgo_alto_cannabis  
+
+
+
+# Sub-reglas para Nivel de Riesgo Bajo - Psilocibina
+def get_low_risk_psilocibina_macrodosis(df_test):
+    # Ha consumido psilocibina en macrodosis
+    return (
+        (df_test['Tipo de Dosis'] == 'Macrodosis') &
+
+            (    
+                (     
+                    # Ha realizado dos o más tratamiento 
+                    (
+                        (df_test['Cantidad Tratamientos'].isin(['Dos', 'Más de tres'])) &
                             (
-                                get_columns(df_test, efectos_negativos_determinantes_psilocibina).eq(False).all(axis=1)  &
-                                get_columns(df_test, efectos_positivos_psilocibina).eq(True).any(axis=1)  
+                                # La calificación dada al tratamiento es de 4 o 5
+                                (df_test['Calificación Tratamiento'].isin([4,5]))
                             )
+                    ) |
 
-                        )
+                    (
+                        # Ha consumido psilocibina con fines terapeuticos
+                        (df_test['Propósito Psilocibina'].isin(['Fines terapéuticos', 'Ambos']))
                     ) 
-            ) |
 
-            # No ha consumido en macrodosis pero cumple con las condiciones sanas
-            # Ni el participante ni su familia presentan condiciones riesgosas 
-            (
-                get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1)  &
-                get_columns(df_test, historial_familiar_condiciones_riesgosas).eq(False).all(axis=1)  
-            )  &
-            # No reporta dependencia a la sustancia ni consumo abusivo
-            (
-                (df_test['Dependencia Psilocibina'] == False) &
-                (df_test['Abuso Psilocibina'] == False) 
-            ) &
-            # Ha experimentado efectos positivos con la sustancia y ningún efecto negativo determinante, como psicosis
-            (
-                get_columns(df_test, efectos_negativos_determinantes_psilocibina).eq(False).all(axis=1)  &
-                get_columns(df_test, efectos_positivos_psilocibina).eq(True).any(axis=1)  
-            )
-        ) &
+                ) &
+
+                (    
+                    # Ni el participante ni su familia presentan adicciones o condiciones medicas riesgosas
+                    (
+                        get_columns(df_test, condiciones_medicas_adicciones).eq(False).all(axis=1)  &
+                        get_columns(df_test, historial_familiar_adicciones).eq(False).all(axis=1)  &
+                        get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1)  &
+                        get_columns(df_test, historial_familiar_condiciones_riesgosas).eq(False).all(axis=1)  
+                    )  &
+                    # No reporta dependencia a la sustancia ni consumo abusivo
+                    (
+                        (df_test['Dependencia Psilocibina'] == False) &
+                        (df_test['Abuso Psilocibina'] == False) 
+                    ) &
+                    # Ha experimentado efectos positivos con la sustancia y ningún efecto negativo determinante, como psicosis
+                    (
+                        get_columns(df_test, efectos_negativos_determinantes_psilocibina).eq(False).all(axis=1)  &
+                        get_columns(df_test, efectos_positivos_psilocibina).eq(True).any(axis=1)  
+                    )
 
-        # No presenta condiciones de riesgo
+                )
+            ) 
+    )
+
+def get_low_risk_psilocibina_condiciones_sanas(df_test):
+    # No ha consumido en macrodosis pero cumple con las condiciones sanas
+    return (
+        # Ni el participante ni su familia presentan condiciones riesgosas 
         (
-            get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1) &
-            (df_test['Dependencia Psilocibina'] == False) 
+            get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1)  &
+            get_columns(df_test, historial_familiar_condiciones_riesgosas).eq(False).all(axis=1)  
+        )  &
+        # No reporta dependencia a la sustancia ni consumo abusivo
+        (
+            (df_test['Dependencia Psilocibina'] == False) &
+            (df_test['Abuso Psilocibina'] == False) 
+        ) &
+        # Ha experimentado efectos positivos con la sustancia y ningún efecto negativo determinante, como psicosis
+        (
+            get_columns(df_test, efectos_negativos_determinantes_psilocibina).eq(False).all(axis=1)  &
+            get_columns(df_test, efectos_positivos_psilocibina).eq(True).any(axis=1)  
         )
     )
 
-    return riesgo_bajo_psilocibina
+def get_sin_condiciones_riesgo_psilocibina(df_test):
+    # No presenta condiciones de riesgo
+    return (
+        get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1) &
+        (df_test['Dependencia Psilocibina'] == False) 
+    )
 
-def get_medium_risk_psilocibina(df_test):
 
-    riesgo_medio_psilocibina = (
-        
-        (    
-            # Ha consumido psilocibina en macrodosis
-            (    
-                (df_test['Tipo de Dosis'] == 'Macrodosis') &
+# Sub-reglas para Nivel de Riesgo Medio - Psilocibina
+def get_medium_risk_psilocibina_macrodosis(df_test):
+    # Ha consumido psilocibina en macrodosis
+    return (
+        (df_test['Tipo de Dosis'] == 'Macrodosis') &
 
-                    (     
-                        # Ha realizado tratamientos
+            (     
+                # Ha realizado tratamientos
+                (
+                    (df_test['Cantidad Tratamientos'] != 'Sin Dato') &
                         (
-                            (df_test['Cantidad Tratamientos'] != 'Sin Dato') &
-                                (
-                                    # La calificación dada al tratamiento es diferente a 1
-                                    (df_test['Calificación Tratamiento'] != 1)
-                                )
-                        ) |
+                            # La calificación dada al tratamiento es diferente a 1
+                            (df_test['Calificación Tratamiento'] != 1)
+                        )
+                ) |
 
-                        (
-                            # Ha consumido psilocibina con fines terapeuticos
-                            (df_test['Propósito Psilocibina'].isin(['Fines terapéuticos', 'Ambos']))
-                        ) 
+                (
+                    # Ha consumido psilocibina con fines terapeuticos
+                    (df_test['Propósito Psilocibina'].isin(['Fines terapéuticos', 'Ambos']))
+                ) 
 
-                    ) |
+            )
+    )
 
-                    (    
-                        # No presenta condiciones riesgosas 
-                        (
-                            get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1)  
-                        )  &
-                        # no es dependiente ni abusa de la sustancia
-                        (
-                            (df_test['Dependencia Psilocibina'] == False) &
-                            (df_test['Abuso Psilocibina'] == False) 
-                        ) &
-                        # No reporta dependencia a la sustancia ni consumo abusivo
-                        (
-                            get_columns(df_test, efectos_negativos_determinantes_psilocibina).eq(False).all(axis=1)  &
-                            get_columns(df_test, efectos_positivos_psilocibina).eq(True).any(axis=1)  
-                        )
+def get_medium_risk_psilocibina_sin_condiciones_riesgosas(df_test):
+    return (    
+        # No presenta condiciones riesgosas 
+        (
+            get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1)  
+        )  &
+        # no es dependiente ni abusa de la sustancia
+        (
+            (df_test['Dependencia Psilocibina'] == False) &
+            (df_test['Abuso Psilocibina'] == False) 
+        ) &
+        # No reporta dependencia a la sustancia ni consumo abusivo
+        (
+            get_columns(df_test, efectos_negativos_determinantes_psilocibina).eq(False).all(axis=1)  &
+            get_columns(df_test, efectos_positivos_psilocibina).eq(True).any(axis=1)  
+        )
 
-                    )
+    )
 
-            ) |
+def get_medium_risk_psilocibina_condiciones_sanas(df_test):
+    # No ha consumido en macrodosis pero cumple con las condiciones sanas
+    return (
+        # No presenta condiciones riesgosas 
+        (
+            get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1)  
+        )  &
+        # No reporta dependencia a la sustancia ni consumo abusivo
+        (
+            (df_test['Dependencia Psilocibina'] == False) &
+            (df_test['Abuso Psilocibina'] == False) 
+        ) &
+        # Ha experimentado efectos positivos con la sustancia y ningún efecto negativo determinante, como psicosis
+        (
+            get_columns(df_test, efectos_negativos_determinantes_psilocibina).eq(False).all(axis=1)  &
+            get_columns(df_test, efectos_positivos_psilocibina).eq(True).any(axis=1)  
+        )
+    )
 
-            # No ha consumido en macrodosis pero cumple con las condiciones sanas
-            # No presenta condiciones riesgosas 
-            (
-                get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1)  
+
+# Sub-reglas para Nivel de Riesgo Alto - Psilocibina
+def get_high_risk_psilocibina_macrodosis(df_test):
+    # Ha consumido psilocibina en macrodosis
+    return (           
+        (df_test['Tipo de Dosis'] == 'Macrodosis') &
+
+            (     
+                # Ha realizado tratamientos y ha dado una mala calificación
+                (
+                    (df_test['Cantidad Tratamientos'] != 'Sin Dato') &
+                    (df_test['Calificación Tratamiento'] == 1)
+                )
             )  &
-            # No reporta dependencia a la sustancia ni consumo abusivo
-            (
-                (df_test['Dependencia Psilocibina'] == False) &
-                (df_test['Abuso Psilocibina'] == False) 
-            ) &
-            # Ha experimentado efectos positivos con la sustancia y ningún efecto negativo determinante, como psicosis
-            (
-                get_columns(df_test, efectos_negativos_determinantes_psilocibina).eq(False).all(axis=1)  &
-                get_columns(df_test, efectos_positivos_psilocibina).eq(True).any(axis=1)  
+
+            (    
+                # El participante y su familia presentan cualquier condición riesgosa
+                (
+                    get_columns(df_test, condiciones_medicas_riesgosas).eq(True).any(axis=1)  &
+                    get_columns(df_test, historial_familiar_condiciones_riesgosas).eq(True).any(axis=1)  
+                )  |
+                # Reporta dependencia a la sustancia
+                (
+                    (df_test['Dependencia Psilocibina'] == True)  
+                ) | 
+                # Ha experimentado efectos negativos determinantes
+                (
+                    get_columns(df_test, efectos_negativos_determinantes_psilocibina).eq(True).any(axis=1)  
+                )
+
             )
-        ) &
+    )
 
-        # No presenta condiciones de riesgo
+def get_high_risk_psilocibina_condiciones_no_sanas(df_test):
+    # No ha consumido en macrodosis pero no cumple con las condiciones sanas
+    return (
+        # Presenta cualquier condición riesgosa
+        (
+            get_columns(df_test, condiciones_medicas_riesgosas).eq(True).any(axis=1)  
+        )  |
+        # Reporta dependencia a la sustancia
         (
-            get_columns(df_test, condiciones_medicas_riesgosas).eq(False).all(axis=1) &
             (df_test['Dependencia Psilocibina'] == False) 
+        ) |
+        # Ha experimentado efectos negativos determinantes
+        (
+            get_columns(df_test, efectos_negativos_determinantes_psilocibina).eq(True).any(axis=1)  
         )
     )
 
-    return riesgo_medio_psilocibina
-
-def get_high_risk_psilocibina(df_test):
-    riesgo_alto_psilocibina = (
-    
-        # Ha consumido psilocibina en macrodosis
-        (           
-            (df_test['Tipo de Dosis'] == 'Macrodosis') &
 
-                (     
-                    # Ha realizado tratamientos y ha dado una mala calificación
-                    (
-                        (df_test['Cantidad Tratamientos'] != 'Sin Dato') &
-                        (df_test['Calificación Tratamiento'] == 1)
-                    )
-                )  &
 
-                (    
-                    # El participante y su familia presentan cualquier condición riesgosa
-                    (
-                        get_columns(df_test, condiciones_medicas_riesgosas).eq(True).any(axis=1)  &
-                        get_columns(df_test, historial_familiar_condiciones_riesgosas).eq(True).any(axis=1)  
-                    )  |
-                    # Reporta dependencia a la sustancia
-                    (
-                        (df_test['Dependencia Psilocibina'] == True)  
-                    ) | 
-                    # Ha experimentado efectos negativos determinantes
-                    (
-                        get_columns(df_test, efectos_negativos_determinantes_psilocibina).eq(True).any(axis=1)  
-                    )
+# Conjuntos de Reglas para Nivel de Riesgo - Psilocibina
+def get_low_risk_psilocibina(df_test):
+    riesgo_bajo_psilocibina = (
+        (
+            evaluar_regla('Riesgo Bajo Psilocibina - Macrodosis', get_low_risk_psilocibina_macrodosis, df_test) |
+            evaluar_regla('Riesgo Bajo Psilocibina - Condiciones sanas', get_low_risk_psilocibina_condiciones_sanas, df_test)
+        ) &
+        evaluar_regla('Riesgo Bajo Psilocibina - Sin condiciones de riesgo', get_sin_condiciones_riesgo_psilocibina, df_test)
+    )
 
-                )
-                    
-        ) |
+    return riesgo_bajo_psilocibina
 
-        # No ha consumido en macrodosis pero no cumple con las condiciones sanas
+def get_medium_risk_psilocibina(df_test):
+    riesgo_medio_psilocibina = (
         (
-            # Presenta cualquier condición riesgosa
-            (
-                get_columns(df_test, condiciones_medicas_riesgosas).eq(True).any(axis=1)  
-            )  |
-            # Reporta dependencia a la sustancia
-            (
-                (df_test['Dependencia Psilocibina'] == False) 
-            ) |
-            # Ha experimentado efectos negativos determinantes
-            (
-                get_columns(df_test, efectos_negativos_determinantes_psilocibina).eq(True).any(axis=1)  
-            )
-        ) 
+            evaluar_regla('Riesgo Medio Psilocibina - Macrodosis', get_medium_risk_psilocibina_macrodosis, df_test) |
+            evaluar_regla('Riesgo Medio Psilocibina - Sin condiciones riesgosas', get_medium_risk_psilocibina_sin_condiciones_riesgosas, df_test) |
+            evaluar_regla('Riesgo Medio Psilocibina - Condiciones sanas', get_medium_risk_psilocibina_condiciones_sanas, df_test)
+        ) &
+        evaluar_regla('Riesgo Medio Psilocibina - Sin condiciones de riesgo', get_sin_condiciones_riesgo_psilocibina, df_test)
+    )
+
+    return riesgo_medio_psilocibina
+
+def get_high_risk_psilocibina(df_test):
+    riesgo_alto_psilocibina = (
+        evaluar_regla('Riesgo Alto Psilocibina - Macrodosis con mala calificación', get_high_risk_psilocibina_macrodosis, df_test) |
+        evaluar_regla('Riesgo Alto Psilocibina - Condiciones no sanas', get_high_risk_psilocibina_condiciones_no_sanas, df_test)
     )
 
-    return riesgo_alto_psilocibina
\ No newline at end of file
+    return riesgo_alto_psilocibina
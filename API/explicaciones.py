@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from definitions import dict_renombrar_respuestas, dict_encoder_riesgo_tratamiento
+
+
+# Nombres de las respuestas originales de la encuesta a partir de los nombres codificados de las columnas
+dict_respuestas_originales = {v: k for k, v in dict_renombrar_respuestas.items()}
+reverse_dict_encoder_riesgo = {v: k for k, v in dict_encoder_riesgo_tratamiento.items()}
+
+
+def get_nombre_legible(col):
+    # Ej. 'Condición_Adicción Nicotina' -> 'Condición: Adicción a la nicotina'
+    return dict_respuestas_originales.get(col, col).replace('_', ': ', 1)
+
+
+class ExplicadorGradientBoosting:
+    # Calcula la contribución de cada variable a la predicción de un Gradient Boosting Classifier.
+    # Para cada árbol se precalcula, en cada nodo, la suma de los cambios de valor a lo largo del camino desde la raíz,
+    # asignando cada cambio a la variable de la división. Los árboles de todas las clases se unen en arreglos globales
+    # de nodos, de modo que un lote completo recorre todos los árboles a la vez (un paso por nivel de profundidad)
+    # y las contribuciones se obtienen con un producto matricial disperso por clase.
+    # Las contribuciones están en la escala del 'decision_function' (log-odds).
+
+    def __init__(self, modelo):
+        self.modelo = modelo
+        self.columnas = list(modelo.feature_names_in_)
+        self.nombres = [get_nombre_legible(col) for col in self.columnas]
+        self.clases = [reverse_dict_encoder_riesgo.get(clase, str(clase)) for clase in modelo.classes_]
+
+        n_estimadores, n_clases = modelo.estimators_.shape
+        n_variables = len(self.columnas)
+        self.raices = np.zeros((n_estimadores, n_clases), dtype=np.int64)
+        izquierdos, derechos, variables, umbrales, tablas = [], [], [], [], []
+        desplazamiento = 0
+        self.profundidad = 0
+
+        for k in range(n_clases):
+            for i in range(n_estimadores):
+                arbol = modelo.estimators_[i, k].tree_
+                nodos = np.arange(arbol.node_count)
+                es_hoja = arbol.children_left == -1
+
+                # Las hojas apuntan a sí mismas para que el recorrido por niveles se detenga en ellas
+                izquierdos.append(np.where(es_hoja, nodos, arbol.children_left) + desplazamiento)
+                derechos.append(np.where(es_hoja, nodos, arbol.children_right) + desplazamiento)
+                variables.append(np.where(es_hoja, 0, arbol.feature))
+                umbrales.append(arbol.threshold)
+                tablas.append(self.calcular_tabla_arbol(arbol, n_variables) * modelo.learning_rate)
+
+                self.raices[i, k] = desplazamiento
+                desplazamiento += arbol.node_count
+                self.profundidad = max(self.profundidad, arbol.max_depth)
+
+        self.izquierdos = np.concatenate(izquierdos)
+        self.derechos = np.concatenate(derechos)
+        self.variables = np.concatenate(variables)
+        self.umbrales = np.concatenate(umbrales)
+        self.tabla = np.vstack(tablas)
+
+        # El valor base (predicción inicial del modelo más la raíz de cada árbol) es la parte de la decisión que no depende del perfil
+        X_cero = pd.DataFrame(np.zeros((1, n_variables)), columns=self.columnas)
+        self.valor_base = self.modelo.decision_function(X_cero).reshape(1, -1)[0] - self.get_contribuciones(X_cero)[0].sum(axis=1)
+
+        # En la clasificación binaria hay un solo puntaje, que corresponde a la clase positiva
+        self.clases_puntaje = self.clases if n_clases > 1 else self.clases[1:]
+
+    @staticmethod
+    def calcular_tabla_arbol(arbol, n_variables):
+        # Recorrer el árbol desde la raíz acumulando el cambio de valor en la variable de cada división
+        tabla = np.zeros((arbol.node_count, n_variables))
+        valores = arbol.value[:, 0, 0]
+        pendientes = [0]
+        while pendientes:
+            nodo = pendientes.pop()
+            for hijo in (arbol.children_left[nodo], arbol.children_right[nodo]):
+                if hijo != -1:
+                    tabla[hijo] = tabla[nodo]
+                    tabla[hijo, arbol.feature[nodo]] += valores[hijo] - valores[nodo]
+                    pendientes.append(hijo)
+        return tabla
+
+    def get_hojas(self, X):
+        # Recorrer todos los árboles a la vez; los árboles de sklearn comparan las variables en float32
+        X = np.asarray(X[self.columnas] if hasattr(X, 'columns') else X, dtype=np.float32)
+        filas = np.arange(len(X))[:, None]
+        nodos = np.tile(self.raices.ravel(), (len(X), 1))
+        for _ in range(self.profundidad):
+            a_la_izquierda = X[filas, self.variables[nodos]] <= self.umbrales[nodos]
+            nodos = np.where(a_la_izquierda, self.izquierdos[nodos], self.derechos[nodos])
+        return nodos.reshape(len(X), *self.raices.shape)
+
+    def get_contribuciones(self, X):
+        # Índice global de la hoja alcanzada en cada árbol: (perfiles, estimadores, clases)
+        hojas = self.get_hojas(X)
+        n_perfiles, n_estimadores, n_clases = hojas.shape
+
+        contribuciones = []
+        for k in range(n_clases):
+            indicador = csr_matrix(
+                (np.ones(n_perfiles * n_estimadores), hojas[:, :, k].ravel(), np.arange(0, n_perfiles * n_estimadores + 1, n_estimadores)),
+                shape=(n_perfiles, self.tabla.shape[0])
+            )
+            contribuciones.append(indicador @ self.tabla)
+        return np.stack(contribuciones, axis=1)
+
+    def explicar(self, X):
+        # Devuelve el valor base (clases) y las contribuciones (perfiles, clases, variables)
+        return self.valor_base, self.get_contribuciones(X)
+
+    def explicar_perfiles(self, X, top=None):
+        # Explicación legible de cada perfil: contribuciones distintas de cero ordenadas por magnitud para cada clase
+        valor_base, contribuciones = self.explicar(X)
+        decision = valor_base + contribuciones.sum(axis=2)
+        explicaciones = []
+        for i in range(len(X)):
+            por_clase = {}
+            for k, clase in enumerate(self.clases_puntaje):
+                orden = np.argsort(-np.abs(contribuciones[i, k]))
+                orden = [j for j in orden if contribuciones[i, k, j] != 0][:top]
+                por_clase[clase] = {
+                    'Valor Base': round(float(valor_base[k]), 4),
+                    'Puntaje': round(float(decision[i, k]), 4),
+                    'Contribuciones': {self.nombres[j]: round(float(contribuciones[i, k, j]), 4) for j in orden}
+                }
+            clase_predicha = int(np.argmax(decision[i])) if len(self.clases_puntaje) > 1 else int(decision[i, 0] > 0)
+            explicaciones.append({'Clase Predicha': self.clases[clase_predicha], 'Clases': por_clase})
+        return explicaciones
@@ -0,0 +1,228 @@
+import argparse
+import hashlib
+import json
+import os
+from collections import Counter
+from datetime import datetime
+from time import perf_counter
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from utils import get_label_encoding, execute_expert_system, encode_risk_level, divide_dataset, filter_df
+from definitions import dict_encoder_duracion_microdosis
+from versiones import ruta_datos_cannabis, ruta_datos_psilocibina
+from tabla_decision import calcular_huella_reglas
+
+
+# Rutas de la encuesta limpia, la encuesta codificada y el registro de filas ya procesadas
+ruta_encuesta_limpia = '../encuestas/encuesta_limpia.csv'
+ruta_encuesta_codificada = '../encuestas/encuesta_codificada.csv'
+ruta_manifiesto_ingesta = '../encuestas/manifiesto_ingesta.json'
+
+# Columnas de la encuesta limpia que no se usan en la encuesta codificada
+columnas_excluidas_codificacion = ['Edad']
+
+
+def calcular_huella_fila(fila):
+    # La huella solo considera las respuestas marcadas, para que no cambie si la encuesta agrega columnas nuevas con False
+    respuestas = {col: valor for col, valor in fila.items() if not pd.isna(valor) and valor is not False}
+    return hashlib.sha256(json.dumps(respuestas, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def calcular_huellas(df_limpia):
+    return [calcular_huella_fila(fila) for fila in df_limpia.to_dict(orient='records')]
+
+
+def get_filas_nuevas(huellas, filas_procesadas):
+    # Una respuesta repetida en la encuesta solo es nueva si aparece más veces de las ya procesadas
+    vistas = Counter()
+    filas_nuevas = []
+    for huella in huellas:
+        vistas[huella] += 1
+        filas_nuevas.append(vistas[huella] > filas_procesadas.get(huella, 0))
+    return filas_nuevas
+
+
+def cargar_manifiesto(ruta=ruta_manifiesto_ingesta):
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding='utf-8') as archivo:
+        return json.load(archivo)
+
+
+def guardar_manifiesto(manifiesto, ruta=ruta_manifiesto_ingesta):
+    def escribir(ruta_temporal):
+        with open(ruta_temporal, 'w', encoding='utf-8') as archivo:
+            json.dump(manifiesto, archivo, ensure_ascii=False, indent=2)
+    guardar_atomico(ruta, escribir)
+
+
+def guardar_atomico(ruta, escribir):
+    # Escribir en un archivo temporal y reemplazar el original, para que la API nunca lea un archivo a medio escribir
+    ruta_temporal = ruta + '.tmp'
+    escribir(ruta_temporal)
+    os.replace(ruta_temporal, ruta)
+
+
+def codificar_columna(serie, diccionario):
+    valores_desconocidos = set(serie.dropna().unique()) - set(diccionario)
+    if valores_desconocidos:
+        raise ValueError(f'La columna {serie.name} tiene valores sin codificación: {sorted(valores_desconocidos)}')
+    return serie.map(diccionario).astype(int)
+
+
+def codificar_encuesta(df_limpia):
+    # Replicar la codificación de 'encuesta_codificada.csv': Label Encoding de las variables ordinales y One Hot Encoding del resto
+    df_codificado = get_label_encoding(df_limpia.drop(columns=columnas_excluidas_codificacion, errors='ignore'))
+    df_codificado = df_codificado.assign(**{
+        'Duración Microdosis': codificar_columna(df_codificado['Duración Microdosis'], dict_encoder_duracion_microdosis),
+        'Calificación Tratamiento': df_codificado['Calificación Tratamiento'].astype(int)
+    })
+    return pd.get_dummies(df_codificado)
+
+
+def renombrar_opciones(df):
+    # Los conjuntos de los modelos no incluyen las siglas entre paréntesis (ej. 'Trastorno Bipolar (I , II)' -> 'Trastorno Bipolar')
+    return df.set_axis(df.columns.str.replace(r' \([^)]*\)$', '', regex=True), axis=1)
+
+
+def codificar_sustancias(df_limpia, df_codificado, target_cols):
+    # Etiquetar las filas con el sistema experto y dividir la encuesta codificada según la sustancia
+    df_test = renombrar_opciones(df_limpia)
+    df_encoded = renombrar_opciones(df_codificado)
+
+    # Agregar el nivel de riesgo de ambas sustancias de una sola vez, sin insertar columnas en el DataFrame fragmentado de 'get_dummies'
+    df_encoded = pd.concat([df_encoded, *[execute_expert_system(df_test, target_col) for target_col in target_cols]], axis=1)
+    for target_col in target_cols:
+        df_encoded = encode_risk_level(df_encoded, target_col)
+
+    df_encoded_cannabis, df_encoded_psilocibina = divide_dataset(df_encoded)
+    return {
+        target_cols[0]: filter_df(df_encoded_cannabis, target_cols[0]),
+        target_cols[1]: filter_df(df_encoded_psilocibina, target_cols[1])
+    }
+
+
+def ampliar_esquema(df_actual, df_nuevo, target_col=None):
+    # Agregar las columnas de opciones de respuesta nuevas (False en las filas anteriores).
+    # En los conjuntos de los modelos solo se agregan opciones de preguntas que ya hacen parte del conjunto.
+    if target_col is None:
+        columnas_nuevas = [col for col in df_nuevo.columns if col not in df_actual.columns]
+        columnas = list(df_actual.columns) + columnas_nuevas
+    else:
+        preguntas = {col.split('_')[0] for col in df_actual.columns if '_' in col}
+        columnas_nuevas = [col for col in df_nuevo.columns if col not in df_actual.columns and col.split('_')[0] in preguntas]
+        columnas = [col for col in df_actual.columns if col != target_col] + columnas_nuevas + [target_col]
+
+    df_actual = df_actual.reindex(columns=columnas, fill_value=False)
+    df_nuevo = df_nuevo.reindex(columns=columnas, fill_value=False)
+    return pd.concat([df_actual, df_nuevo], ignore_index=True), columnas_nuevas
+
+
+def reetiquetar_conjuntos(df_limpia, target_cols, rutas_sustancias):
+    # Etiquetar de nuevo todas las respuestas con las reglas actuales, conservando las columnas de cada conjunto
+    conjuntos = {}
+    for target_col, df_sustancia in codificar_sustancias(df_limpia, codificar_encuesta(df_limpia), target_cols).items():
+        ruta_datos = rutas_sustancias[target_col]
+        columnas = list(pd.read_csv(ruta_datos, nrows=0).columns)
+        conjuntos[ruta_datos] = df_sustancia.reindex(columns=columnas, fill_value=False)
+    return conjuntos
+
+
+def ingerir_encuesta(ruta_encuesta=ruta_encuesta_limpia, simular=False, reetiquetar=False):
+    load_dotenv()
+    target_cols = [os.getenv("TARGET_COL_CANNABIS"), os.getenv("TARGET_COL_PSILOCIBINA")]
+    rutas_sustancias = {target_cols[0]: ruta_datos_cannabis, target_cols[1]: ruta_datos_psilocibina}
+
+    inicio = perf_counter()
+    df_limpia = pd.read_csv(ruta_encuesta)
+    huellas = calcular_huellas(df_limpia)
+    manifiesto = cargar_manifiesto()
+    huella_reglas = calcular_huella_reglas()
+
+    # Sin manifiesto, las respuestas actuales son las que generaron los conjuntos existentes y se registran como procesadas.
+    # Los conjuntos se etiquetan de nuevo una sola vez con las reglas actuales, para que las filas que se agreguen después
+    # tengan el mismo criterio que las anteriores
+    if manifiesto is None:
+        conjuntos = reetiquetar_conjuntos(df_limpia, target_cols, rutas_sustancias)
+        manifiesto = {'Filas Procesadas': dict(Counter(huellas)), 'Huella Reglas': huella_reglas, 'Ingestas': []}
+        resumen = {'Fecha': datetime.now().isoformat(timespec='seconds'), 'Filas Nuevas': 0, 'Línea Base': len(huellas), 'Reetiquetado': True}
+        resumen.update({target_col: len(conjuntos[rutas_sustancias[target_col]]) for target_col in target_cols})
+        manifiesto['Ingestas'].append(resumen)
+        if not simular:
+            for ruta, df in conjuntos.items():
+                guardar_atomico(ruta, lambda ruta_temporal: df.to_csv(ruta_temporal, index=False))
+            guardar_manifiesto(manifiesto)
+        resumen['Tiempo (s)'] = round(perf_counter() - inicio, 3)
+        return resumen
+
+    filas_nuevas = get_filas_nuevas(huellas, manifiesto['Filas Procesadas'])
+    df_nuevas = df_limpia[filas_nuevas].reset_index(drop=True)
+    resumen = {'Fecha': datetime.now().isoformat(timespec='seconds'), 'Filas Nuevas': len(df_nuevas)}
+
+    # Las filas nuevas se etiquetan con las reglas actuales: si los conjuntos se etiquetaron con otras reglas,
+    # solo se agregan después de etiquetar de nuevo las filas ya procesadas
+    reglas_distintas = manifiesto.get('Huella Reglas') != huella_reglas
+    if reglas_distintas and not reetiquetar and not df_nuevas.empty:
+        raise ValueError('Los conjuntos de los modelos se etiquetaron con otras reglas del sistema experto. '
+                         'Ejecutar con --reetiquetar para etiquetar de nuevo todas las respuestas con las reglas actuales')
+
+    if df_nuevas.empty and not reetiquetar:
+        resumen['Tiempo (s)'] = round(perf_counter() - inicio, 3)
+        return resumen
+
+    if reetiquetar:
+        conjuntos = reetiquetar_conjuntos(df_limpia[[not nueva for nueva in filas_nuevas]].reset_index(drop=True), target_cols, rutas_sustancias)
+        resumen['Reetiquetado'] = True
+    else:
+        conjuntos = {ruta_datos: pd.read_csv(ruta_datos) for ruta_datos in rutas_sustancias.values()}
+    archivos = dict(conjuntos)
+    resumen['Columnas Nuevas'] = {}
+
+    if not df_nuevas.empty:
+        # Codificar únicamente las filas nuevas y agregarlas a la encuesta codificada
+        df_codificado_nuevo = codificar_encuesta(df_nuevas)
+        df_codificado, columnas_nuevas = ampliar_esquema(pd.read_csv(ruta_encuesta_codificada), df_codificado_nuevo)
+        resumen['Columnas Nuevas']['Encuesta Codificada'] = columnas_nuevas
+        archivos[ruta_encuesta_codificada] = df_codificado
+
+        # Agregar las filas con nivel de riesgo conocido al conjunto de cada sustancia
+        for target_col, df_sustancia_nuevo in codificar_sustancias(df_nuevas, df_codificado_nuevo, target_cols).items():
+            ruta_datos = rutas_sustancias[target_col]
+            df_sustancia, columnas_nuevas = ampliar_esquema(conjuntos[ruta_datos], df_sustancia_nuevo, target_col)
+            resumen[target_col] = len(df_sustancia_nuevo)
+            resumen['Columnas Nuevas'][target_col] = columnas_nuevas
+            archivos[ruta_datos] = df_sustancia
+
+    if not simular:
+        for ruta, df in archivos.items():
+            guardar_atomico(ruta, lambda ruta_temporal: df.to_csv(ruta_temporal, index=False))
+
+        # El manifiesto se actualiza al final, para que una ingesta interrumpida se pueda repetir
+        for huella, nueva in zip(huellas, filas_nuevas):
+            if nueva:
+                manifiesto['Filas Procesadas'][huella] = manifiesto['Filas Procesadas'].get(huella, 0) + 1
+        manifiesto['Huella Reglas'] = huella_reglas
+        manifiesto['Ingestas'].append(resumen)
+        guardar_manifiesto(manifiesto)
+
+    resumen['Tiempo (s)'] = round(perf_counter() - inicio, 3)
+    return resumen
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Codifica las respuestas nuevas de la encuesta limpia y las agrega a los conjuntos de entrenamiento.')
+    parser.add_argument('--encuesta', default=ruta_encuesta_limpia, help='Ruta de la encuesta limpia con las respuestas nuevas')
+    parser.add_argument('--simular', action='store_true', help='Mostrar el resultado sin modificar los archivos')
+    parser.add_argument('--reetiquetar', action='store_true', help='Etiquetar de nuevo los conjuntos de los modelos con las reglas actuales del sistema experto')
+    args = parser.parse_args()
+
+    resumen = ingerir_encuesta(args.encuesta, args.simular, args.reetiquetar)
+    print(json.dumps(resumen, ensure_ascii=False, indent=2))
+
+    columnas_modelos = [columnas for target_col, columnas in resumen.get('Columnas Nuevas', {}).items() if target_col != 'Encuesta Codificada']
+    if resumen.get('Reetiquetado'):
+        print('Los conjuntos de los modelos se etiquetaron de nuevo: se deben reentrenar los modelos con entrenamiento.py antes de recargar la API.')
+    elif any(columnas_modelos):
+        print('Los conjuntos de los modelos tienen columnas nuevas: se deben reentrenar los modelos con entrenamiento.py antes de recargar la API.')
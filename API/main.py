@@ -1,50 +1,126 @@
 # Importaciones
-import pandas as pd
-import numpy as np
-from joblib import load
+from perfil_arranque import marcar_etapa, perfil_arranque_activo, generar_reporte_arranque
 from pydantic import BaseModel, ValidationError
-from fastapi import FastAPI, HTTPException
-from joblib import load
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import FileResponse
 from dotenv import load_dotenv
 import os
-
-from expert_system import * 
-from utils import *
-from test_data import *
+import shutil
+import threading
+
+from prediccion import calcular_prediccion
+from versiones import cargar_version, RegistroVersiones
+from test_data import sujeto7
+from coalescencia import CoalescedorSolicitudes, normalizar_perfiles
+from perfil_reglas import perfil_reglas_activo, activar_perfil_reglas
+from perfil_memoria import perfil_memoria_activo, activar_perfil_memoria
+from monitor_deriva import monitor_deriva_activo, activar_monitor_deriva
+from sombra import cargar_evaluador_sombra
+from validacion import validar_perfiles, formatear_errores
+from trabajos import ColaTrabajos, cargar_procesador_trabajos
+from planificador import cargar_planificador, ColaLlena
 from definitions import columnas_df
+import pandas as pd
+marcar_etapa('Importaciones')
  
 
 # Inicializar app
 app = FastAPI()
 
-# Leer datos de entrenamiento
-df_encoded_cannabis = pd.read_csv('../encuestas/cannabis_encoded_modelos.csv')
-df_encoded_psilocibina = pd.read_csv('../encuestas/psilocibina_encoded_modelos.csv')
-
 
 # Cargar y extraer variables de entorno
 load_dotenv()
-random_state_cannabis = int(os.getenv("RANDOM_STATE_CANNABIS"))
-random_state_psilocibina = int(os.getenv("RANDOM_STATE_PSILOCIBINA"))
-target_col_cannabis = os.getenv("TARGET_COL_CANNABIS")
-target_col_psilocibina = os.getenv("TARGET_COL_PSILOCIBINA")
+usar_tabla_decision = os.getenv("USAR_TABLA_DECISION", "1") == "1"
+vigilar_artefactos = os.getenv("VIGILAR_ARTEFACTOS", "0") == "1"
+intervalo_vigilancia = float(os.getenv("INTERVALO_VIGILANCIA", "5"))
+ruta_perfil_memoria = os.getenv("PERFIL_MEMORIA_ARCHIVO", "perfil_memoria.json")
+# Directorio del que '/jobs' puede leer los CSV indicados en 'ruta_entrada'
+directorio_entrada_trabajos = os.getenv("TRABAJOS_DIRECTORIO_ENTRADA", "../entradas")
+marcar_etapa('Variables de entorno')
 
 
+# Cargar los datos de entrenamiento, los modelos y la tabla de decisión como la versión inicial del servicio
 try:
-    model_psilocibina = load('../modelos/best_model_psilocibina.joblib')
-    model_cannabis = load('../modelos/best_model_cannabis.joblib')
+    version_inicial = cargar_version(usar_tabla_decision, marcar_etapa=marcar_etapa)
     print(f'Los modelos se cargaron correctamente')
 except Exception as e:
+    version_inicial = None
     print(f'Ocurrió un error en la carga de los modelos: {e}')
 
+registro_versiones = RegistroVersiones(version_inicial, usar_tabla_decision)
+if vigilar_artefactos:
+    registro_versiones.iniciar_vigilancia(intervalo_vigilancia)
+
+# Cargar los modelos candidatos para evaluarlos en segundo plano sobre el tráfico real, si están definidos
+try:
+    evaluador_sombra = cargar_evaluador_sombra()
+except Exception as e:
+    evaluador_sombra = None
+    print(f'Ocurrió un error en la carga de los modelos candidatos: {e}')
+
+# Agrupar las solicitudes idénticas que se procesan al mismo tiempo
+coalescedor = CoalescedorSolicitudes()
+
+# Solicitudes y perfiles rechazados por la validación antes de ejecutar el pipeline
+lock_validacion = threading.Lock()
+metricas_validacion = {'Solicitudes Rechazadas': 0, 'Perfiles Rechazados': 0}
+
+# Turnos de ejecución del pipeline con prioridad para las solicitudes interactivas sobre las partes de los trabajos
+planificador = cargar_planificador()
+
+# Cola persistente de los trabajos de puntuación masiva ('/jobs') y trabajadores en segundo plano que la procesan
+cola_trabajos = ColaTrabajos()
+try:
+    procesador_trabajos = cargar_procesador_trabajos(cola_trabajos, planificador)
+except Exception as e:
+    procesador_trabajos = None
+    print(f'Ocurrió un error al iniciar los trabajadores de la cola de trabajos: {e}')
+
+# Activar la instrumentación de las sub-reglas del sistema experto si está habilitada
+recolector_reglas = activar_perfil_reglas() if perfil_reglas_activo() else None
+
+# Activar la medición de la memoria asignada por cada etapa del pipeline (en la fracción de solicitudes indicada) si está habilitada
+recolector_memoria = activar_perfil_memoria(float(os.getenv("PERFIL_MEMORIA_MUESTREO", "1"))) if perfil_memoria_activo() else None
+
+# Activar el monitor de deriva de los perfiles recibidos respecto a los datos de entrenamiento si está habilitado
+monitor_deriva = None
+if monitor_deriva_activo():
+    try:
+        monitor_deriva = activar_monitor_deriva(float(os.getenv("MONITOR_DERIVA_UMBRAL", "0.1")), int(os.getenv("MONITOR_DERIVA_MIN_FILAS", "100")),
+                                                int(os.getenv("MONITOR_DERIVA_FILAS_VENTANA", "1000")), int(os.getenv("MONITOR_DERIVA_MAX_COLA", "1000")),
+                                                version=version_inicial)
+    except Exception as e:
+        print(f'Ocurrió un error al iniciar el monitor de deriva: {e}')
+
+# Mostrar el desglose de tiempos de arranque si el modo de perfilado está activo
+if perfil_arranque_activo():
+    print(generar_reporte_arranque())
+
+
+@app.middleware("http")
+async def agregar_version(request: Request, call_next):
+    # Reportar en cada respuesta la versión del servicio (si la solicitud no reportó ya la versión con la que se atendió)
+    response = await call_next(request)
+    version = registro_versiones.get_actual()
+    if 'X-Version-Servicio' not in response.headers and version is not None:
+        response.headers['X-Version-Servicio'] = version.version
+    return response
+
 
 # Definir el formato de los datos a predecir
 class DataPredict(BaseModel):
     data_to_predict: list[list] = [sujeto7]
 
 
+def calcular_prediccion_planificada(list_data, version, explicar, sombra):
+    # La respuesta corresponde al primer perfil y el pipeline procesa cada perfil por separado, así que solo se puntúa ese perfil
+    # (el resto del lote ya se validó) en un único turno interactivo, sin importar el tamaño del lote
+    with planificador.turno('Interactiva'):
+        return calcular_prediccion(list_data[:1], version, explicar, sombra)
+
+
 @app.post("/predict-risk")
-def predict(request: DataPredict):
+def predict(request: DataPredict, response: Response, explicar: bool = False, solo_validos: bool = False):
     """
     Predice el nivel de riesgo para un tratamiento con sustancias psicoactivas según el perfil del paciente.
 
@@ -92,80 +168,223 @@ def predict(request: DataPredict):
         
     Todas los campos permiten la opción 'N/A' como respuesta en caso de que la pregunta no aplique para el paciente.
 
+    Con 'explicar=true' la respuesta incluye, para cada sustancia, las variables que más contribuyeron al puntaje de cada nivel de riesgo en el modelo.
+
+    Las respuestas se validan contra las opciones válidas de cada pregunta antes de procesar el lote. Si algún perfil no es válido la solicitud se rechaza
+    con el código 422 y los errores de cada fila; con 'solo_validos=true' se procesan solo los perfiles válidos y los rechazados se reportan en 'Perfiles Rechazados'.
+
     """
+    # Validar el lote completo antes de cualquier procesamiento, para que los perfiles mal formados no consuman el pipeline
+    list_data = request.data_to_predict
+    if not list_data:
+        raise HTTPException(status_code=422, detail='No se recibieron perfiles para predecir')
+    validos, errores = validar_perfiles(list_data)
+    if errores:
+        with lock_validacion:
+            metricas_validacion['Perfiles Rechazados'] += len(errores)
+            metricas_validacion['Solicitudes Rechazadas'] += int(not solo_validos or not validos)
+        if not solo_validos or not validos:
+            raise HTTPException(status_code=422, detail={'Perfiles Rechazados': formatear_errores(errores)})
+        list_data = [list_data[i] for i in validos]
+
     try:
-        # Obtener los datos de prueba recibidos en la solicitud a la API y convertirlos en un DataFrame
-        list_data = request.data_to_predict
-        df_test = pd.DataFrame(list_data, columns=columnas_df)
 
-        # Realizar el preprocesamiento de los datos de prueba
-        preprocess_data(df_test)
+        # Tomar la versión activa; la solicitud termina con esta versión aunque se active otra mientras tanto
+        version = registro_versiones.get_actual()
+        if version is None:
+            raise RuntimeError('No hay una versión de los modelos cargada')
+        response.headers['X-Version-Servicio'] = version.version
+
+        # Las solicitudes idénticas concurrentes comparten un único cálculo
+        clave = version.version + str(explicar) + normalizar_perfiles(list_data)
+        resultado = coalescedor.ejecutar(clave, calcular_prediccion_planificada, list_data, version, explicar, evaluador_sombra)
+        if errores:
+            resultado = {**resultado, 'Perfiles Rechazados': formatear_errores(errores)}
+        return resultado
+    except ColaLlena as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        print(f'Exception: {e}')
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Codificar las variables con multiples respuestas
-        df_test_encoded, df_test = get_one_hot_encoding(df_test)
-        
-        # Realizar transformaciones necesarias a los datos de prueba
-        df_test = transform_data(df_test)
-        df_test_encoded = transform_data(df_test_encoded)
 
-        # Codificar con Label Encoding las variables con una gran cantidad de posibilidades de respuesta
-        get_label_encoding(df_test_encoded)
-        # Condificar con One Hot Encoding el resto de variables
-        df_test_encoded = pd.get_dummies(df_test_encoded) 
+# Definir el formato de los trabajos de puntuación masiva: perfiles en la solicitud o el nombre de un CSV del directorio de entrada
+class DataTrabajo(BaseModel):
+    data_to_predict: list[list] | None = None
+    ruta_entrada: str | None = None
 
-        # Dividir el dataset de prueba según la sustancia
-        df_test_encoded_cannabis, df_test_encoded_psilocibina = divide_dataset(df_test_encoded)
 
-        # Ejecutar el sistema experto con los conjuntos de reglas para determinar el nivel de riesgo del individuo
-        execute_expert_system(df_test, df_test_encoded_cannabis, target_col_cannabis)
-        execute_expert_system(df_test, df_test_encoded_psilocibina, target_col_psilocibina)
+def validar_csv_trabajo(ruta):
+    try:
+        columnas = pd.read_csv(ruta, nrows=0).columns
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f'No se pudo leer el CSV de entrada: {e}')
+    faltantes = [col for col in columnas_df if col not in columnas]
+    if faltantes:
+        raise HTTPException(status_code=422, detail=f'Faltan columnas en el CSV de entrada: {faltantes}')
+
+
+def resolver_entrada_trabajo(nombre):
+    # Solo se leen archivos dentro de TRABAJOS_DIRECTORIO_ENTRADA: se rechazan las rutas absolutas, '..' y los enlaces
+    # que apunten fuera del directorio antes de acceder al sistema de archivos
+    partes = nombre.replace('\\', '/').split('/')
+    if not nombre or os.path.isabs(nombre) or '..' in partes:
+        raise HTTPException(status_code=422, detail="'ruta_entrada' debe ser el nombre de un archivo del directorio de entrada, sin rutas absolutas ni '..'")
+    directorio = os.path.realpath(directorio_entrada_trabajos)
+    ruta = os.path.realpath(os.path.join(directorio, nombre))
+    if os.path.commonpath([directorio, ruta]) != directorio:
+        raise HTTPException(status_code=422, detail="'ruta_entrada' debe ser el nombre de un archivo del directorio de entrada, sin rutas absolutas ni '..'")
+    if not os.path.isfile(ruta):
+        raise HTTPException(status_code=404, detail=f'No existe el archivo {nombre} en el directorio de entrada')
+    return ruta
+
+
+def encolar_trabajo(**entrada):
+    id_trabajo = cola_trabajos.crear(**entrada)
+    if procesador_trabajos is not None:
+        procesador_trabajos.avisar()
+    return cola_trabajos.get_trabajo(id_trabajo)
+
+
+@app.post("/jobs", status_code=202)
+def crear_trabajo(trabajo: DataTrabajo):
+    """
+    Crea un trabajo de puntuación masiva y devuelve su identificador sin esperar el resultado.
 
-        # Codificar el nivel de riesgo
-        encode_risk_level(df_test_encoded_cannabis, target_col_cannabis)
-        encode_risk_level(df_test_encoded_psilocibina, target_col_psilocibina)
+    Recibe los perfiles en 'data_to_predict' (mismo formato de '/predict-risk') o, en 'ruta_entrada', el nombre de un CSV con las columnas
+    de los perfiles dentro del directorio de entrada (TRABAJOS_DIRECTORIO_ENTRADA).
+    Los perfiles con respuestas no válidas no se rechazan: quedan con el error en la columna 'Error' del resultado.
+    """
+    if (trabajo.data_to_predict is None) == (trabajo.ruta_entrada is None):
+        raise HTTPException(status_code=422, detail="Se debe indicar 'data_to_predict' o 'ruta_entrada'")
 
-        # Filtrar los datos de prueba para eliminar filas sin predicciones de riesgo
-        df_test_encoded_cannabis = filter_df(df_test_encoded_cannabis, target_col_cannabis)
-        df_test_encoded_psilocibina = filter_df(df_test_encoded_psilocibina, target_col_psilocibina)
+    if trabajo.ruta_entrada is not None:
+        ruta_entrada = resolver_entrada_trabajo(trabajo.ruta_entrada)
+        validar_csv_trabajo(ruta_entrada)
+        return encolar_trabajo(ruta_entrada=ruta_entrada)
 
+    # Los perfiles sin las 18 respuestas no se pueden guardar como filas del CSV del trabajo
+    _, errores = validar_perfiles(trabajo.data_to_predict)
+    errores = {i: errores_fila for i, errores_fila in errores.items() if 'Perfil' in errores_fila}
+    if errores:
+        raise HTTPException(status_code=422, detail={'Perfiles Rechazados': formatear_errores(errores)})
+    return encolar_trabajo(list_data=trabajo.data_to_predict)
 
-        # Generar el DF para el modelo y sus subconjuntos de entrenamiento y prueba
-        df_test_encoded_cannabis_model, _ , _ , _ , _ ,_ , _  = balance_and_setup_test_data(df_encoded_cannabis, df_test_encoded_cannabis, target_col_cannabis, random_state_cannabis)
-        df_test_encoded_psilocibina_model, _ , _ , _ , _ , _ , _  = balance_and_setup_test_data(df_encoded_psilocibina, df_test_encoded_psilocibina, target_col_psilocibina, random_state_psilocibina)
 
-        # Ejecutar el modelo pre cargado para realizar predicciones para ambas sustancias
-        if not df_test_encoded_psilocibina_model.empty:
-            y_test_pred_riesgo_psilocibina = model_psilocibina.predict(df_test_encoded_psilocibina_model)
-        else:
-            y_test_pred_riesgo_psilocibina = np.array([0])
+@app.post("/jobs/csv", status_code=202)
+async def crear_trabajo_csv(request: Request):
+    """
+    Crea un trabajo de puntuación masiva a partir de un CSV enviado como cuerpo de la solicitud (Content-Type: text/csv).
+    """
+    id_trabajo = cola_trabajos.crear_directorio()
+    ruta_entrada = os.path.join(cola_trabajos.get_directorio_trabajo(id_trabajo), 'entrada.csv')
+    with open(ruta_entrada, 'wb') as archivo:
+        async for bloque in request.stream():
+            archivo.write(bloque)
+    try:
+        validar_csv_trabajo(ruta_entrada)
+    except HTTPException:
+        shutil.rmtree(cola_trabajos.get_directorio_trabajo(id_trabajo))
+        raise
+    return encolar_trabajo(ruta_entrada=ruta_entrada, id_trabajo=id_trabajo)
 
-        if not df_test_encoded_cannabis_model.empty:
-            y_test_pred_riesgo_cannabis = model_cannabis.predict(df_test_encoded_cannabis_model)
-        else:
-            y_test_pred_riesgo_cannabis = np.array([0])
 
+@app.get("/jobs")
+def listar_trabajos(limite: int = 50):
+    """
+    Devuelve la cantidad de trabajos por estado y los últimos trabajos creados.
+    """
+    return {'Resumen': cola_trabajos.get_resumen(), 'Trabajos': cola_trabajos.listar(limite)}
 
 
+@app.get("/jobs/{id_trabajo}")
+def estado_trabajo(id_trabajo: str):
+    """
+    Devuelve el estado de un trabajo: filas procesadas, avance, filas por segundo, filas con error y versión del servicio.
+    """
+    trabajo = cola_trabajos.get_trabajo(id_trabajo)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail='Trabajo no encontrado')
+    return trabajo
 
-        # Reemplazar los valores codificados para obtener el nivel de riesgo en lenguaje natural
-        y_test_pred_riesgo_cannabis = map_values(y_test_pred_riesgo_cannabis)
-        y_test_pred_riesgo_psilocibina = map_values(y_test_pred_riesgo_psilocibina)
 
-        return {
-            "Riesgo Cannabis": {
-                "Predicción Sistema Experto": df_test['Nivel de Riesgo Tratamiento Cannabis'][0],
-                "Predicción Modelo Gradient Boosting": str(y_test_pred_riesgo_cannabis[0])
-            },
-            "Riesgo Psilocibina": {
-                "Predicción Sistema Experto": df_test['Nivel de Riesgo Tratamiento Psilocibina'][0],
-                "Predicción Modelo Gradient Boosting": str(y_test_pred_riesgo_psilocibina[0])
-            }
-        }
-    except Exception as e:
-        print(f'Exception: {e}')
-        raise HTTPException(status_code=500, detail=str(e))
+@app.get("/jobs/{id_trabajo}/results")
+def resultados_trabajo(id_trabajo: str):
+    """
+    Devuelve el CSV con las predicciones de un trabajo completado, una fila por perfil y en el orden de la entrada.
+    """
+    trabajo = cola_trabajos.get_trabajo(id_trabajo)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail='Trabajo no encontrado')
+    if trabajo['Estado'] != 'Completado':
+        raise HTTPException(status_code=409, detail=f'El trabajo no está completado (estado: {trabajo["Estado"]})')
+    return FileResponse(cola_trabajos.get_ruta_resultado(id_trabajo), media_type='text/csv', filename=f'{id_trabajo}.csv')
 
 
 @app.get("/")
 def home():
     return {'Proyecto de Fin de Programa - SRL'}
+
+
+@app.post("/reload")
+def reload():
+    """
+    Recarga en segundo plano los modelos, los datos de entrenamiento y las reglas del sistema experto.
+
+    La versión nueva se calienta con los perfiles de prueba y se activa de forma atómica; las solicitudes en curso terminan con la versión anterior.
+    """
+    registro_versiones.recargar_en_segundo_plano()
+    return registro_versiones.get_estado()
+
+
+@app.get("/version")
+def version():
+    """
+    Devuelve la versión activa del servicio y el estado de la última recarga.
+    """
+    return registro_versiones.get_estado()
+
+
+@app.get("/memory-profile")
+def memory_profile(guardar: bool = False):
+    """
+    Devuelve la memoria asignada por cada etapa del pipeline (solo con PERFIL_MEMORIA=1).
+
+    Por etapa: pico y neto promedio, pico máximo y pico por fila, además del detalle de las últimas solicitudes medidas.
+    Con 'guardar=true' el reporte se guarda también en el archivo PERFIL_MEMORIA_ARCHIVO.
+    """
+    if recolector_memoria is None:
+        raise HTTPException(status_code=404, detail='El perfilado de memoria no está activo (PERFIL_MEMORIA=1)')
+    if guardar:
+        recolector_memoria.guardar_reporte(ruta_perfil_memoria)
+    return {'Métricas': recolector_memoria.get_metricas(), 'Solicitudes': recolector_memoria.get_solicitudes()}
+
+
+@app.get("/metrics")
+def metrics():
+    """
+    Devuelve las métricas de operación de la API.
+
+    - Coalescencia: solicitudes recibidas, calculadas y coalescidas con una solicitud idéntica en curso.
+    - Validación: solicitudes y perfiles rechazados antes de ejecutar el pipeline.
+    - Trabajos: cantidad de trabajos de puntuación masiva por estado, filas pendientes y trabajadores en la API.
+    - Planificador: por clase de prioridad, turnos en cola y en ejecución, solicitudes rechazadas por cola llena y tiempo de espera en la cola.
+    - Reglas (solo con PERFIL_REGLAS=1): tiempo y coincidencias de cada sub-regla del sistema experto, y niveles de riesgo asignados.
+    - Sombra (solo con modelos candidatos): coincidencias de los modelos candidatos con el modelo principal y el sistema experto.
+    - Deriva (solo con MONITOR_DERIVA=1): por sustancia, tasa de activación de las variables, opciones desconocidas por los modelos,
+      proporción de 'Riesgo Desconocido' y niveles de riesgo, comparados con los datos de entrenamiento.
+    """
+    metricas = {
+        "Coalescencia": coalescedor.get_metricas()
+    }
+    with lock_validacion:
+        metricas["Validación"] = dict(metricas_validacion)
+    metricas["Planificador"] = planificador.get_metricas()
+    metricas["Trabajos"] = {**cola_trabajos.get_resumen(), 'Trabajadores API': procesador_trabajos.trabajadores if procesador_trabajos is not None else 0}
+    if recolector_reglas is not None:
+        metricas["Reglas"] = recolector_reglas.get_metricas()
+    if evaluador_sombra is not None:
+        metricas["Sombra"] = evaluador_sombra.get_metricas()
+    if monitor_deriva is not None:
+        metricas["Deriva"] = monitor_deriva.get_metricas()
+    return metricas
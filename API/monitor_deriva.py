@@ -0,0 +1,259 @@
+import os
+import queue
+import threading
+from time import perf_counter
+
+import numpy as np
+
+import prediccion
+from definitions import dict_encoder_riesgo_tratamiento
+from ingesta import ruta_encuesta_codificada
+from utils import setup_training_data
+
+
+reverse_dict_encoder_riesgo = {v: k for k, v in dict_encoder_riesgo_tratamiento.items()}
+niveles_riesgo = len(dict_encoder_riesgo_tratamiento)
+
+# Cantidad de variables con mayor diferencia respecto a la línea base que se reportan por sustancia
+max_variables_reporte = 10
+# Cantidad máxima de opciones desconocidas distintas que se registran por sustancia; el resto se suma en 'Otras'
+max_opciones_desconocidas = 50
+
+
+def contar_filas_csv(ruta):
+    with open(ruta, 'rb') as archivo:
+        return max(sum(1 for _ in archivo) - 1, 0)
+
+
+class LineaBase:
+    # Distribución de los datos de entrenamiento de una sustancia con la que se compara el tráfico:
+    # tasa de activación (o valor medio) de cada variable, proporción de cada nivel de riesgo y proporción de 'Riesgo Desconocido'
+
+    def __init__(self, df_encoded, target_col, random_state, filas_encuesta):
+        X_riesgo, y_riesgo, _, _, _, _ = setup_training_data(df_encoded, target_col, random_state)
+        self.target_col = target_col
+        self.columnas = list(X_riesgo.columns)
+        self.indice_columnas = {col: i for i, col in enumerate(self.columnas)}
+        self.tasas = X_riesgo.to_numpy(dtype=np.float64).mean(axis=0)
+        self.niveles = np.bincount(y_riesgo.to_numpy(dtype=np.int64), minlength=niveles_riesgo) / len(y_riesgo)
+        # Los conjuntos de los modelos son las filas de la encuesta codificada que no quedaron con 'Riesgo Desconocido' (ver 'ingesta.py')
+        self.proporcion_desconocido = 1 - len(df_encoded) / filas_encuesta if filas_encuesta else 0.0
+
+
+class ContadoresDeriva:
+    # Contadores de tamaño fijo para una sustancia: la memoria no crece con la cantidad de solicitudes
+
+    def __init__(self, linea_base):
+        self.filas = 0
+        self.filas_desconocido = 0
+        self.filas_modelo = 0
+        self.activaciones = np.zeros(len(linea_base.columnas))
+        self.niveles = np.zeros(niveles_riesgo, dtype=np.int64)
+        self.predicciones = np.zeros(niveles_riesgo, dtype=np.int64)
+        self.opciones_desconocidas = {}
+
+    def registrar(self, filas, riesgo_codificado, indices_modelo, activaciones, y_pred, opciones_desconocidas):
+        self.filas += filas
+        self.filas_desconocido += filas - len(riesgo_codificado)
+        self.niveles += np.bincount(riesgo_codificado, minlength=niveles_riesgo)[:niveles_riesgo]
+        if len(riesgo_codificado):
+            self.filas_modelo += len(riesgo_codificado)
+            self.activaciones[indices_modelo] += activaciones
+            self.predicciones += np.bincount(y_pred, minlength=niveles_riesgo)[:niveles_riesgo]
+        for opcion, cantidad in opciones_desconocidas:
+            if opcion in self.opciones_desconocidas or len(self.opciones_desconocidas) < max_opciones_desconocidas:
+                self.opciones_desconocidas[opcion] = self.opciones_desconocidas.get(opcion, 0) + cantidad
+            else:
+                self.opciones_desconocidas['Otras'] = self.opciones_desconocidas.get('Otras', 0) + cantidad
+
+
+def proporciones(conteo):
+    total = conteo.sum()
+    return conteo / total if total else np.zeros(len(conteo))
+
+
+def comparar(contadores, linea_base, umbral, min_filas, alertar=True):
+    # Con 'alertar' el reporte incluye 'Alerta'; solo se calcula para las ventanas, para que una desviación antigua no la mantenga activa
+    proporcion_desconocido = contadores.filas_desconocido / contadores.filas if contadores.filas else None
+    # Las filas con 'Riesgo Desconocido' no llegan a los contadores de niveles (se cuentan en 'Riesgo Desconocido'), por lo que se comparan solo los niveles conocidos
+    niveles = proporciones(contadores.niveles[1:])
+    distancia_niveles = float(np.abs(niveles - linea_base.niveles[1:]).sum() / 2) if contadores.niveles[1:].sum() else None
+
+    tasas = contadores.activaciones / contadores.filas_modelo if contadores.filas_modelo else np.full(len(linea_base.columnas), np.nan)
+    diferencias = tasas - linea_base.tasas
+    orden = np.argsort(-np.nan_to_num(np.abs(diferencias)))[:max_variables_reporte]
+    variables_deriva = int(np.sum(np.abs(np.nan_to_num(diferencias)) > umbral))
+
+    reporte = {
+        'Filas': contadores.filas,
+        'Filas Modelo': contadores.filas_modelo
+    }
+    if alertar:
+        suficientes = contadores.filas_modelo >= min_filas
+        reporte['Alerta'] = bool(suficientes and (variables_deriva > 0
+                                                  or (distancia_niveles is not None and distancia_niveles > umbral)
+                                                  or abs(proporcion_desconocido - linea_base.proporcion_desconocido) > umbral
+                                                  or contadores.opciones_desconocidas))
+
+    return {
+        **reporte,
+        'Riesgo Desconocido': {
+            'Proporción': round(proporcion_desconocido, 4) if proporcion_desconocido is not None else None,
+            'Línea Base': round(linea_base.proporcion_desconocido, 4)
+        },
+        'Niveles de Riesgo Sistema Experto': {
+            reverse_dict_encoder_riesgo[nivel]: {'Proporción': round(float(niveles[nivel - 1]), 4), 'Línea Base': round(float(linea_base.niveles[nivel]), 4)}
+            for nivel in range(1, niveles_riesgo)
+        },
+        'Distancia Niveles de Riesgo': round(distancia_niveles, 4) if distancia_niveles is not None else None,
+        'Predicciones Modelo': {reverse_dict_encoder_riesgo[nivel]: round(float(proporcion), 4) for nivel, proporcion in enumerate(proporciones(contadores.predicciones)) if nivel > 0},
+        'Variables con Deriva': variables_deriva,
+        'Variables': {
+            linea_base.columnas[i]: {'Tasa': round(float(tasas[i]), 4), 'Línea Base': round(float(linea_base.tasas[i]), 4), 'Diferencia': round(float(diferencias[i]), 4)}
+            for i in orden if contadores.filas_modelo
+        },
+        'Opciones Desconocidas': dict(contadores.opciones_desconocidas)
+    }
+
+
+class MonitorDeriva:
+    # Compara el tráfico de predicción con la distribución de los datos de entrenamiento de la versión activa.
+    # La solicitud solo deja en una cola acotada las filas codificadas que ya produjo el pipeline (los DataFrames no se modifican
+    # después de crearlos, por lo que no se copian); un hilo en segundo plano las suma en contadores de tamaño fijo y
+    # las proporciones y diferencias se calculan al consultar las métricas. Si la cola está llena, la solicitud se descarta
+    # en lugar de hacerla esperar. Los contadores se reinician cuando cambia la versión, porque la línea base y las columnas
+    # de los modelos pueden cambiar. Además del acumulado, se conserva la última ventana completa de 'filas_ventana' filas;
+    # la alerta se calcula sobre esa ventana, así que se desactiva cuando una ventana completa vuelve a parecerse a la línea base.
+
+    def __init__(self, umbral=0.1, min_filas=100, filas_ventana=1000, max_cola=1000):
+        self.umbral = umbral
+        self.min_filas = min_filas
+        self.filas_ventana = filas_ventana
+        self.cola = queue.Queue(maxsize=max_cola)
+        self.lock = threading.Lock()
+        self.version = None
+        self.lineas_base = {}
+        self.acumulado, self.ventana, self.ultima_ventana = {}, {}, {}
+        self.solicitudes = 0
+        self.descartadas = 0
+        self.errores = 0
+        self.tiempo_registro = 0.0
+        self.tiempo_procesamiento = 0.0
+        self.hilo = threading.Thread(target=self.procesar, daemon=True)
+        self.hilo.start()
+
+    def preparar(self, version):
+        # Calcular la línea base de la versión y reiniciar los contadores
+        filas_encuesta = contar_filas_csv(ruta_encuesta_codificada) if os.path.exists(ruta_encuesta_codificada) else 0
+        lineas_base = {
+            'Cannabis': LineaBase(version.df_encoded_cannabis, version.target_col_cannabis, version.random_state_cannabis, filas_encuesta),
+            'Psilocibina': LineaBase(version.df_encoded_psilocibina, version.target_col_psilocibina, version.random_state_psilocibina, filas_encuesta)
+        }
+        with self.lock:
+            self.version = version.version
+            self.lineas_base = lineas_base
+            self.acumulado = {sustancia: ContadoresDeriva(linea_base) for sustancia, linea_base in lineas_base.items()}
+            self.ventana = {sustancia: ContadoresDeriva(linea_base) for sustancia, linea_base in lineas_base.items()}
+            self.ultima_ventana = {}
+
+    def registrar(self, version, filas, sustancias):
+        # 'sustancias': {sustancia: (filas codificadas que pasaron filter_df, predicciones del modelo)}. No bloquea.
+        inicio = perf_counter()
+        try:
+            self.cola.put_nowait((version, filas, sustancias))
+            descartada = False
+        except queue.Full:
+            descartada = True
+        with self.lock:
+            self.descartadas += descartada
+            self.tiempo_registro += perf_counter() - inicio
+
+    def procesar(self):
+        while True:
+            version, filas, sustancias = self.cola.get()
+            try:
+                inicio = perf_counter()
+                self.sumar(version, filas, sustancias)
+                with self.lock:
+                    self.solicitudes += 1
+                    self.tiempo_procesamiento += perf_counter() - inicio
+            except Exception as e:
+                with self.lock:
+                    self.errores += 1
+                print(f'Ocurrió un error en el monitor de deriva: {e}')
+            self.cola.task_done()
+
+    def sumar(self, version, filas, sustancias):
+        if version.version != self.version:
+            self.preparar(version)
+
+        registros = {}
+        for sustancia, (df_test_encoded, y_pred) in sustancias.items():
+            linea_base = self.lineas_base[sustancia]
+            # Las filas del modelo son estas mismas filas reordenadas con las columnas del modelo ('setup_test_data'), por lo que
+            # todo se obtiene de una sola conversión a numpy: seleccionar columnas de un DataFrame cuesta más que la conversión.
+            # Las opciones de respuesta ('Pregunta_Opción') que no son columnas del modelo se pierden al reordenar las filas.
+            posiciones_modelo, indices_modelo, posiciones_desconocidas = [], [], []
+            for posicion, col in enumerate(df_test_encoded.columns):
+                indice = linea_base.indice_columnas.get(col)
+                if indice is not None:
+                    posiciones_modelo.append(posicion)
+                    indices_modelo.append(indice)
+                elif '_' in col:
+                    posiciones_desconocidas.append(posicion)
+
+            valores = df_test_encoded.to_numpy(dtype=np.float64)
+            riesgo_codificado = valores[:, df_test_encoded.columns.get_loc(linea_base.target_col)].astype(np.int64)
+            marcadas = np.count_nonzero(valores[:, posiciones_desconocidas], axis=0)
+            opciones_desconocidas = [(df_test_encoded.columns[posicion], int(cantidad)) for posicion, cantidad in zip(posiciones_desconocidas, marcadas) if cantidad]
+            registros[sustancia] = (filas, riesgo_codificado, indices_modelo, valores[:, posiciones_modelo].sum(axis=0), np.asarray(y_pred, dtype=np.int64), opciones_desconocidas)
+
+        with self.lock:
+            for sustancia, registro in registros.items():
+                self.acumulado[sustancia].registrar(*registro)
+                self.ventana[sustancia].registrar(*registro)
+            if self.ventana['Cannabis'].filas >= self.filas_ventana:
+                self.ultima_ventana = self.ventana
+                self.ventana = {sustancia: ContadoresDeriva(linea_base) for sustancia, linea_base in self.lineas_base.items()}
+
+    def esperar(self):
+        # Esperar a que se procesen las solicitudes en cola (para pruebas y reportes)
+        self.cola.join()
+
+    def get_metricas(self):
+        with self.lock:
+            registradas = self.solicitudes + self.cola.qsize() + self.descartadas
+            ultima_ventana = {sustancia: comparar(contadores, self.lineas_base[sustancia], self.umbral, self.min_filas) for sustancia, contadores in self.ultima_ventana.items()}
+            return {
+                'Versión': self.version,
+                'Solicitudes': self.solicitudes,
+                'En Cola': self.cola.qsize(),
+                'Descartadas': self.descartadas,
+                'Errores': self.errores,
+                'Tiempo Promedio en la Solicitud (µs)': round(self.tiempo_registro / registradas * 1e6, 2) if registradas else None,
+                'Tiempo Promedio de Procesamiento (µs)': round(self.tiempo_procesamiento / self.solicitudes * 1e6, 1) if self.solicitudes else None,
+                'Umbral': self.umbral,
+                'Filas Ventana': self.filas_ventana,
+                'Filas Ventana Actual': self.ventana['Cannabis'].filas if self.ventana else 0,
+                'Alerta': any(reporte['Alerta'] for reporte in ultima_ventana.values()),
+                'Acumulado': {sustancia: comparar(contadores, self.lineas_base[sustancia], self.umbral, self.min_filas, alertar=False) for sustancia, contadores in self.acumulado.items()},
+                'Última Ventana': ultima_ventana
+            }
+
+
+def monitor_deriva_activo():
+    # El monitor de deriva se activa con la variable de entorno MONITOR_DERIVA
+    return os.getenv("MONITOR_DERIVA", "0").lower() in ('1', 'true', 'si')
+
+
+def activar_monitor_deriva(umbral=0.1, min_filas=100, filas_ventana=1000, max_cola=1000, version=None):
+    # Instalar el monitor en el pipeline; con 'version' la línea base se calcula al activarlo y no con la primera solicitud
+    monitor = MonitorDeriva(umbral, min_filas, filas_ventana, max_cola)
+    if version is not None:
+        monitor.preparar(version)
+    prediccion.monitor_deriva = monitor
+    return monitor
+
+
+def desactivar_monitor_deriva():
+    prediccion.monitor_deriva = None
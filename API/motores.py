@@ -0,0 +1,161 @@
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from utils import preprocess_data, get_one_hot_encoding, transform_data, get_label_encoding, get_columnas_duplicadas
+from definitions import (columnas_df, columnas_categoricas, cols_dependencia_abuso, dict_cols_binarias, dict_renombrar_respuestas, respuestas_sin_dato,
+                         dict_encoder_frecuencia, dict_encoder_sesiones_macro, dict_encoder_cantidad_tratamientos)
+
+
+# Motores con los que se puede ejecutar la preparación de los perfiles (variable de entorno MOTOR_DATAFRAMES)
+motores_disponibles = ['pandas', 'polars']
+
+
+class MotorPandas:
+    # Preparación de los perfiles con las funciones de 'utils.py' (la misma que se usa al construir los conjuntos de entrenamiento).
+    # Un motor recibe los perfiles de la solicitud y devuelve, como DataFrames de pandas:
+    # - 'df_test': los perfiles preprocesados con las respuestas múltiples codificadas, que recibe el sistema experto.
+    # - 'df_test_encoded': todas las variables codificadas, que se dividen por sustancia y se reordenan para los modelos.
+
+    nombre = 'pandas'
+
+    def procesar(self, list_data, medir_etapa):
+        # Convertir los datos de prueba recibidos en la solicitud a la API en un DataFrame
+        with medir_etapa('DataFrame de Entrada'):
+            df_test = pd.DataFrame(list_data, columns=columnas_df)
+
+        # Realizar el preprocesamiento de los datos de prueba, codificar las variables con multiples respuestas
+        # y realizar las transformaciones necesarias. Cada etapa devuelve un DataFrame nuevo, por lo que el resultado
+        # se comparte entre el sistema experto y la codificación para los modelos sin copiarlo.
+        with medir_etapa('preprocess_data'):
+            df_test = preprocess_data(df_test)
+        with medir_etapa('get_one_hot_encoding'):
+            df_test = get_one_hot_encoding(df_test)
+        with medir_etapa('transform_data'):
+            df_test = transform_data(df_test)
+
+        with medir_etapa('get_label_encoding'):
+            # Codificar con Label Encoding las variables con una gran cantidad de posibilidades de respuesta
+            df_test_encoded = get_label_encoding(df_test)
+            # La calificación sin dato equivale a 0 (como en un perfil individual), para que en un lote con calificaciones
+            # numéricas y 'Sin Dato' la columna siga siendo numérica y no se codifique con One Hot Encoding
+            df_test_encoded = df_test_encoded.assign(**{'Calificación Tratamiento': codificar_calificacion(df_test_encoded['Calificación Tratamiento'])})
+        with medir_etapa('get_dummies'):
+            # Condificar con One Hot Encoding el resto de variables
+            df_test_encoded = pd.get_dummies(df_test_encoded)
+
+        return df_test, df_test_encoded
+
+
+def codificar_calificacion(calificaciones):
+    return pd.to_numeric(calificaciones.mask(calificaciones == 'Sin Dato', 0))
+
+
+class MotorPolars:
+    # Las mismas etapas de 'MotorPandas' sobre un DataFrame de Polars, que evalúa las expresiones de cada etapa en paralelo
+    # en todos los núcleos (POLARS_MAX_THREADS) y sin el GIL. Las respuestas múltiples se codifican con 'list.contains'
+    # sobre las listas de opciones en lugar de 'explode', 'get_dummies' y 'groupby().max()', que multiplican las filas.
+    # Los DataFrames se convierten a pandas al final, con las mismas columnas, orden y tipos que 'MotorPandas'
+    # (ver 'paridad_motores.py'), porque el sistema experto y los modelos reciben DataFrames de pandas.
+
+    nombre = 'polars'
+
+    def __init__(self):
+        # Dependencia opcional (requirements-polars.txt)
+        import polars as pl
+        self.pl = pl
+
+    def procesar(self, list_data, medir_etapa):
+        pl = self.pl
+
+        with medir_etapa('DataFrame de Entrada'):
+            columnas = list(zip(*list_data)) if list_data else [()] * len(columnas_df)
+            df_test = pl.DataFrame({col: [None if pd.isna(valor) else str(valor) for valor in valores] for col, valores in zip(columnas_df, columnas)},
+                                   schema={col: pl.String for col in columnas_df})
+            # Las reglas del sistema experto comparan la calificación con enteros, por lo que la columna se conserva aparte
+            # con los valores y el tipo que tendría en pandas (por ejemplo, 4.0 si hay calificaciones vacías)
+            calificaciones = pd.Series(list(columnas[columnas_df.index('Calificación Tratamiento')]), name='Calificación Tratamiento')
+
+        with medir_etapa('preprocess_data'):
+            df_test = df_test.with_columns(pl.all().fill_null('Sin Dato').replace(respuestas_sin_dato, 'Sin Dato'))
+            calificaciones = preprocess_data(calificaciones)
+
+        with medir_etapa('get_one_hot_encoding'):
+            # Una columna por opción marcada en algún perfil, en orden alfabético como en 'get_dummies'
+            df_test = df_test.with_columns(pl.col(col).str.split(';') for col in columnas_categoricas)
+            opciones = df_test.select(pl.col(col).explode().unique().sort().implode() for col in columnas_categoricas).row(0)
+            df_test = df_test.select(
+                *[col for col in df_test.columns if col not in columnas_categoricas],
+                *[pl.col(col).list.contains(opcion).alias(f'{col}_{opcion}') for col, opciones_col in zip(columnas_categoricas, opciones) for opcion in opciones_col]
+            )
+
+        with medir_etapa('transform_data'):
+            df_test = self.transform_data(df_test)
+
+        with medir_etapa('get_label_encoding'):
+            cols_label_encoder = [col for col in df_test.columns if 'Frecuencia' in col]
+            df_test_encoded = df_test.with_columns(
+                *[pl.col(col).replace_strict(dict_encoder_frecuencia, return_dtype=pl.Int64) for col in cols_label_encoder],
+                pl.col('Sesiones Macrodosis').replace_strict(dict_encoder_sesiones_macro, return_dtype=pl.Int64),
+                pl.col('Cantidad Tratamientos').replace_strict(dict_encoder_cantidad_tratamientos, return_dtype=pl.Int64)
+            )
+
+        with medir_etapa('get_dummies'):
+            # Como 'pd.get_dummies': las columnas de texto se reemplazan por una columna por valor, agregadas al final.
+            # La calificación se codifica aparte con sus valores originales, en la misma posición.
+            cols_texto = [col for col, tipo in df_test_encoded.schema.items() if tipo == pl.String and col != 'Calificación Tratamiento']
+            valores = df_test_encoded.select(pl.col(col).unique().sort().implode() for col in cols_texto).row(0) if cols_texto else []
+            df_test_encoded = df_test_encoded.select(
+                *[col for col in df_test_encoded.columns if col not in cols_texto],
+                *[(pl.col(col) == valor).alias(f'{col}_{valor}') for col, valores_col in zip(cols_texto, valores) for valor in valores_col]
+            )
+
+            df_test = self.a_pandas(df_test, {'Calificación Tratamiento': calificaciones})
+            df_test_encoded = self.a_pandas(df_test_encoded, {'Calificación Tratamiento': codificar_calificacion(calificaciones)})
+
+        return df_test, df_test_encoded
+
+    def transform_data(self, df):
+        pl = self.pl
+
+        # Crear variable fusionada (Psicosis/Paranoia)
+        cols_existentes = [col for col in ['Condición_Psicosis', 'Condición_Paranoia', 'Historial Familiar_Psicosis', 'Historial Familiar_Paranoia'] if col in df.columns]
+        if cols_existentes:
+            df = df.with_columns(pl.any_horizontal(cols_existentes).alias('Condición_Psicosis/Paranoia')).drop(cols_existentes)
+
+        # Transformar los datos a valores booleanos; las respuestas sin equivalencia quedan en True, como NaN con 'astype(bool)'
+        df = df.with_columns(pl.col(col).replace_strict(dict_cols_binarias, default=1, return_dtype=pl.Int64).cast(pl.Boolean) for col in cols_dependencia_abuso)
+
+        # Combinar las formas de una misma opción y renombrar las columnas
+        duplicadas = get_columnas_duplicadas(df.columns)
+        if duplicadas:
+            df = df.with_columns(pl.any_horizontal(cols).alias(cols[0]) for cols in duplicadas).drop([col for cols in duplicadas for col in cols[1:]])
+        df = df.rename({col: dict_renombrar_respuestas[col] for col in df.columns if col in dict_renombrar_respuestas})
+
+        # Reemplazar caracteres especiales en los nombres de las columnas
+        return df.rename({col: re.sub(r'[^\w\s/,\']', '_', col) for col in df.columns})
+
+    def a_pandas(self, df, columnas_reemplazo):
+        # Conversión columna por columna a numpy (sin pyarrow): los números y booleanos se comparten sin copiarlos
+        pl = self.pl
+        datos = {}
+        for col in df.columns:
+            if col in columnas_reemplazo:
+                datos[col] = columnas_reemplazo[col].to_numpy()
+            elif df.schema[col] == pl.String:
+                datos[col] = np.array(df.get_column(col).to_list(), dtype=object)
+            else:
+                datos[col] = df.get_column(col).to_numpy()
+        return pd.DataFrame(datos)
+
+
+def cargar_motor(nombre=None):
+    # El motor se elige con la variable de entorno MOTOR_DATAFRAMES (por defecto, pandas)
+    nombre = nombre or os.getenv("MOTOR_DATAFRAMES", "pandas")
+    if nombre == 'pandas':
+        return MotorPandas()
+    if nombre == 'polars':
+        return MotorPolars()
+    raise ValueError(f'Motor de DataFrames desconocido: {nombre} (disponibles: {", ".join(motores_disponibles)})')
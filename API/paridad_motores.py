@@ -0,0 +1,86 @@
+import argparse
+import os
+import sys
+from contextlib import nullcontext
+from time import perf_counter
+
+import pandas as pd
+
+from motores import MotorPandas, cargar_motor, motores_disponibles
+from prediccion import calcular_predicciones
+
+
+def medir_motor(motor, list_data, repeticiones):
+    # Mejor tiempo de preparación de los perfiles (segundos) y el resultado de la última ejecución
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = perf_counter()
+        resultado = motor.procesar(list_data, lambda nombre: nullcontext())
+        tiempos.append(perf_counter() - inicio)
+    return min(tiempos), resultado
+
+
+def comparar_motores(list_data, version, motor, lote, repeticiones=3):
+    # Diferencias entre un motor y 'MotorPandas': DataFrames preparados (columnas, orden, tipos y valores)
+    # y niveles de riesgo de ambas sustancias, con el sistema experto y los modelos de la versión cargada
+    diferencias = {}
+    tiempos = {}
+    base = MotorPandas()
+    for inicio in range(0, len(list_data), lote):
+        perfiles = list_data[inicio:inicio + lote]
+        tiempo_base, esperado = medir_motor(base, perfiles, repeticiones)
+        tiempo_motor, obtenido = medir_motor(motor, perfiles, repeticiones)
+        tiempos[base.nombre] = tiempos.get(base.nombre, 0) + tiempo_base
+        tiempos[motor.nombre] = tiempos.get(motor.nombre, 0) + tiempo_motor
+
+        for nombre, df_esperado, df_obtenido in zip(['df_test', 'df_test_encoded'], esperado, obtenido):
+            try:
+                pd.testing.assert_frame_equal(df_obtenido, df_esperado)
+            except AssertionError as e:
+                diferencias.setdefault(nombre, f'Lote desde la fila {inicio}: {e}')
+
+        version.motor = base
+        riesgo_esperado = calcular_predicciones(perfiles, version)
+        version.motor = motor
+        riesgo_obtenido = calcular_predicciones(perfiles, version)
+        try:
+            pd.testing.assert_frame_equal(riesgo_obtenido, riesgo_esperado)
+        except AssertionError as e:
+            diferencias.setdefault('Predicciones', f'Lote desde la fila {inicio}: {e}')
+
+    return diferencias, tiempos
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    import test_data
+    from test_data import generar_perfiles_sinteticos
+    from puntuacion_lotes import contar_filas, leer_fragmento
+    from versiones import cargar_version
+
+    parser = argparse.ArgumentParser(description='Verifica que un motor de DataFrames prepare los perfiles y prediga igual que pandas.')
+    parser.add_argument('--motor', choices=[motor for motor in motores_disponibles if motor != 'pandas'], default='polars')
+    parser.add_argument('--perfiles', type=int, default=10000, help='Cantidad de perfiles sintéticos')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--csv', help='CSV con perfiles reales (mismo formato de puntuacion_lotes.py) en lugar de los sintéticos')
+    parser.add_argument('--lote', type=int, default=1000, help='Perfiles por llamada al pipeline')
+    parser.add_argument('--repeticiones', type=int, default=3, help='Ejecuciones de cada motor por lote para medir el tiempo')
+    args = parser.parse_args()
+
+    load_dotenv()
+    version = cargar_version(os.getenv("USAR_TABLA_DECISION", "1") == "1")
+    if args.csv:
+        list_data = leer_fragmento(args.csv, 0, contar_filas(args.csv))
+    else:
+        # Los sujetos de prueba cubren respuestas que los perfiles sintéticos pueden no generar
+        list_data = [getattr(test_data, f'sujeto{i}') for i in range(1, 11)] + generar_perfiles_sinteticos(args.perfiles, semilla=args.semilla)
+
+    diferencias, tiempos = comparar_motores(list_data, version, cargar_motor(args.motor), args.lote, args.repeticiones)
+    for nombre, tiempo in tiempos.items():
+        print(f'{nombre:<10} {tiempo:.3f} s ({len(list_data)} perfiles en lotes de {args.lote})')
+
+    if diferencias:
+        for nombre, detalle in diferencias.items():
+            print(f'Diferencias en {nombre}:\n{detalle}')
+        sys.exit(1)
+    print(f'Sin diferencias entre pandas y {args.motor}')
@@ -0,0 +1,62 @@
+import os
+import sys
+from time import perf_counter
+
+
+# Momento en que se inicia la medición del arranque (primera importación de este módulo)
+inicio_arranque = perf_counter()
+ultima_marca = inicio_arranque
+
+# Duración en segundos de cada etapa del arranque, en el orden en que se registraron
+tiempos_arranque = {}
+
+
+def marcar_etapa(nombre_etapa):
+    # Registrar el tiempo transcurrido desde la marca anterior como la duración de la etapa
+    global ultima_marca
+    ahora = perf_counter()
+    tiempos_arranque[nombre_etapa] = ahora - ultima_marca
+    ultima_marca = ahora
+
+
+def perfil_arranque_activo():
+    # El reporte de arranque se activa con la variable de entorno PERFIL_ARRANQUE
+    return os.getenv("PERFIL_ARRANQUE", "0").lower() in ('1', 'true', 'si')
+
+
+def generar_reporte_arranque():
+    # Construir el reporte con la duración de cada etapa y su porcentaje del total
+    total = sum(tiempos_arranque.values())
+    lineas = ['Perfil de arranque de la API:']
+    for etapa, duracion in tiempos_arranque.items():
+        porcentaje = (duracion / total * 100) if total else 0
+        lineas.append(f'  {etapa:<25} {duracion * 1000:>9.1f} ms  ({porcentaje:5.1f} %)')
+    lineas.append(f'  {"Total":<25} {total * 1000:>9.1f} ms')
+    return '\n'.join(lineas)
+
+
+def medir_importaciones(modulos):
+    # Medir el tiempo de importación de cada módulo pesado por separado (solo los que no estén cargados)
+    tiempos = {}
+    for modulo in modulos:
+        if modulo in sys.modules:
+            continue
+        inicio = perf_counter()
+        __import__(modulo)
+        tiempos[modulo] = perf_counter() - inicio
+    return tiempos
+
+
+if __name__ == '__main__':
+    # Desglosar primero las importaciones pesadas y luego el arranque completo de la API
+    modulos_pesados = ['numpy', 'pandas', 'sklearn', 'sklearn.ensemble', 'joblib', 'fastapi', 'pydantic']
+    tiempos_importacion = medir_importaciones(modulos_pesados)
+
+    print('Importaciones individuales:')
+    for modulo, duracion in tiempos_importacion.items():
+        print(f'  {modulo:<25} {duracion * 1000:>9.1f} ms')
+
+    # Importar la API a través del módulo 'perfil_arranque' para leer los tiempos registrados por 'main'
+    import main
+    import perfil_arranque
+    print(perfil_arranque.generar_reporte_arranque())
@@ -0,0 +1,185 @@
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import prediccion
+
+
+class RecolectorMemoria:
+    # Registra, por cada etapa del pipeline, el pico y el neto de memoria asignada durante una ejecución de 'ejecutar_pipeline'.
+    # 'tracemalloc' es global al proceso, por lo que se mide una sola ejecución a la vez: si ya hay una medición en curso,
+    # la ejecución se omite. Las asignaciones de otras solicitudes concurrentes también se cuentan en la medición,
+    # por lo que las cifras son exactas solo sin concurrencia (por ejemplo, en 'python perfil_memoria.py').
+
+    def __init__(self, muestreo=1.0, max_solicitudes=100):
+        self.muestreo = muestreo
+        self.lock = threading.Lock()
+        self.lock_medicion = threading.Lock()
+        self.local = threading.local()
+        self.etapas = {}
+        self.solicitudes = deque(maxlen=max_solicitudes)
+        self.medidas = 0
+        self.omitidas = 0
+
+    @contextmanager
+    def medir_solicitud(self, filas):
+        if random.random() >= self.muestreo or not self.lock_medicion.acquire(blocking=False):
+            with self.lock:
+                self.omitidas += 1
+            yield
+            return
+
+        solicitud = {'Fecha': datetime.now().isoformat(timespec='seconds'), 'Filas': filas, 'Etapas': {}}
+        self.local.solicitud = solicitud
+        self.local.pico = 0
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            actual, pico = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.local.solicitud = None
+            solicitud['Pico (KB)'] = round(max(pico, self.local.pico) / 1024, 1)
+            solicitud['Neto (KB)'] = round(actual / 1024, 1)
+            self.lock_medicion.release()
+            self.registrar(solicitud)
+
+    @contextmanager
+    def medir_etapa(self, nombre):
+        solicitud = getattr(self.local, 'solicitud', None)
+        if solicitud is None:
+            yield
+            return
+
+        # El pico de la etapa se mide desde la memoria ocupada al iniciarla, sin contar lo que ya asignaron las etapas anteriores
+        antes, pico_anterior = tracemalloc.get_traced_memory()
+        self.local.pico = max(self.local.pico, pico_anterior)
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            actual, pico = tracemalloc.get_traced_memory()
+            self.local.pico = max(self.local.pico, pico)
+            solicitud['Etapas'][nombre] = {'Pico (KB)': round((pico - antes) / 1024, 1), 'Neto (KB)': round((actual - antes) / 1024, 1)}
+
+    def registrar(self, solicitud):
+        with self.lock:
+            self.medidas += 1
+            self.solicitudes.append(solicitud)
+            for nombre, medicion in solicitud['Etapas'].items():
+                etapa = self.etapas.setdefault(nombre, {'Mediciones': 0, 'Filas': 0, 'Pico Total (KB)': 0.0, 'Pico Máximo (KB)': 0.0, 'Neto Total (KB)': 0.0})
+                etapa['Mediciones'] += 1
+                etapa['Filas'] += solicitud['Filas']
+                etapa['Pico Total (KB)'] += medicion['Pico (KB)']
+                etapa['Pico Máximo (KB)'] = max(etapa['Pico Máximo (KB)'], medicion['Pico (KB)'])
+                etapa['Neto Total (KB)'] += medicion['Neto (KB)']
+
+    def get_metricas(self):
+        with self.lock:
+            return {
+                'Solicitudes Medidas': self.medidas,
+                'Solicitudes Omitidas': self.omitidas,
+                'Muestreo': self.muestreo,
+                'Etapas': {
+                    nombre: {
+                        'Mediciones': etapa['Mediciones'],
+                        'Pico Promedio (KB)': round(etapa['Pico Total (KB)'] / etapa['Mediciones'], 1),
+                        'Pico Máximo (KB)': etapa['Pico Máximo (KB)'],
+                        'Neto Promedio (KB)': round(etapa['Neto Total (KB)'] / etapa['Mediciones'], 1),
+                        'Pico por Fila (KB)': round(etapa['Pico Total (KB)'] / etapa['Filas'], 2) if etapa['Filas'] else None
+                    }
+                    for nombre, etapa in self.etapas.items()
+                }
+            }
+
+    def get_solicitudes(self):
+        with self.lock:
+            return list(self.solicitudes)
+
+    def generar_reporte(self):
+        metricas = self.get_metricas()
+        lineas = [f'{"Etapa":<30} {"Mediciones":>10} {"Pico Prom. (KB)":>16} {"Pico Máx. (KB)":>15} {"Neto Prom. (KB)":>16} {"Pico/Fila (KB)":>15}']
+        for nombre, etapa in metricas['Etapas'].items():
+            lineas.append(f'{nombre:<30} {etapa["Mediciones"]:>10} {etapa["Pico Promedio (KB)"]:>16} {etapa["Pico Máximo (KB)"]:>15} '
+                          f'{etapa["Neto Promedio (KB)"]:>16} {etapa["Pico por Fila (KB)"]:>15}')
+        lineas.append(f'Solicitudes medidas: {metricas["Solicitudes Medidas"]}, omitidas: {metricas["Solicitudes Omitidas"]}')
+        return '\n'.join(lineas)
+
+    def guardar_reporte(self, ruta):
+        with open(ruta, 'w', encoding='utf-8') as archivo:
+            json.dump({'Métricas': self.get_metricas(), 'Solicitudes': self.get_solicitudes()}, archivo, ensure_ascii=False, indent=2)
+
+
+def comparar_reportes(ruta_base, ruta_actual, tolerancia):
+    # Detectar las etapas cuyo pico promedio creció más que la tolerancia (proporción) respecto al reporte base
+    with open(ruta_base, encoding='utf-8') as archivo:
+        base = json.load(archivo)['Métricas']['Etapas']
+    with open(ruta_actual, encoding='utf-8') as archivo:
+        actual = json.load(archivo)['Métricas']['Etapas']
+
+    regresiones = {}
+    for nombre, etapa in actual.items():
+        if nombre in base and etapa['Pico Promedio (KB)'] > base[nombre]['Pico Promedio (KB)'] * (1 + tolerancia):
+            regresiones[nombre] = {'Base (KB)': base[nombre]['Pico Promedio (KB)'], 'Actual (KB)': etapa['Pico Promedio (KB)']}
+    return regresiones
+
+
+def perfil_memoria_activo():
+    # El perfilado de memoria se activa con la variable de entorno PERFIL_MEMORIA
+    return os.getenv("PERFIL_MEMORIA", "0").lower() in ('1', 'true', 'si')
+
+
+def activar_perfil_memoria(muestreo=1.0, max_solicitudes=100):
+    # Instalar el recolector en el pipeline para que 'ejecutar_pipeline' mida cada etapa
+    prediccion.instrumentacion_memoria = RecolectorMemoria(muestreo, max_solicitudes)
+    return prediccion.instrumentacion_memoria
+
+
+def desactivar_perfil_memoria():
+    prediccion.instrumentacion_memoria = None
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from test_data import generar_perfiles_sinteticos
+    from versiones import cargar_version
+
+    parser = argparse.ArgumentParser(description='Mide la memoria asignada por cada etapa del pipeline sobre perfiles sintéticos.')
+    parser.add_argument('--perfiles', type=int, default=1000)
+    parser.add_argument('--lote', type=int, default=100, help='Cantidad de perfiles por ejecución del pipeline')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--salida', help='Ruta del archivo JSON donde guardar el reporte')
+    parser.add_argument('--comparar', metavar='REPORTE_BASE', help='Terminar con error si el pico de alguna etapa creció más que la tolerancia respecto a este reporte')
+    parser.add_argument('--tolerancia', type=float, default=0.2, help='Crecimiento máximo permitido del pico promedio de cada etapa (proporción)')
+    args = parser.parse_args()
+
+    load_dotenv()
+    version = cargar_version(os.getenv("USAR_TABLA_DECISION", "1") == "1")
+    list_data = generar_perfiles_sinteticos(args.perfiles, semilla=args.semilla)
+
+    # La primera ejecución llena las cachés del proceso y no se mide
+    prediccion.ejecutar_pipeline(list_data[:args.lote], version)
+    recolector = activar_perfil_memoria(max_solicitudes=args.perfiles // args.lote + 1)
+    for inicio in range(0, len(list_data), args.lote):
+        prediccion.ejecutar_pipeline(list_data[inicio:inicio + args.lote], version)
+
+    print(recolector.generar_reporte())
+    if args.salida:
+        recolector.guardar_reporte(args.salida)
+        print(f'Reporte guardado en {args.salida}')
+
+    if args.comparar:
+        if not args.salida:
+            parser.error('--comparar requiere --salida')
+        regresiones = comparar_reportes(args.comparar, args.salida, args.tolerancia)
+        if regresiones:
+            print(f'Etapas con un pico mayor al {args.tolerancia:.0%} del reporte base: {json.dumps(regresiones, ensure_ascii=False)}')
+            sys.exit(1)
+        print('Sin regresiones de memoria respecto al reporte base')
@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+import threading
+from collections import deque
+from time import perf_counter
+
+import expert_system
+
+
+class RecolectorReglas:
+    # Registra el tiempo de evaluación y la cantidad de coincidencias de cada sub-regla del sistema experto,
+    # además del nivel de riesgo asignado en cada lote (incluyendo los 'Riesgo Desconocido' que elimina filter_df)
+
+    def __init__(self, max_lotes=100):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reglas = {}
+        self.resultados = {}
+        self.lotes = deque(maxlen=max_lotes)
+
+    def medir_regla(self, nombre, regla, df_test):
+        inicio = perf_counter()
+        resultado = regla(df_test)
+        duracion = perf_counter() - inicio
+        coincidencias = int(resultado.sum())
+
+        with self.lock:
+            metricas = self.reglas.setdefault(nombre, {'Evaluaciones': 0, 'Filas': 0, 'Coincidencias': 0, 'Tiempo (ms)': 0.0})
+            metricas['Evaluaciones'] += 1
+            metricas['Filas'] += len(resultado)
+            metricas['Coincidencias'] += coincidencias
+            metricas['Tiempo (ms)'] += duracion * 1000
+
+        # Registrar también la sub-regla en el lote que se está evaluando en este hilo
+        lote = getattr(self.local, 'lote', None)
+        if lote is not None:
+            lote['Reglas'][nombre] = {'Coincidencias': coincidencias, 'Tiempo (ms)': round(duracion * 1000, 4)}
+
+        return resultado
+
+    def iniciar_lote(self, target_col, filas, metodo):
+        self.local.lote = {'Nivel de Riesgo': target_col, 'Método': metodo, 'Filas': filas, 'Reglas': {}}
+        self.local.inicio = perf_counter()
+
+    def finalizar_lote(self, riesgo):
+        lote = self.local.lote
+        self.local.lote = None
+        lote['Tiempo (ms)'] = round((perf_counter() - self.local.inicio) * 1000, 4)
+        lote['Resultados'] = {nivel: int(cantidad) for nivel, cantidad in riesgo.value_counts().items()}
+
+        with self.lock:
+            resultados = self.resultados.setdefault(lote['Nivel de Riesgo'], {'Lotes': 0, 'Filas': 0})
+            resultados['Lotes'] += 1
+            resultados['Filas'] += lote['Filas']
+            for nivel, cantidad in lote['Resultados'].items():
+                resultados[nivel] = resultados.get(nivel, 0) + cantidad
+            self.lotes.append(lote)
+
+    def get_metricas(self):
+        with self.lock:
+            # Ordenar las sub-reglas de mayor a menor costo total de evaluación
+            reglas = sorted(self.reglas.items(), key=lambda item: item[1]['Tiempo (ms)'], reverse=True)
+            return {
+                'Reglas': {
+                    nombre: {
+                        **metricas,
+                        'Tiempo (ms)': round(metricas['Tiempo (ms)'], 4),
+                        'Tiempo Promedio (ms)': round(metricas['Tiempo (ms)'] / metricas['Evaluaciones'], 4),
+                        'Tasa de Coincidencia': round(metricas['Coincidencias'] / metricas['Filas'], 4) if metricas['Filas'] else 0.0
+                    }
+                    for nombre, metricas in reglas
+                },
+                'Resultados': {target_col: dict(resultados) for target_col, resultados in self.resultados.items()},
+                'Lotes Registrados': len(self.lotes)
+            }
+
+    def get_lotes(self):
+        with self.lock:
+            return list(self.lotes)
+
+    def generar_reporte(self):
+        metricas = self.get_metricas()
+        tiempo_total = sum(regla['Tiempo (ms)'] for regla in metricas['Reglas'].values())
+
+        lineas = [f'{"Sub-regla":<75} {"Tiempo (ms)":>12} {"% Tiempo":>9} {"Coincidencias":>14} {"Tasa":>7}']
+        for nombre, regla in metricas['Reglas'].items():
+            porcentaje = regla['Tiempo (ms)'] / tiempo_total * 100 if tiempo_total else 0
+            lineas.append(f'{nombre:<75} {regla["Tiempo (ms)"]:>12.2f} {porcentaje:>8.1f}% {regla["Coincidencias"]:>14} {regla["Tasa de Coincidencia"]:>7.3f}')
+
+        lineas.append('')
+        for target_col, resultados in metricas['Resultados'].items():
+            desconocidos = resultados.get('Riesgo Desconocido', 0)
+            lineas.append(f'{target_col}: {resultados}')
+            lineas.append(f'  Filas eliminadas por filter_df (Riesgo Desconocido): {desconocidos} de {resultados["Filas"]}')
+
+        return '\n'.join(lineas)
+
+    def guardar_reporte(self, ruta):
+        with open(ruta, 'w', encoding='utf-8') as archivo:
+            json.dump({'Métricas': self.get_metricas(), 'Lotes': self.get_lotes()}, archivo, ensure_ascii=False, indent=2)
+
+
+def perfil_reglas_activo():
+    # La instrumentación de las reglas se activa con la variable de entorno PERFIL_REGLAS
+    return os.getenv("PERFIL_REGLAS", "0").lower() in ('1', 'true', 'si')
+
+
+def activar_perfil_reglas(max_lotes=100):
+    # Instalar el recolector en el sistema experto para que 'evaluar_regla' mida cada sub-regla
+    expert_system.instrumentacion_reglas = RecolectorReglas(max_lotes)
+    return expert_system.instrumentacion_reglas
+
+
+def desactivar_perfil_reglas():
+    expert_system.instrumentacion_reglas = None
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from test_data import generar_perfiles_sinteticos
+    from tabla_decision import preparar_perfiles, ejecutar_sistema_experto
+
+    parser = argparse.ArgumentParser(description='Perfila las sub-reglas del sistema experto sobre perfiles sintéticos.')
+    parser.add_argument('--perfiles', type=int, default=2000)
+    parser.add_argument('--lote', type=int, default=100, help='Cantidad de perfiles por lote')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--salida', help='Ruta del archivo JSON donde guardar el reporte')
+    args = parser.parse_args()
+
+    load_dotenv()
+    target_cols = [os.getenv("TARGET_COL_CANNABIS"), os.getenv("TARGET_COL_PSILOCIBINA")]
+
+    recolector = activar_perfil_reglas(max_lotes=args.perfiles // args.lote + 1)
+    list_data = generar_perfiles_sinteticos(args.perfiles, semilla=args.semilla)
+
+    # Evaluar las reglas directamente (sin la tabla de decisión) para medir cada sub-regla
+    for inicio in range(0, len(list_data), args.lote):
+        df_test = preparar_perfiles(list_data[inicio:inicio + args.lote])
+        for target_col in target_cols:
+            ejecutar_sistema_experto(df_test, target_col)
+
+    print(recolector.generar_reporte())
+    if args.salida:
+        recolector.guardar_reporte(args.salida)
+        print(f'Reporte guardado en {args.salida}')
@@ -0,0 +1,104 @@
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter
+
+import numpy as np
+from dotenv import load_dotenv
+
+
+# Cantidad de esperas recientes por clase con las que se calculan los percentiles
+max_esperas_registradas = 1000
+
+
+class ColaLlena(Exception):
+    pass
+
+
+class PlanificadorPrioridades:
+    # Reparte los turnos de ejecución del pipeline entre clases de prioridad.
+    # Un turno se entrega a la clase de mayor prioridad con trabajo en espera que no haya alcanzado su límite de concurrencia,
+    # y dentro de cada clase en orden de llegada. Los trabajos de '/jobs' piden un turno para cada parte (sin límite de cola,
+    # porque ya fueron aceptados), para que las solicitudes interactivas que lleguen mientras tanto se atiendan entre una parte y la siguiente.
+
+    def __init__(self, clases, concurrencia_total):
+        # 'clases' en orden de prioridad: {nombre: {'Concurrencia': ..., 'Max Cola': ...}}
+        self.clases = clases
+        self.orden = list(clases)
+        self.concurrencia_total = concurrencia_total
+        self.condicion = threading.Condition()
+        self.en_cola = {clase: deque() for clase in clases}
+        self.en_ejecucion = {clase: 0 for clase in clases}
+        self.metricas = {clase: {'Turnos': 0, 'Rechazadas': 0, 'Espera Total (s)': 0.0, 'Esperas': deque(maxlen=max_esperas_registradas)} for clase in clases}
+
+    def puede_entrar(self, clase, ticket):
+        if sum(self.en_ejecucion.values()) >= self.concurrencia_total:
+            return False
+        if self.en_ejecucion[clase] >= self.clases[clase]['Concurrencia'] or self.en_cola[clase][0] is not ticket:
+            return False
+        # Ceder el turno a las clases de mayor prioridad que tengan trabajo en espera y capacidad para ejecutarlo
+        for superior in self.orden[:self.orden.index(clase)]:
+            if self.en_cola[superior] and self.en_ejecucion[superior] < self.clases[superior]['Concurrencia']:
+                return False
+        return True
+
+    @contextmanager
+    def turno(self, clase, limitar_cola=True):
+        ticket = object()
+        llegada = perf_counter()
+        with self.condicion:
+            if limitar_cola and len(self.en_cola[clase]) >= self.clases[clase]['Max Cola']:
+                self.metricas[clase]['Rechazadas'] += 1
+                raise ColaLlena(f'La cola de la clase {clase} está llena ({self.clases[clase]["Max Cola"]} en espera)')
+
+            self.en_cola[clase].append(ticket)
+            try:
+                while not self.puede_entrar(clase, ticket):
+                    self.condicion.wait()
+            finally:
+                self.en_cola[clase].remove(ticket)
+                # El siguiente de la cola (o de otra clase) puede estar esperando a que este ticket salga
+                self.condicion.notify_all()
+
+            self.en_ejecucion[clase] += 1
+            espera = perf_counter() - llegada
+            self.metricas[clase]['Turnos'] += 1
+            self.metricas[clase]['Espera Total (s)'] += espera
+            self.metricas[clase]['Esperas'].append(espera)
+
+        try:
+            yield
+        finally:
+            with self.condicion:
+                self.en_ejecucion[clase] -= 1
+                self.condicion.notify_all()
+
+    def get_metricas(self):
+        with self.condicion:
+            metricas = {}
+            for clase, configuracion in self.clases.items():
+                esperas_ms = np.array(self.metricas[clase]['Esperas']) * 1000
+                turnos = self.metricas[clase]['Turnos']
+                metricas[clase] = {
+                    **configuracion,
+                    'En Cola': len(self.en_cola[clase]),
+                    'En Ejecución': self.en_ejecucion[clase],
+                    'Turnos': turnos,
+                    'Rechazadas': self.metricas[clase]['Rechazadas'],
+                    'Espera Media (ms)': round(self.metricas[clase]['Espera Total (s)'] / turnos * 1000, 2) if turnos else None,
+                    'Espera p50 (ms)': round(float(np.percentile(esperas_ms, 50)), 2) if len(esperas_ms) else None,
+                    'Espera p95 (ms)': round(float(np.percentile(esperas_ms, 95)), 2) if len(esperas_ms) else None,
+                    'Espera Máxima (ms)': round(float(esperas_ms.max()), 2) if len(esperas_ms) else None
+                }
+            return {'Concurrencia Total': self.concurrencia_total, 'Clases': metricas}
+
+
+def cargar_planificador():
+    # Dos clases: las solicitudes de '/predict-risk' y las partes de los trabajos de '/jobs'
+    load_dotenv()
+    clases = {
+        'Interactiva': {'Concurrencia': int(os.getenv("PLANIFICADOR_CONCURRENCIA_INTERACTIVA", "2")), 'Max Cola': int(os.getenv("PLANIFICADOR_MAX_COLA_INTERACTIVA", "100"))},
+        'Masiva': {'Concurrencia': int(os.getenv("PLANIFICADOR_CONCURRENCIA_MASIVA", "1")), 'Max Cola': int(os.getenv("PLANIFICADOR_MAX_COLA_MASIVA", "10"))}
+    }
+    return PlanificadorPrioridades(clases, int(os.getenv("PLANIFICADOR_CONCURRENCIA", "2")))
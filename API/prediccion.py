@@ -0,0 +1,205 @@
+from contextlib import nullcontext
+
+import pandas as pd
+import numpy as np
+
+from utils import divide_dataset, encode_risk_level, filter_df, setup_training_data, setup_test_data, map_values
+from tabla_decision import ejecutar_sistema_experto
+from definitions import dict_encoder_riesgo_tratamiento
+
+
+# Cantidad de variables con mayor contribución que se reportan por clase al explicar una predicción
+max_variables_explicacion = 10
+
+# Recolector de la memoria asignada por cada etapa del pipeline (ver 'perfil_memoria.py'); None si el perfilado está desactivado
+instrumentacion_memoria = None
+
+# Monitor de deriva del tráfico respecto a los datos de entrenamiento (ver 'monitor_deriva.py'); None si está desactivado
+monitor_deriva = None
+
+
+def medir_etapa(nombre):
+    return instrumentacion_memoria.medir_etapa(nombre) if instrumentacion_memoria is not None else nullcontext()
+
+
+def get_condicion_determinante_psilocibina(df_test, reglas):
+    # Reporta una condición riesgosa o ha experimentado un efecto negativo determinante. Las reglas de psilocibina no tienen
+    # una sub-regla equivalente a 'get_high_risk_cannabis_condicion_determinante', por lo que solo se usa para el cortocircuito.
+    return (
+        reglas.get_columns(df_test, reglas.condiciones_medicas_riesgosas).eq(True).any(axis=1) |
+        reglas.get_columns(df_test, reglas.efectos_negativos_determinantes_psilocibina).eq(True).any(axis=1)
+    )
+
+
+def get_perfiles_decisivos(df_test, target_col, reglas):
+    # Perfiles a los que el sistema experto asignó 'Riesgo Alto' y que reportan una condición riesgosa o un efecto negativo determinante
+    if 'Cannabis' in target_col:
+        determinante = reglas.get_high_risk_cannabis_condicion_determinante(df_test)
+    else:
+        determinante = get_condicion_determinante_psilocibina(df_test, reglas)
+    return (df_test[target_col] == 'Riesgo Alto') & determinante
+
+
+def predecir_modelo(modelo, df_test_encoded_model, decisivos=None):
+    # Ejecutar el modelo solo sobre los perfiles en los que las reglas no son decisivas; el resto conserva el 'Riesgo Alto' del sistema experto
+    if df_test_encoded_model.empty:
+        return np.array([0]), ['Sin Predicción']
+
+    if decisivos is None:
+        return modelo.predict(df_test_encoded_model), ['Modelo Gradient Boosting'] * len(df_test_encoded_model)
+
+    decisivos = decisivos.reindex(df_test_encoded_model.index, fill_value=False).to_numpy()
+    y_pred = np.full(len(df_test_encoded_model), dict_encoder_riesgo_tratamiento['Riesgo Alto'])
+    if not decisivos.all():
+        y_pred[~decisivos] = modelo.predict(df_test_encoded_model[~decisivos])
+    return y_pred, list(np.where(decisivos, 'Sistema Experto', 'Modelo Gradient Boosting'))
+
+
+def ejecutar_pipeline(list_data, version, sombra=None, monitorear=True):
+    # Con el perfilado de memoria activo, la ejecución completa se registra como una solicitud con la memoria de cada etapa
+    if instrumentacion_memoria is None:
+        return ejecutar_etapas(list_data, version, sombra, monitorear)
+    with instrumentacion_memoria.medir_solicitud(len(list_data)):
+        return ejecutar_etapas(list_data, version, sombra, monitorear)
+
+
+def ejecutar_etapas(list_data, version, sombra=None, monitorear=True):
+    # Ejecutar el pipeline completo de preprocesamiento, sistema experto y modelos para los perfiles recibidos,
+    # usando los modelos, reglas y datos de entrenamiento de una única versión del servicio
+
+    # Convertir los perfiles en un DataFrame, preprocesarlos y codificar las variables con el motor de la versión.
+    # 'df_test' lo recibe el sistema experto y 'df_test_encoded' se divide por sustancia para los modelos.
+    df_test, df_test_encoded = version.motor.procesar(list_data, medir_etapa)
+
+    # Dividir el dataset de prueba según la sustancia
+    with medir_etapa('divide_dataset'):
+        df_test_encoded_cannabis, df_test_encoded_psilocibina = divide_dataset(df_test_encoded)
+
+    # Ejecutar el sistema experto con los conjuntos de reglas para determinar el nivel de riesgo del individuo
+    with medir_etapa('Sistema Experto'):
+        riesgo_cannabis = ejecutar_sistema_experto(df_test, version.target_col_cannabis, version.tabla_decision, version.reglas)
+        riesgo_psilocibina = ejecutar_sistema_experto(df_test, version.target_col_psilocibina, version.tabla_decision, version.reglas)
+        df_test = df_test.assign(**{version.target_col_cannabis: riesgo_cannabis, version.target_col_psilocibina: riesgo_psilocibina})
+
+    # Codificar el nivel de riesgo
+    with medir_etapa('encode_risk_level'):
+        df_test_encoded_cannabis = encode_risk_level(df_test_encoded_cannabis.assign(**{version.target_col_cannabis: riesgo_cannabis}), version.target_col_cannabis)
+        df_test_encoded_psilocibina = encode_risk_level(df_test_encoded_psilocibina.assign(**{version.target_col_psilocibina: riesgo_psilocibina}), version.target_col_psilocibina)
+
+    # Filtrar los datos de prueba para eliminar filas sin predicciones de riesgo
+    with medir_etapa('filter_df'):
+        df_test_encoded_cannabis = filter_df(df_test_encoded_cannabis, version.target_col_cannabis)
+        df_test_encoded_psilocibina = filter_df(df_test_encoded_psilocibina, version.target_col_psilocibina)
+
+
+    # Generar el DF para el modelo con las columnas del conjunto de prueba de los datos de entrenamiento
+    # (los mismos pasos de 'balance_and_setup_test_data', separados para medir la memoria de cada uno)
+    with medir_etapa('setup_training_data'):
+        _, _, _, X_test_riesgo_cannabis, _, _ = setup_training_data(version.df_encoded_cannabis, version.target_col_cannabis, version.random_state_cannabis)
+        _, _, _, X_test_riesgo_psilocibina, _, _ = setup_training_data(version.df_encoded_psilocibina, version.target_col_psilocibina, version.random_state_psilocibina)
+    with medir_etapa('setup_test_data'):
+        df_test_encoded_cannabis_model, _ = setup_test_data(df_test_encoded_cannabis, X_test_riesgo_cannabis, version.target_col_cannabis)
+        df_test_encoded_psilocibina_model, _ = setup_test_data(df_test_encoded_psilocibina, X_test_riesgo_psilocibina, version.target_col_psilocibina)
+
+    # Ejecutar el modelo pre cargado para realizar predicciones para ambas sustancias.
+    # Con el cortocircuito activo, los perfiles en los que las reglas son decisivas no se envían al modelo.
+    with medir_etapa('Modelos'):
+        decisivos_cannabis = get_perfiles_decisivos(df_test, version.target_col_cannabis, version.reglas) if version.cortocircuito_cannabis else None
+        decisivos_psilocibina = get_perfiles_decisivos(df_test, version.target_col_psilocibina, version.reglas) if version.cortocircuito_psilocibina else None
+
+        y_test_pred_riesgo_cannabis, origen_cannabis = predecir_modelo(version.model_cannabis, df_test_encoded_cannabis_model, decisivos_cannabis)
+        y_test_pred_riesgo_psilocibina, origen_psilocibina = predecir_modelo(version.model_psilocibina, df_test_encoded_psilocibina_model, decisivos_psilocibina)
+
+
+    # Enviar las filas codificadas y los niveles de riesgo al monitor de deriva (no bloquea la solicitud);
+    # las filas eliminadas por filter_df se cuentan como 'Riesgo Desconocido'. Sin 'monitorear' (calentamiento) no se registran.
+    if monitorear and monitor_deriva is not None:
+        monitor_deriva.registrar(version, len(df_test), {
+            'Cannabis': (df_test_encoded_cannabis, y_test_pred_riesgo_cannabis),
+            'Psilocibina': (df_test_encoded_psilocibina, y_test_pred_riesgo_psilocibina)
+        })
+
+    # Enviar las filas codificadas a la evaluación en segundo plano de los modelos candidatos (no bloquea la solicitud)
+    if sombra is not None:
+        sombra.enviar([
+            ('Cannabis', df_test_encoded_cannabis_model, y_test_pred_riesgo_cannabis, df_test_encoded_cannabis[version.target_col_cannabis].to_numpy()),
+            ('Psilocibina', df_test_encoded_psilocibina_model, y_test_pred_riesgo_psilocibina, df_test_encoded_psilocibina[version.target_col_psilocibina].to_numpy())
+        ])
+
+    return df_test, {
+        'Cannabis': (df_test_encoded_cannabis_model, y_test_pred_riesgo_cannabis, origen_cannabis),
+        'Psilocibina': (df_test_encoded_psilocibina_model, y_test_pred_riesgo_psilocibina, origen_psilocibina)
+    }
+
+
+def calcular_predicciones(list_data, version, sombra=None):
+    # Predicciones de todos los perfiles recibidos, una fila por perfil y en el mismo orden.
+    # Los perfiles sin nivel de riesgo conocido para una sustancia no pasan por su modelo y quedan con 'Riesgo Desconocido'.
+    df_test, modelos = ejecutar_pipeline(list_data, version, sombra)
+
+    df_resultados = pd.DataFrame(index=df_test.index)
+    for sustancia, target_col in (('Cannabis', version.target_col_cannabis), ('Psilocibina', version.target_col_psilocibina)):
+        df_test_encoded_model, y_pred, origen = modelos[sustancia]
+        if df_test_encoded_model.empty:
+            y_pred, origen = pd.Series(dtype=int), pd.Series(dtype=object)
+        else:
+            y_pred, origen = pd.Series(y_pred, index=df_test_encoded_model.index), pd.Series(origen, index=df_test_encoded_model.index)
+
+        df_resultados[f'Predicción Sistema Experto {sustancia}'] = df_test[target_col]
+        df_resultados[f'Predicción Modelo Gradient Boosting {sustancia}'] = map_values(y_pred.reindex(df_resultados.index, fill_value=0).to_numpy())
+        df_resultados[f'Origen Predicción {sustancia}'] = origen.reindex(df_resultados.index, fill_value='Sin Predicción')
+
+    df_resultados['Versión'] = version.version
+    return df_resultados
+
+
+def get_posicion_perfil(df_test_encoded_model, etiqueta=0):
+    # Posición del perfil en las filas del modelo, o None si filter_df lo eliminó ('Riesgo Desconocido'): las predicciones
+    # del modelo solo incluyen las filas que llegaron a él, por lo que se buscan por la etiqueta del perfil y no por posición
+    if etiqueta not in df_test_encoded_model.index:
+        return None
+    return df_test_encoded_model.index.get_loc(etiqueta)
+
+
+def calcular_prediccion(list_data, version, explicar=False, sombra=None, monitorear=True):
+    # Respuesta de '/predict-risk' para el primer perfil recibido
+    df_test, modelos = ejecutar_pipeline(list_data, version, sombra, monitorear)
+    df_test_encoded_cannabis_model, y_test_pred_riesgo_cannabis, origen_cannabis = modelos['Cannabis']
+    df_test_encoded_psilocibina_model, y_test_pred_riesgo_psilocibina, origen_psilocibina = modelos['Psilocibina']
+    posicion_cannabis = get_posicion_perfil(df_test_encoded_cannabis_model)
+    posicion_psilocibina = get_posicion_perfil(df_test_encoded_psilocibina_model)
+
+    # Reemplazar los valores codificados para obtener el nivel de riesgo en lenguaje natural;
+    # el perfil que no llegó al modelo queda con 'Riesgo Desconocido', igual que en 'calcular_predicciones'
+    riesgo_cannabis = map_values(y_test_pred_riesgo_cannabis[posicion_cannabis] if posicion_cannabis is not None else 0)
+    riesgo_psilocibina = map_values(y_test_pred_riesgo_psilocibina[posicion_psilocibina] if posicion_psilocibina is not None else 0)
+
+    resultado = {
+        "Riesgo Cannabis": {
+            "Predicción Sistema Experto": df_test['Nivel de Riesgo Tratamiento Cannabis'][0],
+            "Predicción Modelo Gradient Boosting": str(riesgo_cannabis)
+        },
+        "Riesgo Psilocibina": {
+            "Predicción Sistema Experto": df_test['Nivel de Riesgo Tratamiento Psilocibina'][0],
+            "Predicción Modelo Gradient Boosting": str(riesgo_psilocibina)
+        },
+        "Versión": version.version
+    }
+
+    # Reportar qué componente produjo la predicción cuando el cortocircuito está activo ('Sin Predicción' si el perfil no llegó al modelo)
+    if version.cortocircuito_cannabis:
+        resultado["Riesgo Cannabis"]["Origen Predicción"] = origen_cannabis[posicion_cannabis] if posicion_cannabis is not None else 'Sin Predicción'
+    if version.cortocircuito_psilocibina:
+        resultado["Riesgo Psilocibina"]["Origen Predicción"] = origen_psilocibina[posicion_psilocibina] if posicion_psilocibina is not None else 'Sin Predicción'
+
+    # Agregar la contribución de cada variable a la predicción de los modelos
+    # (solo si el perfil llegó al modelo; las filas del modelo no incluyen los perfiles con 'Riesgo Desconocido')
+    if explicar:
+        if posicion_cannabis is not None:
+            resultado["Riesgo Cannabis"]["Explicación Modelo Gradient Boosting"] = version.explicador_cannabis.explicar_perfiles(
+                df_test_encoded_cannabis_model.loc[[0]], top=max_variables_explicacion)[0]
+        if posicion_psilocibina is not None:
+            resultado["Riesgo Psilocibina"]["Explicación Modelo Gradient Boosting"] = version.explicador_psilocibina.explicar_perfiles(
+                df_test_encoded_psilocibina_model.loc[[0]], top=max_variables_explicacion)[0]
+
+    return resultado
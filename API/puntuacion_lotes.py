@@ -0,0 +1,397 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter
+
+import pandas as pd
+from dotenv import load_dotenv
+
+import expert_system
+from definitions import columnas_df
+from ingesta import guardar_atomico
+from motores import motores_disponibles
+from prediccion import calcular_predicciones
+from validacion import validar_perfiles
+from versiones import cargar_version, calcular_huella_artefactos, get_rutas_modelos, ruta_datos_cannabis, ruta_datos_psilocibina
+
+
+# Nombre del manifiesto del trabajo dentro del directorio compartido
+nombre_manifiesto = 'manifiesto.json'
+
+# Versión del servicio cargada una sola vez en cada proceso de trabajo
+version_proceso = None
+
+
+def calcular_huella_archivo(ruta, tamano_bloque=1 << 20):
+    huella = hashlib.sha256()
+    with open(ruta, 'rb') as archivo:
+        for bloque in iter(lambda: archivo.read(tamano_bloque), b''):
+            huella.update(bloque)
+    return huella.hexdigest()
+
+
+def contar_filas(ruta):
+    return sum(len(bloque) for bloque in pd.read_csv(ruta, usecols=[0], chunksize=1_000_000))
+
+
+def calcular_desplazamientos(ruta, filas_por_fragmento):
+    # Posición en bytes del inicio de cada fragmento, en una sola lectura del archivo, para que cada fragmento se lea desde ahí
+    # en lugar de recorrer todas las filas anteriores. Un registro termina en un salto de línea fuera de comillas (una respuesta
+    # entre comillas puede tener saltos de línea) y las líneas vacías se omiten, como en pandas.
+    desplazamientos, filas, en_comillas = [], 0, False
+    with open(ruta, 'rb') as archivo:
+        posicion = len(archivo.readline())
+        for linea in archivo:
+            if not en_comillas and linea.strip():
+                if filas % filas_por_fragmento == 0:
+                    desplazamientos.append(posicion)
+                filas += 1
+            if linea.count(b'"') % 2:
+                en_comillas = not en_comillas
+            posicion += len(linea)
+    return desplazamientos
+
+
+def get_huella_version():
+    # Misma huella que 'cargar_version', sin cargar los modelos
+    return calcular_huella_artefactos([*get_rutas_modelos(), ruta_datos_cannabis, ruta_datos_psilocibina, expert_system.__file__])
+
+
+def get_ruta_fragmento(directorio, numero, extension):
+    return os.path.join(directorio, f'fragmento_{numero:05d}.{extension}')
+
+
+def planificar(ruta_entrada, directorio, filas_por_fragmento):
+    # Dividir la entrada en fragmentos de filas consecutivas y registrar el plan en el manifiesto del directorio compartido.
+    # Si el manifiesto ya existe (trabajo reanudado o iniciado desde otro equipo) se usa el plan registrado.
+    os.makedirs(directorio, exist_ok=True)
+    ruta_manifiesto = os.path.join(directorio, nombre_manifiesto)
+    huella_entrada = calcular_huella_archivo(ruta_entrada)
+
+    if not os.path.exists(ruta_manifiesto):
+        filas = contar_filas(ruta_entrada)
+        fragmentos = -(-filas // filas_por_fragmento)
+        # Si el recuento no coincide con el de pandas (formato inusual), los fragmentos se leen saltando las filas anteriores
+        desplazamientos = calcular_desplazamientos(ruta_entrada, filas_por_fragmento)
+        manifiesto = {
+            'Entrada': os.path.abspath(ruta_entrada),
+            'Huella Entrada': huella_entrada,
+            'Filas': filas,
+            'Filas por Fragmento': filas_por_fragmento,
+            'Fragmentos': fragmentos,
+            'Desplazamientos': desplazamientos if len(desplazamientos) == fragmentos else None,
+            'Versión': get_huella_version(),
+            'Creado': datetime.now().isoformat(timespec='seconds')
+        }
+
+        # Si dos equipos planifican a la vez, el enlace falla para el segundo y ambos usan el plan del primero
+        ruta_temporal = ruta_manifiesto + f'.{socket.gethostname()}.{os.getpid()}'
+        with open(ruta_temporal, 'w', encoding='utf-8') as archivo:
+            json.dump(manifiesto, archivo, ensure_ascii=False, indent=2)
+        try:
+            os.link(ruta_temporal, ruta_manifiesto)
+        except FileExistsError:
+            pass
+        os.remove(ruta_temporal)
+
+    with open(ruta_manifiesto, encoding='utf-8') as archivo:
+        manifiesto = json.load(archivo)
+
+    if manifiesto['Huella Entrada'] != huella_entrada:
+        raise ValueError(f'La entrada {ruta_entrada} no corresponde al trabajo registrado en {ruta_manifiesto}')
+    return manifiesto
+
+
+def es_reclamo_abandonado(ruta_reclamo, expiracion):
+    # Un reclamo del mismo equipo está abandonado si su proceso ya no existe (trabajo interrumpido).
+    # Los de otros equipos solo se consideran abandonados cuando superan 'expiracion' segundos (equipo caído).
+    if time.time() - os.path.getmtime(ruta_reclamo) >= expiracion:
+        return True
+    try:
+        with open(ruta_reclamo, encoding='utf-8') as archivo:
+            reclamo = json.load(archivo)
+    except ValueError:
+        # Reclamo recién creado y aún sin contenido
+        return False
+    if reclamo['Equipo'] != socket.gethostname():
+        return False
+    try:
+        os.kill(reclamo['Proceso'], 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def reclamar_fragmento(directorio, numero, expiracion):
+    # Crear el archivo de reclamo de forma exclusiva; solo un proceso (de cualquier equipo) puede procesar el fragmento
+    ruta_reclamo = get_ruta_fragmento(directorio, numero, 'reclamo')
+    reclamo = json.dumps({'Equipo': socket.gethostname(), 'Proceso': os.getpid(), 'Fecha': datetime.now().isoformat(timespec='seconds')})
+
+    for _ in range(2):
+        try:
+            descriptor = os.open(ruta_reclamo, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if not es_reclamo_abandonado(ruta_reclamo, expiracion):
+                    return False
+                # Renombrar el reclamo abandonado es atómico: solo uno de los procesos que lo intenten lo consigue
+                os.rename(ruta_reclamo, ruta_reclamo + f'.abandonado.{socket.gethostname()}.{os.getpid()}')
+                os.remove(ruta_reclamo + f'.abandonado.{socket.gethostname()}.{os.getpid()}')
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as archivo:
+            archivo.write(reclamo)
+        return True
+    return False
+
+
+def es_reclamo_propio(ruta_reclamo):
+    # El reclamo pertenece a este proceso si registra su equipo y su PID (otro proceso puede haberlo tomado al considerarlo abandonado)
+    try:
+        with open(ruta_reclamo, encoding='utf-8') as archivo:
+            reclamo = json.load(archivo)
+    except (FileNotFoundError, ValueError):
+        return False
+    return reclamo['Equipo'] == socket.gethostname() and reclamo['Proceso'] == os.getpid()
+
+
+@contextmanager
+def mantener_reclamo(ruta_reclamo, expiracion):
+    # Renovar la fecha de modificación del reclamo mientras se puntúa el fragmento, para que un fragmento que tarda más
+    # que 'expiracion' no se considere abandonado y otro proceso no lo vuelva a puntuar
+    detener = threading.Event()
+
+    def renovar():
+        while not detener.wait(expiracion / 4):
+            if not es_reclamo_propio(ruta_reclamo):
+                return
+            try:
+                os.utime(ruta_reclamo)
+            except FileNotFoundError:
+                return
+
+    hilo = threading.Thread(target=renovar, daemon=True)
+    hilo.start()
+    try:
+        yield
+    finally:
+        detener.set()
+        hilo.join()
+
+
+def get_perfiles(df):
+    # Convertir las filas leídas como texto al formato de las solicitudes a la API (la calificación como entero).
+    # Las celdas vacías y los nulos de pandas ('NA', 'N/A', ...) se envían como None, que el preprocesamiento trata como 'Sin Dato'.
+    df = df[columnas_df].replace({'': None})
+    df = df.astype(object).where(df.notna(), None)
+    # Como Series de objetos, para que las calificaciones vacías no conviertan la columna en float
+    df['Calificación Tratamiento'] = pd.Series([int(valor) if valor is not None and valor.isdigit() else valor for valor in df['Calificación Tratamiento']],
+                                               index=df.index, dtype=object)
+    return df.values.tolist()
+
+
+def leer_fragmento(ruta_entrada, inicio, filas, desplazamiento=None):
+    # Leer todo como texto para conservar las respuestas tal como están en el archivo (ej. la calificación).
+    # Con 'desplazamiento' (posición en bytes de la fila 'inicio', ver 'calcular_desplazamientos') la lectura empieza en esa posición.
+    if desplazamiento is None:
+        df = pd.read_csv(ruta_entrada, skiprows=range(1, inicio + 1), nrows=filas, dtype=str, usecols=columnas_df)
+    else:
+        columnas = list(pd.read_csv(ruta_entrada, nrows=0).columns)
+        with open(ruta_entrada, 'rb') as archivo:
+            archivo.seek(desplazamiento)
+            df = pd.read_csv(archivo, header=None, names=columnas, nrows=filas, dtype=str, usecols=columnas_df)
+    return get_perfiles(df)
+
+
+def puntuar_perfiles(perfiles, version):
+    # Si el lote falla se divide a la mitad hasta aislar los perfiles con error, sin repetir fila por fila todo el lote
+    try:
+        df_resultados = calcular_predicciones(perfiles, version)
+        df_resultados['Error'] = None
+        return [df_resultados]
+    except Exception as e:
+        if len(perfiles) == 1:
+            return [pd.DataFrame({'Versión': [version.version], 'Error': [str(e)]})]
+        mitad = len(perfiles) // 2
+        return puntuar_perfiles(perfiles[:mitad], version) + puntuar_perfiles(perfiles[mitad:], version)
+
+
+def puntuar_filas(list_data, version, lote):
+    # Los perfiles con respuestas no válidas no pasan por el pipeline y quedan con el error de validación
+    validos, errores = validar_perfiles(list_data)
+    perfiles = [list_data[i] for i in validos]
+
+    resultados = []
+    for inicio in range(0, len(perfiles), lote):
+        resultados.extend(puntuar_perfiles(perfiles[inicio:inicio + lote], version))
+    df_resultados = pd.concat(resultados, ignore_index=True) if resultados else pd.DataFrame(columns=['Versión', 'Error'])
+    df_resultados.index = validos
+
+    df_resultados = df_resultados.reindex(range(len(list_data)))
+    df_resultados['Versión'] = version.version
+    df_resultados.loc[list(errores), 'Error'] = [json.dumps(errores[i], ensure_ascii=False) for i in errores]
+    return df_resultados.reset_index(drop=True)
+
+
+def inicializar_proceso(usar_tabla_decision):
+    global version_proceso
+    version_proceso = cargar_version(usar_tabla_decision)
+
+
+def procesar_fragmento(ruta_entrada, directorio, manifiesto, numero, lote, expiracion):
+    ruta_resultado = get_ruta_fragmento(directorio, numero, 'csv')
+    ruta_estado = get_ruta_fragmento(directorio, numero, 'json')
+    ruta_reclamo = get_ruta_fragmento(directorio, numero, 'reclamo')
+    if os.path.exists(ruta_estado):
+        return {'Fragmento': numero, 'Estado': 'Completado Previamente'}
+    if not reclamar_fragmento(directorio, numero, expiracion):
+        return {'Fragmento': numero, 'Estado': 'Reclamado por Otro Proceso'}
+
+    try:
+        if version_proceso.version != manifiesto['Versión']:
+            raise RuntimeError(f'La versión cargada ({version_proceso.version}) no corresponde a la del trabajo ({manifiesto["Versión"]})')
+
+        inicio_proceso = perf_counter()
+        inicio = numero * manifiesto['Filas por Fragmento']
+        with mantener_reclamo(ruta_reclamo, expiracion):
+            desplazamientos = manifiesto.get('Desplazamientos')
+            list_data = leer_fragmento(ruta_entrada, inicio, manifiesto['Filas por Fragmento'], desplazamientos[numero] if desplazamientos else None)
+            df_resultados = puntuar_filas(list_data, version_proceso, lote)
+            df_resultados.insert(0, 'Fila', range(inicio, inicio + len(df_resultados)))
+
+        # Si otro proceso tomó el fragmento (por ejemplo, el equipo dejó de responder más de 'expiracion' segundos), el resultado es suyo
+        if not es_reclamo_propio(ruta_reclamo):
+            return {'Fragmento': numero, 'Estado': 'Reclamado por Otro Proceso'}
+
+        # Primero el resultado y luego el estado: un fragmento solo se considera completo si su estado existe
+        guardar_atomico(ruta_resultado, lambda ruta_temporal: df_resultados.to_csv(ruta_temporal, index=False))
+        estado = {
+            'Fragmento': numero,
+            'Estado': 'Completado',
+            'Filas': len(df_resultados),
+            'Errores': int(df_resultados['Error'].notna().sum()),
+            'Versión': version_proceso.version,
+            'Equipo': socket.gethostname(),
+            'Tiempo (s)': round(perf_counter() - inicio_proceso, 3),
+            'Fecha': datetime.now().isoformat(timespec='seconds')
+        }
+
+        def escribir(ruta_temporal):
+            with open(ruta_temporal, 'w', encoding='utf-8') as archivo:
+                json.dump(estado, archivo, ensure_ascii=False, indent=2)
+        guardar_atomico(ruta_estado, escribir)
+        return estado
+    finally:
+        # Solo se elimina el reclamo propio, nunca el de un proceso que tomó el fragmento después
+        if es_reclamo_propio(ruta_reclamo):
+            try:
+                os.remove(ruta_reclamo)
+            except FileNotFoundError:
+                pass
+
+
+def get_estado(directorio, manifiesto):
+    completados = [get_ruta_fragmento(directorio, numero, 'json') for numero in range(manifiesto['Fragmentos'])]
+    completados = [ruta for ruta in completados if os.path.exists(ruta)]
+    reclamados = glob.glob(os.path.join(directorio, 'fragmento_*.reclamo'))
+    errores = 0
+    for ruta in completados:
+        with open(ruta, encoding='utf-8') as archivo:
+            errores += json.load(archivo)['Errores']
+    return {
+        'Fragmentos': manifiesto['Fragmentos'],
+        'Completados': len(completados),
+        'En Proceso': len(reclamados),
+        'Pendientes': manifiesto['Fragmentos'] - len(completados) - len(reclamados),
+        'Filas con Error': errores
+    }
+
+
+def ejecutar_trabajo(ruta_entrada, directorio, filas_por_fragmento, procesos, lote, expiracion, usar_tabla_decision):
+    manifiesto = planificar(ruta_entrada, directorio, filas_por_fragmento)
+    if manifiesto['Versión'] != get_huella_version():
+        raise RuntimeError(f'Los artefactos actuales ({get_huella_version()}) no corresponden a la versión del trabajo ({manifiesto["Versión"]})')
+
+    pendientes = [numero for numero in range(manifiesto['Fragmentos']) if not os.path.exists(get_ruta_fragmento(directorio, numero, 'json'))]
+    print(f'{manifiesto["Fragmentos"]} fragmentos, {len(pendientes)} pendientes', flush=True)
+
+    if procesos == 1:
+        # Un único proceso (por ejemplo con Polars, que ya usa todos los núcleos): los fragmentos se procesan en este proceso
+        inicializar_proceso(usar_tabla_decision)
+        for numero in pendientes:
+            informar_fragmento(procesar_fragmento(ruta_entrada, directorio, manifiesto, numero, lote, expiracion))
+        return get_estado(directorio, manifiesto)
+
+    with ProcessPoolExecutor(max_workers=procesos, initializer=inicializar_proceso, initargs=(usar_tabla_decision,)) as ejecutor:
+        futuros = [ejecutor.submit(procesar_fragmento, ruta_entrada, directorio, manifiesto, numero, lote, expiracion) for numero in pendientes]
+        for futuro in as_completed(futuros):
+            informar_fragmento(futuro.result())
+
+    return get_estado(directorio, manifiesto)
+
+
+def informar_fragmento(estado):
+    detalle = f'{estado["Filas"]} filas, {estado["Errores"]} errores, {estado["Tiempo (s)"]} s' if estado['Estado'] == 'Completado' else ''
+    print(f'Fragmento {estado["Fragmento"]:05d}: {estado["Estado"]} {detalle}', flush=True)
+
+
+def combinar(directorio, ruta_salida):
+    # Unir los fragmentos en orden en un único archivo, solo cuando el trabajo está completo
+    with open(os.path.join(directorio, nombre_manifiesto), encoding='utf-8') as archivo:
+        manifiesto = json.load(archivo)
+    estado = get_estado(directorio, manifiesto)
+    if estado['Completados'] != manifiesto['Fragmentos']:
+        raise RuntimeError(f'El trabajo no está completo: {estado}')
+
+    def escribir(ruta_temporal):
+        for numero in range(manifiesto['Fragmentos']):
+            pd.read_csv(get_ruta_fragmento(directorio, numero, 'csv')).to_csv(ruta_temporal, mode='w' if numero == 0 else 'a', header=numero == 0, index=False)
+    guardar_atomico(ruta_salida, escribir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Puntuación reanudable por fragmentos de extractos históricos con el sistema experto y los modelos.')
+    parser.add_argument('entrada', nargs='?', help='CSV con las columnas de los perfiles (mismo formato de /predict-risk)')
+    parser.add_argument('--directorio', required=True, help='Directorio del trabajo (puede ser compartido entre varios equipos)')
+    parser.add_argument('--filas-por-fragmento', type=int, default=50000)
+    parser.add_argument('--procesos', type=int, help='Procesos en paralelo (por defecto, uno por núcleo con pandas y uno solo con Polars)')
+    parser.add_argument('--motor', choices=motores_disponibles, help='Motor de DataFrames (por defecto, MOTOR_DATAFRAMES del .env)')
+    parser.add_argument('--lote', type=int, default=1000, help='Perfiles por llamada al pipeline dentro de un fragmento')
+    parser.add_argument('--expiracion', type=float, default=3600, help='Segundos tras los cuales un reclamo sin terminar se considera abandonado')
+    parser.add_argument('--estado', action='store_true', help='Mostrar el avance del trabajo y terminar')
+    parser.add_argument('--combinar', metavar='SALIDA', help='Unir los fragmentos completos en un único CSV y terminar')
+    args = parser.parse_args()
+
+    if args.combinar:
+        combinar(args.directorio, args.combinar)
+        print(f'Resultados guardados en {args.combinar}')
+        sys.exit(0)
+
+    if args.estado:
+        with open(os.path.join(args.directorio, nombre_manifiesto), encoding='utf-8') as archivo:
+            print(json.dumps(get_estado(args.directorio, json.load(archivo)), ensure_ascii=False, indent=2))
+        sys.exit(0)
+
+    if args.entrada is None:
+        parser.error('Se debe indicar el CSV de entrada')
+
+    load_dotenv()
+    if args.motor:
+        # Los procesos hijos leen el motor del entorno al cargar la versión
+        os.environ["MOTOR_DATAFRAMES"] = args.motor
+    # Polars paraleliza cada etapa en todos los núcleos, por lo que varios procesos solo competirían por ellos
+    procesos = args.procesos or (1 if os.getenv("MOTOR_DATAFRAMES", "pandas") == 'polars' else os.cpu_count())
+    estado = ejecutar_trabajo(args.entrada, args.directorio, args.filas_por_fragmento, procesos, args.lote, args.expiracion, os.getenv("USAR_TABLA_DECISION", "1") == "1")
+    print(json.dumps(estado, ensure_ascii=False, indent=2))
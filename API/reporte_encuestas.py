@@ -0,0 +1,284 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from definitions import dict_encoder_riesgo_tratamiento
+from ingesta import guardar_atomico, ruta_encuesta_limpia, ruta_encuesta_codificada
+from versiones import ruta_datos_cannabis, ruta_datos_psilocibina
+
+
+# Directorio donde se guardan los agregados parciales de cada fragmento ya procesado
+ruta_cache_reportes = '../.cache_reportes'
+ruta_reporte_encuestas = '../encuestas/reporte_encuestas.json'
+
+# Se incrementa cuando cambia el contenido de los agregados, para que los fragmentos en caché se vuelvan a procesar
+version_agregados = 1
+
+# Preguntas de selección múltiple cuyas opciones se cruzan entre sí (por ejemplo, condición del participante y de su familia)
+cruces_seleccion_multiple = [('Condición', 'Historial Familiar')]
+
+# Tablas de contingencia entre dos columnas de la encuesta limpia
+tablas_contingencia = [
+    ('Frecuencia Cannabis', 'Dependencia Cannabis'),
+    ('Frecuencia Cannabis', 'Efectos Negativos Cannabis_Psicosis'),
+    ('Frecuencia Psilocibina', 'Dependencia Psilocibina'),
+    ('Sustancia Tratamiento', 'Calificación Tratamiento'),
+    ('Tipo de Dosis', 'Calificación Tratamiento')
+]
+
+# Variables de la encuesta codificada con las que se calcula la matriz de correlación, y las que usan 0 para 'Sin Dato'
+columnas_correlacion = ['Calificación Tratamiento', 'Cantidad Tratamientos', 'Tipo de Dosis_Microdosis', 'Tipo de Dosis_Macrodosis',
+                        'Razón Tratamiento_Ansiedad', 'Razón Tratamiento_Depresión', 'Sesiones Macrodosis', 'Duración Microdosis']
+columnas_cero_sin_dato = ['Calificación Tratamiento', 'Cantidad Tratamientos']
+
+dict_decoder_riesgo_tratamiento = {codigo: nivel for nivel, codigo in dict_encoder_riesgo_tratamiento.items()}
+
+
+def leer_fragmentos(ruta, filas_por_fragmento):
+    # Dividir el CSV en fragmentos de filas sin interpretarlo, para que los fragmentos en caché no se tengan que leer con pandas.
+    # Una fila termina en un salto de línea fuera de comillas, por lo que las respuestas con saltos de línea no se parten
+    with open(ruta, 'rb') as archivo:
+        encabezado = archivo.readline()
+        lineas, filas, comillas = [], 0, 0
+        for linea in archivo:
+            lineas.append(linea)
+            comillas += linea.count(b'"')
+            if comillas % 2 == 0:
+                filas += 1
+                if filas == filas_por_fragmento:
+                    yield encabezado, b''.join(lineas)
+                    lineas, filas = [], 0
+        if lineas:
+            yield encabezado, b''.join(lineas)
+
+
+def calcular_huella_fragmento(fuente, encabezado, datos):
+    contenido = f'{fuente}:{version_agregados}:'.encode('utf-8') + encabezado + datos
+    return hashlib.sha256(contenido).hexdigest()
+
+
+def normalizar_valor(valor):
+    # Un mismo valor se puede leer como 4 o 4.0 según si el fragmento tiene celdas vacías en la columna
+    if pd.isna(valor):
+        return 'Sin Dato'
+    if isinstance(valor, (float, np.floating)) and float(valor).is_integer():
+        return str(int(valor))
+    return str(valor)
+
+
+def contar_valores(serie):
+    conteo = {}
+    for valor, cantidad in serie.value_counts(dropna=False).items():
+        valor = normalizar_valor(valor)
+        conteo[valor] = conteo.get(valor, 0) + int(cantidad)
+    return conteo
+
+
+def get_preguntas_seleccion_multiple(columnas):
+    # Las opciones de una pregunta de selección múltiple son columnas 'Pregunta_Opción'
+    preguntas = {}
+    for col in columnas:
+        if '_' in col:
+            pregunta, opcion = col.split('_', 1)
+            preguntas.setdefault(pregunta, {})[opcion] = col
+    return preguntas
+
+
+def contar_coocurrencias(marcas_a, marcas_b):
+    # Cantidad de filas con ambas opciones marcadas, para cada par de opciones (solo los pares que ocurren)
+    conteo = marcas_a.T.astype(np.int64) @ marcas_b.astype(np.int64)
+    return {a: {b: int(cantidad) for b, cantidad in fila.items() if cantidad} for a, fila in conteo.iterrows() if fila.any()}
+
+
+def agregar_encuesta(df):
+    preguntas_multiples = get_preguntas_seleccion_multiple(df.columns)
+    columnas_multiples = {col for opciones in preguntas_multiples.values() for col in opciones.values()}
+    marcas = {pregunta: df[list(opciones.values())].eq(True).set_axis(list(opciones), axis=1) for pregunta, opciones in preguntas_multiples.items()}
+
+    agregados = {
+        'Filas': len(df),
+        'Respuestas': {col: contar_valores(df[col]) for col in df.columns if col not in columnas_multiples},
+        'Selección Múltiple': {pregunta: {opcion: int(cantidad) for opcion, cantidad in marcas_pregunta.sum().items()} for pregunta, marcas_pregunta in marcas.items()},
+        'Coocurrencia': {pregunta: contar_coocurrencias(marcas_pregunta, marcas_pregunta) for pregunta, marcas_pregunta in marcas.items()},
+        'Cruces Selección Múltiple': {
+            f'{pregunta_a} x {pregunta_b}': contar_coocurrencias(marcas[pregunta_a], marcas[pregunta_b])
+            for pregunta_a, pregunta_b in cruces_seleccion_multiple if pregunta_a in marcas and pregunta_b in marcas
+        },
+        'Tablas de Contingencia': {},
+        'Calificación por Razón Tratamiento': {}
+    }
+
+    for col_a, col_b in tablas_contingencia:
+        if col_a in df.columns and col_b in df.columns:
+            tabla = {}
+            for (valor_a, valor_b), cantidad in df.groupby([col_a, col_b], dropna=False).size().items():
+                fila = tabla.setdefault(normalizar_valor(valor_a), {})
+                fila[normalizar_valor(valor_b)] = fila.get(normalizar_valor(valor_b), 0) + int(cantidad)
+            agregados['Tablas de Contingencia'][f'{col_a} x {col_b}'] = tabla
+
+    # Suma y cantidad de calificaciones por razón de tratamiento, para calcular el promedio al combinar los fragmentos
+    if 'Razón Tratamiento' in marcas and 'Calificación Tratamiento' in df.columns:
+        calificaciones = pd.to_numeric(df['Calificación Tratamiento'], errors='coerce')
+        for razon, marcada in marcas['Razón Tratamiento'].items():
+            seleccion = calificaciones[marcada].dropna()
+            if len(seleccion):
+                agregados['Calificación por Razón Tratamiento'][razon] = {'Suma': float(seleccion.sum()), 'Cantidad': len(seleccion)}
+
+    return agregados
+
+
+def agregar_correlacion(df):
+    # Sumas por par de variables sobre las filas donde ambas tienen dato, con las que se calcula la correlación de Pearson
+    # del archivo completo sin volver a leerlo
+    columnas = [col for col in columnas_correlacion if col in df.columns]
+    valores = df[columnas].apply(pd.to_numeric, errors='coerce').astype(float)
+    for col in columnas_cero_sin_dato:
+        if col in valores.columns:
+            valores[col] = valores[col].mask(valores[col] == 0)
+
+    presentes = valores.notna().to_numpy(dtype=float)
+    x = valores.fillna(0).to_numpy()
+    sumas = {'n': presentes.T @ presentes, 'x': x.T @ presentes, 'xx': (x ** 2).T @ presentes, 'xy': x.T @ x}
+
+    return {
+        'Filas': len(df),
+        'Sumas Correlación': {
+            col_a: {col_b: {nombre: float(matriz[i, j]) for nombre, matriz in sumas.items()} for j, col_b in enumerate(columnas)}
+            for i, col_a in enumerate(columnas)
+        }
+    }
+
+
+def agregar_riesgo(target_col):
+    def agregar(df):
+        niveles = df[target_col].map(lambda codigo: dict_decoder_riesgo_tratamiento.get(codigo, normalizar_valor(codigo)))
+        return {'Filas': len(df), 'Niveles de Riesgo': contar_valores(niveles)}
+    return agregar
+
+
+def combinar_agregados(total, parcial):
+    # Todos los agregados son conteos o sumas, por lo que dos fragmentos se combinan sumando clave por clave
+    for clave, valor in parcial.items():
+        if isinstance(valor, dict):
+            combinar_agregados(total.setdefault(clave, {}), valor)
+        else:
+            total[clave] = total.get(clave, 0) + valor
+    return total
+
+
+def agregar_archivo(fuente, ruta, agregar, filas_por_fragmento, ruta_cache=ruta_cache_reportes):
+    # Recorrer el archivo una sola vez, reutilizando los agregados de los fragmentos que no cambiaron desde la última ejecución
+    directorio = os.path.join(ruta_cache, fuente)
+    os.makedirs(directorio, exist_ok=True)
+
+    total, usados = {}, set()
+    estadisticas = {'Fragmentos': 0, 'Fragmentos Procesados': 0, 'Filas Procesadas': 0}
+    for encabezado, datos in leer_fragmentos(ruta, filas_por_fragmento):
+        huella = calcular_huella_fragmento(fuente, encabezado, datos)
+        ruta_fragmento = os.path.join(directorio, f'{huella}.json')
+        usados.add(f'{huella}.json')
+        estadisticas['Fragmentos'] += 1
+
+        if os.path.exists(ruta_fragmento):
+            with open(ruta_fragmento, encoding='utf-8') as archivo:
+                parcial = json.load(archivo)
+        else:
+            parcial = agregar(pd.read_csv(io.BytesIO(encabezado + datos)))
+            estadisticas['Fragmentos Procesados'] += 1
+            estadisticas['Filas Procesadas'] += parcial['Filas']
+
+            def escribir(ruta_temporal):
+                with open(ruta_temporal, 'w', encoding='utf-8') as archivo:
+                    json.dump(parcial, archivo, ensure_ascii=False)
+            guardar_atomico(ruta_fragmento, escribir)
+
+        combinar_agregados(total, parcial)
+
+    # Eliminar los fragmentos que ya no hacen parte del archivo (por ejemplo, el último fragmento antes de agregarle filas)
+    for nombre in os.listdir(directorio):
+        if nombre not in usados:
+            os.remove(os.path.join(directorio, nombre))
+
+    estadisticas['Filas'] = total.get('Filas', 0)
+    return total, estadisticas
+
+
+def calcular_porcentajes(conteo, total):
+    return {valor: {'Cantidad': cantidad, 'Porcentaje': round(cantidad / total * 100, 2) if total else None}
+            for valor, cantidad in sorted(conteo.items(), key=lambda item: item[1], reverse=True)}
+
+
+def calcular_correlaciones(sumas):
+    correlaciones = {}
+    for col_a, fila in sumas.items():
+        correlaciones[col_a] = {}
+        for col_b, s in fila.items():
+            # Las sumas de 'col_b' sobre las filas donde ambas tienen dato están en la posición transpuesta
+            t = sumas[col_b][col_a]
+            n = s['n']
+            covarianza = s['xy'] - s['x'] * t['x'] / n if n else 0
+            varianza_a = s['xx'] - s['x'] ** 2 / n if n else 0
+            varianza_b = t['xx'] - t['x'] ** 2 / n if n else 0
+            correlaciones[col_a][col_b] = round(covarianza / np.sqrt(varianza_a * varianza_b), 4) if varianza_a > 0 and varianza_b > 0 else None
+    return correlaciones
+
+
+def generar_reporte(encuesta, codificada, riesgos):
+    filas = encuesta.get('Filas', 0)
+    return {
+        'Fecha': datetime.now().isoformat(timespec='seconds'),
+        'Filas Encuesta': filas,
+        'Respuestas': {col: calcular_porcentajes(conteo, filas) for col, conteo in encuesta.get('Respuestas', {}).items()},
+        'Selección Múltiple': {pregunta: calcular_porcentajes(conteo, filas) for pregunta, conteo in encuesta.get('Selección Múltiple', {}).items()},
+        'Coocurrencia': encuesta.get('Coocurrencia', {}),
+        'Cruces Selección Múltiple': encuesta.get('Cruces Selección Múltiple', {}),
+        'Tablas de Contingencia': encuesta.get('Tablas de Contingencia', {}),
+        'Calificación por Razón Tratamiento': {
+            razon: {'Promedio': round(valores['Suma'] / valores['Cantidad'], 2), 'Cantidad': valores['Cantidad']}
+            for razon, valores in sorted(encuesta.get('Calificación por Razón Tratamiento', {}).items(), key=lambda item: item[1]['Cantidad'], reverse=True)
+        },
+        'Correlaciones': calcular_correlaciones(codificada.get('Sumas Correlación', {})),
+        'Niveles de Riesgo': {sustancia: calcular_porcentajes(agregados.get('Niveles de Riesgo', {}), agregados.get('Filas', 0)) for sustancia, agregados in riesgos.items()}
+    }
+
+
+def guardar_reporte(reporte, ruta):
+    def escribir(ruta_temporal):
+        with open(ruta_temporal, 'w', encoding='utf-8') as archivo:
+            json.dump(reporte, archivo, ensure_ascii=False, indent=2)
+    guardar_atomico(ruta, escribir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Genera el reporte descriptivo de las encuestas en una sola pasada por fragmentos, reutilizando los fragmentos ya procesados.')
+    parser.add_argument('--filas-por-fragmento', type=int, default=5000)
+    parser.add_argument('--salida', default=ruta_reporte_encuestas)
+    parser.add_argument('--cache', default=ruta_cache_reportes)
+    args = parser.parse_args()
+
+    load_dotenv()
+    fuentes = [
+        ('encuesta', ruta_encuesta_limpia, agregar_encuesta),
+        ('codificada', ruta_encuesta_codificada, agregar_correlacion),
+        ('riesgo_cannabis', ruta_datos_cannabis, agregar_riesgo(os.getenv("TARGET_COL_CANNABIS"))),
+        ('riesgo_psilocibina', ruta_datos_psilocibina, agregar_riesgo(os.getenv("TARGET_COL_PSILOCIBINA")))
+    ]
+
+    agregados = {}
+    for fuente, ruta, agregar in fuentes:
+        inicio = perf_counter()
+        agregados[fuente], estadisticas = agregar_archivo(fuente, ruta, agregar, args.filas_por_fragmento, args.cache)
+        print(f'{ruta}: {estadisticas["Filas"]} filas en {estadisticas["Fragmentos"]} fragmentos, '
+              f'{estadisticas["Fragmentos Procesados"]} procesados ({estadisticas["Filas Procesadas"]} filas) en {perf_counter() - inicio:.2f} s')
+
+    reporte = generar_reporte(agregados['encuesta'], agregados['codificada'], {'Cannabis': agregados['riesgo_cannabis'], 'Psilocibina': agregados['riesgo_psilocibina']})
+    guardar_reporte(reporte, args.salida)
+    print(f'Reporte guardado en {args.salida}')
@@ -0,0 +1,107 @@
+import os
+import queue
+import threading
+from time import perf_counter
+
+from joblib import load
+
+from definitions import dict_encoder_riesgo_tratamiento
+
+
+reverse_dict_encoder_riesgo = {v: k for k, v in dict_encoder_riesgo_tratamiento.items()}
+
+
+class EvaluadorSombra:
+    # Evalúa modelos candidatos sobre el tráfico real sin afectar la latencia de '/predict-risk'.
+    # La solicitud solo deja en una cola acotada las filas ya codificadas junto con las predicciones del modelo principal
+    # y del sistema experto; un hilo en segundo plano ejecuta los candidatos y registra las coincidencias.
+    # Si la cola está llena, el trabajo se descarta en lugar de hacer esperar a la solicitud.
+
+    def __init__(self, candidatos, max_cola=100):
+        self.candidatos = candidatos
+        self.cola = queue.Queue(maxsize=max_cola)
+        self.lock = threading.Lock()
+        self.metricas = {
+            sustancia: {'Lotes': 0, 'Filas': 0, 'Coincidencias Modelo Principal': 0, 'Coincidencias Sistema Experto': 0,
+                        'Desacuerdos': {}, 'Tiempo (ms)': 0.0, 'Descartados': 0, 'Errores': 0, 'Último Error': None}
+            for sustancia in candidatos
+        }
+        self.hilo = threading.Thread(target=self.procesar, daemon=True)
+        self.hilo.start()
+
+    def enviar(self, evaluaciones):
+        # Recibe una lista de (sustancia, filas codificadas, predicciones del modelo principal, predicciones del sistema experto).
+        # Las sustancias de una misma solicitud se encolan juntas para que ninguna se descarte más que la otra.
+        # No bloquea: si la cola está llena se cuenta el trabajo como descartado.
+        evaluaciones = [evaluacion for evaluacion in evaluaciones if evaluacion[0] in self.candidatos and not evaluacion[1].empty]
+        if not evaluaciones:
+            return False
+        try:
+            self.cola.put_nowait(evaluaciones)
+            return True
+        except queue.Full:
+            with self.lock:
+                for sustancia, _, _, _ in evaluaciones:
+                    self.metricas[sustancia]['Descartados'] += 1
+            return False
+
+    def procesar(self):
+        while True:
+            evaluaciones = self.cola.get()
+            for sustancia, df_test_encoded_model, y_pred_principal, y_sistema_experto in evaluaciones:
+                try:
+                    self.evaluar(sustancia, df_test_encoded_model, y_pred_principal, y_sistema_experto)
+                except Exception as e:
+                    with self.lock:
+                        self.metricas[sustancia]['Errores'] += 1
+                        self.metricas[sustancia]['Último Error'] = str(e)
+            self.cola.task_done()
+
+    def evaluar(self, sustancia, df_test_encoded_model, y_pred_principal, y_sistema_experto):
+        candidato = self.candidatos[sustancia]
+
+        # El candidato puede haberse entrenado con columnas nuevas (ver 'ingesta.py'); las faltantes se completan con False
+        if hasattr(candidato, 'feature_names_in_'):
+            df_test_encoded_model = df_test_encoded_model.reindex(columns=candidato.feature_names_in_, fill_value=False)
+
+        inicio = perf_counter()
+        y_pred_candidato = candidato.predict(df_test_encoded_model)
+        duracion = perf_counter() - inicio
+
+        with self.lock:
+            metricas = self.metricas[sustancia]
+            metricas['Lotes'] += 1
+            metricas['Filas'] += len(y_pred_candidato)
+            metricas['Tiempo (ms)'] += duracion * 1000
+            for candidato_i, principal_i, experto_i in zip(y_pred_candidato, y_pred_principal, y_sistema_experto):
+                metricas['Coincidencias Modelo Principal'] += int(candidato_i == principal_i)
+                metricas['Coincidencias Sistema Experto'] += int(candidato_i == experto_i)
+                if candidato_i != principal_i:
+                    desacuerdo = f'{reverse_dict_encoder_riesgo.get(principal_i, principal_i)} -> {reverse_dict_encoder_riesgo.get(candidato_i, candidato_i)}'
+                    metricas['Desacuerdos'][desacuerdo] = metricas['Desacuerdos'].get(desacuerdo, 0) + 1
+
+    def get_metricas(self):
+        with self.lock:
+            return {
+                'En Cola': self.cola.qsize(),
+                'Capacidad Cola': self.cola.maxsize,
+                'Sustancias': {
+                    sustancia: {
+                        **metricas,
+                        'Desacuerdos': dict(metricas['Desacuerdos']),
+                        'Tiempo (ms)': round(metricas['Tiempo (ms)'], 3),
+                        'Tasa Coincidencia Modelo Principal': round(metricas['Coincidencias Modelo Principal'] / metricas['Filas'], 4) if metricas['Filas'] else None,
+                        'Tasa Coincidencia Sistema Experto': round(metricas['Coincidencias Sistema Experto'] / metricas['Filas'], 4) if metricas['Filas'] else None
+                    }
+                    for sustancia, metricas in self.metricas.items()
+                }
+            }
+
+
+def cargar_evaluador_sombra():
+    # Los modelos candidatos se definen con SOMBRA_MODELO_CANNABIS y SOMBRA_MODELO_PSILOCIBINA; sin ninguno, la evaluación queda desactivada
+    rutas = {'Cannabis': os.getenv("SOMBRA_MODELO_CANNABIS", ""), 'Psilocibina': os.getenv("SOMBRA_MODELO_PSILOCIBINA", "")}
+    candidatos = {sustancia: load(ruta) for sustancia, ruta in rutas.items() if ruta}
+    if not candidatos:
+        return None
+    return EvaluadorSombra(candidatos, max_cola=int(os.getenv("SOMBRA_MAX_COLA", "100")))
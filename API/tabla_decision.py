@@ -0,0 +1,260 @@
+import argparse
+import hashlib
+import inspect
+import os
+
+import numpy as np
+import pandas as pd
+from joblib import dump, load
+
+import expert_system
+import utils
+from definitions import columnas_df, cols_dependencia_abuso, dict_cols_binarias, dict_encoder_riesgo_tratamiento, opciones_respuesta
+
+
+# Ruta del artefacto con las tablas de decisión compiladas
+ruta_tabla_decision = '../modelos/tabla_decision_sistema_experto.joblib'
+
+# Valor representativo para las respuestas que no se comparan explícitamente en las reglas
+valor_otro = 'Otro valor'
+
+def get_valores_respuesta(columna):
+    # Valores que puede tomar la columna al llegar al sistema experto: las opciones de respuesta válidas
+    # con el mismo preprocesamiento de 'utils.py' ('N/A' como 'Sin Dato' y las columnas Si/No como booleanos)
+    valores = utils.preprocess_data(pd.Series(opciones_respuesta[columna], dtype=object))
+    if columna in cols_dependencia_abuso:
+        valores = valores.map(dict_cols_binarias).astype(bool)
+    return list(dict.fromkeys(valores.tolist()))
+
+
+# Hechos de los que dependen las reglas de cada sustancia. Cada hecho es una tupla (tipo, nombre, parametro):
+# - ('valores', columna, valores): un grupo por cada respuesta válida de la columna; cualquier otra respuesta forma un grupo adicional.
+#   Los valores salen de 'opciones_respuesta', de modo que un cambio en los literales de las reglas no deja respuestas sin grupo propio.
+# - ('alguno', nombre, columnas): alguna de las columnas codificadas de la lista es verdadera
+def get_hechos_cannabis(reglas=expert_system):
+    return [
+        ('valores', 'Frecuencia Cannabis', get_valores_respuesta('Frecuencia Cannabis')),
+        ('valores', 'Dependencia Cannabis', get_valores_respuesta('Dependencia Cannabis')),
+        ('valores', 'Abuso Cannabis', get_valores_respuesta('Abuso Cannabis')),
+        ('alguno', 'Condiciones Adicciones', reglas.condiciones_medicas_adicciones),
+        ('alguno', 'Condiciones Riesgosas', reglas.condiciones_medicas_riesgosas),
+        ('alguno', 'Historial Familiar Adicciones', reglas.historial_familiar_adicciones),
+        ('alguno', 'Historial Familiar Condiciones Riesgosas', reglas.historial_familiar_condiciones_riesgosas),
+        ('alguno', 'Efectos Positivos', reglas.efectos_positivos_cannabis),
+        ('alguno', 'Efectos Moderados', reglas.efectos_moderados_cannabis),
+        ('alguno', 'Efectos Determinantes', reglas.efectos_negativos_determinantes_cannabis)
+    ]
+
+def get_hechos_psilocibina(reglas=expert_system):
+    return [
+        ('valores', 'Tipo de Dosis', get_valores_respuesta('Tipo de Dosis')),
+        ('valores', 'Cantidad Tratamientos', get_valores_respuesta('Cantidad Tratamientos')),
+        ('valores', 'Calificación Tratamiento', get_valores_respuesta('Calificación Tratamiento')),
+        ('valores', 'Propósito Psilocibina', get_valores_respuesta('Propósito Psilocibina')),
+        ('valores', 'Dependencia Psilocibina', get_valores_respuesta('Dependencia Psilocibina')),
+        ('valores', 'Abuso Psilocibina', get_valores_respuesta('Abuso Psilocibina')),
+        ('alguno', 'Condiciones Adicciones', reglas.condiciones_medicas_adicciones),
+        ('alguno', 'Condiciones Riesgosas', reglas.condiciones_medicas_riesgosas),
+        ('alguno', 'Historial Familiar Adicciones', reglas.historial_familiar_adicciones),
+        ('alguno', 'Historial Familiar Condiciones Riesgosas', reglas.historial_familiar_condiciones_riesgosas),
+        ('alguno', 'Efectos Positivos', reglas.efectos_positivos_psilocibina),
+        ('alguno', 'Efectos Determinantes', reglas.efectos_negativos_determinantes_psilocibina)
+    ]
+
+
+def get_hechos(target_col, reglas=expert_system):
+    # Definir los hechos según la sustancia, igual que en 'execute_expert_system'
+    if 'Cannabis' in target_col:
+        return get_hechos_cannabis(reglas)
+    elif 'Psilocibina' in target_col:
+        return get_hechos_psilocibina(reglas)
+
+
+def get_dimensiones(hechos):
+    # Cantidad de grupos posibles de cada hecho
+    return tuple(len(parametro) + 1 if tipo == 'valores' else 2 for tipo, _, parametro in hechos)
+
+
+def calcular_huella_reglas(reglas=expert_system):
+    # Huella del código de las reglas y de los hechos; si cambia, la tabla compilada deja de ser valida
+    with open(reglas.__file__, encoding='utf-8') as archivo:
+        fuentes = archivo.read()
+    fuentes += inspect.getsource(utils.execute_expert_system) + repr(get_hechos_cannabis(reglas)) + repr(get_hechos_psilocibina(reglas))
+    return hashlib.sha256(fuentes.encode('utf-8')).hexdigest()
+
+
+def get_firma(df_test, hechos):
+    # Reducir cada perfil a su firma: el índice del grupo al que pertenece para cada hecho
+    firma = []
+    for tipo, nombre, parametro in hechos:
+        if tipo == 'valores':
+            grupo = np.full(len(df_test), len(parametro))
+            # Recorrer los literales en orden inverso para que el primero que coincida tenga prioridad
+            for i in reversed(range(len(parametro))):
+                grupo[df_test[nombre].isin([parametro[i]]).to_numpy()] = i
+        else:
+            # Equivalente a get_columns(df_test, parametro).eq(True).any(axis=1), evaluado directamente sobre numpy
+            existentes = [col for col in parametro if col in df_test.columns]
+            if existentes:
+                grupo = (df_test[existentes].to_numpy() == True).any(axis=1).astype(int)
+            else:
+                grupo = np.zeros(len(df_test), dtype=int)
+        firma.append(grupo)
+    return firma
+
+
+def generar_perfiles_representativos(hechos):
+    # Construir un perfil por cada combinación posible de los hechos
+    dimensiones = get_dimensiones(hechos)
+    combinaciones = np.indices(dimensiones).reshape(len(dimensiones), -1)
+
+    columnas = {}
+    for (tipo, nombre, parametro), grupo in zip(hechos, combinaciones):
+        if tipo == 'valores':
+            valores = np.array(list(parametro) + [valor_otro], dtype=object)
+            columnas[nombre] = valores[grupo]
+        else:
+            # Solo la primera columna de la lista se marca como verdadera para representar el grupo
+            for col in parametro:
+                columnas.setdefault(col, np.zeros(len(grupo), dtype=bool))
+            columnas[parametro[0]] = columnas[parametro[0]] | (grupo == 1)
+
+    return pd.DataFrame(columnas), combinaciones
+
+
+def compilar_tabla(target_col, reglas=expert_system):
+    # Evaluar el sistema experto una sola vez sobre todas las combinaciones de hechos
+    hechos = get_hechos(target_col, reglas)
+    df_perfiles, combinaciones = generar_perfiles_representativos(hechos)
+
+    # Verificar que cada perfil representativo tenga exactamente la firma de la combinación que representa
+    firma = get_firma(df_perfiles, hechos)
+    if not all(np.array_equal(grupo, combinacion) for grupo, combinacion in zip(firma, combinaciones)):
+        raise ValueError(f'Los perfiles representativos no reproducen las firmas de {target_col}')
+
+    riesgo = utils.execute_expert_system(df_perfiles, target_col, reglas)
+
+    codigos = riesgo.map(dict_encoder_riesgo_tratamiento).to_numpy(dtype=np.int8)
+    return codigos.reshape(get_dimensiones(hechos))
+
+
+def compilar_tablas(target_cols, reglas=expert_system):
+    return {
+        'huella_reglas': calcular_huella_reglas(reglas),
+        'tablas': {target_col: compilar_tabla(target_col, reglas) for target_col in target_cols}
+    }
+
+
+def cargar_tabla_decision(ruta=ruta_tabla_decision, reglas=expert_system):
+    # Cargar las tablas compiladas solo si corresponden a las reglas actuales
+    if not os.path.exists(ruta):
+        print(f'No se encontró la tabla de decisión en {ruta}')
+        return None
+
+    tabla_decision = load(ruta)
+    if tabla_decision['huella_reglas'] != calcular_huella_reglas(reglas):
+        print('La tabla de decisión no corresponde a las reglas actuales del sistema experto, se debe volver a compilar')
+        return None
+
+    return tabla_decision
+
+
+def aplicar_tabla_decision(df_test, target_col, tabla_decision, reglas=expert_system):
+    # Obtener el nivel de riesgo con una sola búsqueda por perfil en la tabla compilada
+    hechos = get_hechos(target_col, reglas)
+    tabla = tabla_decision['tablas'][target_col]
+
+    indices = np.ravel_multi_index(get_firma(df_test, hechos), tabla.shape)
+    return pd.Series(tabla.ravel()[indices], index=df_test.index, name=target_col).map(utils.reverse_dict_encoder_riesgo_tratamiento)
+
+
+def ejecutar_sistema_experto(df_test, target_col, tabla_decision=None, reglas=expert_system):
+    # Devuelve el nivel de riesgo de cada perfil sin modificar 'df_test'
+    usar_tabla = tabla_decision is not None and target_col in tabla_decision['tablas']
+
+    # Registrar el lote si la instrumentación de las reglas está activa
+    instrumentacion = reglas.instrumentacion_reglas
+    if instrumentacion is not None:
+        instrumentacion.iniciar_lote(target_col, len(df_test), 'Tabla de decisión' if usar_tabla else 'Reglas')
+
+    # Usar la tabla compilada si está disponible; en caso contrario evaluar las reglas directamente
+    if usar_tabla:
+        riesgo = aplicar_tabla_decision(df_test, target_col, tabla_decision, reglas)
+    else:
+        riesgo = utils.execute_expert_system(df_test, target_col, reglas)
+
+    if instrumentacion is not None:
+        instrumentacion.finalizar_lote(riesgo)
+    return riesgo
+
+
+def preparar_perfiles(list_data):
+    # Aplicar a los perfiles el mismo preprocesamiento que recibe el sistema experto en la API
+    df_test = pd.DataFrame(list_data, columns=columnas_df)
+    return utils.transform_data(utils.get_one_hot_encoding(utils.preprocess_data(df_test)))
+
+
+def verificar_tabla_decision(tabla_decision, target_cols, list_data, reglas=expert_system, firmas=True):
+    # Comparar la tabla con 'execute_expert_system' de las mismas reglas sobre todas las firmas y sobre perfiles preprocesados
+    df_test = preparar_perfiles(list_data)
+    diferencias = {}
+    for target_col in target_cols:
+        hechos = get_hechos(target_col, reglas)
+        tabla = tabla_decision['tablas'][target_col]
+        resultado = {'Firmas': tabla.size}
+
+        # Todas las combinaciones posibles de hechos
+        if firmas:
+            df_perfiles, _ = generar_perfiles_representativos(hechos)
+            riesgo_esperado = utils.execute_expert_system(df_perfiles, target_col, reglas)
+            riesgo = aplicar_tabla_decision(df_perfiles, target_col, tabla_decision, reglas)
+            resultado['Diferencias en firmas'] = int((riesgo != riesgo_esperado).sum())
+
+        # Perfiles realistas que pasan por el preprocesamiento de la API
+        riesgo_esperado = utils.execute_expert_system(df_test, target_col, reglas)
+        riesgo = aplicar_tabla_decision(df_test, target_col, tabla_decision, reglas)
+        resultado['Perfiles'] = len(df_test)
+        resultado['Diferencias en perfiles'] = int((riesgo != riesgo_esperado).sum())
+
+        diferencias[target_col] = resultado
+    return diferencias
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from test_data import generar_perfiles_sinteticos
+
+    parser = argparse.ArgumentParser(description='Compila y verifica la tabla de decisión del sistema experto.')
+    parser.add_argument('accion', choices=['compilar', 'verificar'])
+    parser.add_argument('--ruta', default=ruta_tabla_decision)
+    parser.add_argument('--perfiles', type=int, default=5000, help='Cantidad de perfiles sintéticos para la verificación')
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args()
+
+    load_dotenv()
+    target_cols = [os.getenv("TARGET_COL_CANNABIS"), os.getenv("TARGET_COL_PSILOCIBINA")]
+
+    if args.accion == 'compilar':
+        tabla_decision = compilar_tablas(target_cols)
+        dump(tabla_decision, args.ruta)
+        for target_col, tabla in tabla_decision['tablas'].items():
+            print(f'{target_col}: {tabla.size} firmas {tabla.shape}')
+        print(f'Tabla de decisión guardada en {args.ruta}')
+
+    else:
+        tabla_decision = cargar_tabla_decision(args.ruta)
+        if tabla_decision is None:
+            raise SystemExit(1)
+
+        list_data = generar_perfiles_sinteticos(args.perfiles, semilla=args.semilla)
+        diferencias = verificar_tabla_decision(tabla_decision, target_cols, list_data)
+
+        total_diferencias = 0
+        for target_col, resultado in diferencias.items():
+            print(f'{target_col}: {resultado}')
+            total_diferencias += resultado.get('Diferencias en firmas', 0) + resultado['Diferencias en perfiles']
+
+        if total_diferencias:
+            print('La tabla de decisión NO es equivalente a execute_expert_system')
+            raise SystemExit(1)
+        print('La tabla de decisión es equivalente a execute_expert_system')
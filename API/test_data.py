@@ -211,3 +211,29 @@ sujeto10 = [
     'No tuvo ningún efecto positivo',
     'Psicosis'
 ]
+
+
+# Generar perfiles sintéticos a partir de los sujetos ficticios, reemplazando respuestas al azar con opciones validas
+def generar_perfiles_sinteticos(cantidad, semilla=0, prob_reemplazo=0.5):
+    import random
+    from definitions import columnas_df, columnas_categoricas, opciones_respuesta
+
+    generador = random.Random(semilla)
+    sujetos = [sujeto1, sujeto2, sujeto3, sujeto4, sujeto5, sujeto6, sujeto7, sujeto8, sujeto9, sujeto10]
+    perfiles = []
+
+    for _ in range(cantidad):
+        perfil = list(generador.choice(sujetos))
+        for i, col in enumerate(columnas_df):
+            if generador.random() >= prob_reemplazo:
+                continue
+            opciones = opciones_respuesta[col]
+            if col in columnas_categoricas:
+                # Las preguntas de selección múltiple reciben entre cero y tres opciones
+                seleccion = generador.sample(opciones, generador.randint(0, 3))
+                perfil[i] = ';'.join(seleccion) if seleccion else 'N/A'
+            else:
+                perfil[i] = generador.choice(opciones)
+        perfiles.append(perfil)
+
+    return perfiles
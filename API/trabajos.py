@@ -0,0 +1,359 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+import pandas as pd
+from dotenv import load_dotenv
+
+import puntuacion_lotes
+from definitions import columnas_df
+from ingesta import guardar_atomico
+from puntuacion_lotes import calcular_desplazamientos, calcular_huella_archivo, contar_filas, get_huella_version, inicializar_proceso, leer_fragmento, puntuar_filas
+
+
+# Directorio de los trabajos: la cola en SQLite y, por trabajo, la entrada, las partes puntuadas y el resultado
+ruta_trabajos = '../trabajos'
+nombre_base_datos = 'trabajos.sqlite'
+
+estados_trabajo = ['En Cola', 'En Proceso', 'Completado', 'Error']
+
+
+def get_identificador_trabajador():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def es_trabajador_activo(trabajador):
+    # Un trabajo 'En Proceso' de un proceso del mismo equipo que ya no existe quedó interrumpido y vuelve a la cola
+    equipo, proceso = trabajador.rsplit(':', 1)
+    if equipo != socket.gethostname():
+        return True
+    try:
+        os.kill(int(proceso), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ColaTrabajos:
+    # Cola persistente de trabajos de puntuación en SQLite. Sobrevive a reinicios de la API:
+    # los trabajos en cola se retoman y los interrumpidos continúan desde la última parte completada.
+
+    def __init__(self, directorio=ruta_trabajos):
+        self.directorio = directorio
+        os.makedirs(directorio, exist_ok=True)
+        with self.conectar() as conexion:
+            conexion.execute('PRAGMA journal_mode=WAL')
+            conexion.execute('''
+                CREATE TABLE IF NOT EXISTS trabajos (
+                    id TEXT PRIMARY KEY,
+                    estado TEXT NOT NULL,
+                    ruta_entrada TEXT NOT NULL,
+                    filas INTEGER,
+                    partes INTEGER,
+                    partes_completadas INTEGER NOT NULL DEFAULT 0,
+                    filas_procesadas INTEGER NOT NULL DEFAULT 0,
+                    filas_error INTEGER NOT NULL DEFAULT 0,
+                    version TEXT,
+                    huella_entrada TEXT,
+                    trabajador TEXT,
+                    creado REAL NOT NULL,
+                    iniciado REAL,
+                    terminado REAL,
+                    error TEXT
+                )''')
+            # Las colas creadas antes de registrar la huella de la entrada no tienen la columna
+            if 'huella_entrada' not in [fila['name'] for fila in conexion.execute('PRAGMA table_info(trabajos)')]:
+                conexion.execute('ALTER TABLE trabajos ADD COLUMN huella_entrada TEXT')
+
+    @contextmanager
+    def conectar(self):
+        # Las transacciones se abren de forma explícita con 'BEGIN IMMEDIATE' donde se reclama un trabajo
+        conexion = sqlite3.connect(os.path.join(self.directorio, nombre_base_datos), timeout=30, isolation_level=None)
+        conexion.row_factory = sqlite3.Row
+        try:
+            yield conexion
+        finally:
+            conexion.close()
+
+    def get_directorio_trabajo(self, id_trabajo):
+        return os.path.join(self.directorio, id_trabajo)
+
+    def get_ruta_resultado(self, id_trabajo):
+        return os.path.join(self.get_directorio_trabajo(id_trabajo), 'resultado.csv')
+
+    def crear_directorio(self):
+        id_trabajo = uuid.uuid4().hex[:16]
+        os.makedirs(self.get_directorio_trabajo(id_trabajo))
+        return id_trabajo
+
+    def crear(self, ruta_entrada=None, list_data=None, id_trabajo=None):
+        # Los perfiles recibidos en la solicitud se guardan como CSV en el directorio del trabajo; un CSV existente se puntúa en su ubicación
+        if id_trabajo is None:
+            id_trabajo = self.crear_directorio()
+        filas = None
+        if list_data is not None:
+            ruta_entrada = os.path.join(self.get_directorio_trabajo(id_trabajo), 'entrada.csv')
+            pd.DataFrame(list_data, columns=columnas_df).to_csv(ruta_entrada, index=False)
+            filas = len(list_data)
+
+        with self.conectar() as conexion:
+            conexion.execute('INSERT INTO trabajos (id, estado, ruta_entrada, filas, creado) VALUES (?, ?, ?, ?, ?)',
+                             (id_trabajo, 'En Cola', os.path.abspath(ruta_entrada), filas, time.time()))
+        return id_trabajo
+
+    def reclamar(self, trabajador):
+        # Tomar el trabajo más antiguo en cola; 'BEGIN IMMEDIATE' asegura que dos trabajadores no tomen el mismo
+        with self.conectar() as conexion:
+            conexion.execute('BEGIN IMMEDIATE')
+            try:
+                for fila in conexion.execute("SELECT id, trabajador FROM trabajos WHERE estado = 'En Proceso'").fetchall():
+                    if not es_trabajador_activo(fila['trabajador']):
+                        conexion.execute("UPDATE trabajos SET estado = 'En Cola', trabajador = NULL WHERE id = ?", (fila['id'],))
+
+                fila = conexion.execute("SELECT * FROM trabajos WHERE estado = 'En Cola' ORDER BY creado LIMIT 1").fetchone()
+                if fila is not None:
+                    conexion.execute("UPDATE trabajos SET estado = 'En Proceso', trabajador = ?, iniciado = COALESCE(iniciado, ?) WHERE id = ?",
+                                     (trabajador, time.time(), fila['id']))
+                conexion.execute('COMMIT')
+            except BaseException:
+                conexion.execute('ROLLBACK')
+                raise
+        return dict(fila) if fila is not None else None
+
+    def actualizar(self, id_trabajo, **valores):
+        with self.conectar() as conexion:
+            conexion.execute(f'UPDATE trabajos SET {", ".join(f"{columna} = ?" for columna in valores)} WHERE id = ?', (*valores.values(), id_trabajo))
+
+    def get_trabajo(self, id_trabajo):
+        with self.conectar() as conexion:
+            fila = conexion.execute('SELECT * FROM trabajos WHERE id = ?', (id_trabajo,)).fetchone()
+        return formatear_trabajo(dict(fila)) if fila is not None else None
+
+    def listar(self, limite=50):
+        with self.conectar() as conexion:
+            filas = conexion.execute('SELECT * FROM trabajos ORDER BY creado DESC LIMIT ?', (limite,)).fetchall()
+        return [formatear_trabajo(dict(fila)) for fila in filas]
+
+    def get_resumen(self):
+        with self.conectar() as conexion:
+            conteos = dict(conexion.execute('SELECT estado, COUNT(*) FROM trabajos GROUP BY estado').fetchall())
+            pendientes = conexion.execute("SELECT COALESCE(SUM(filas - filas_procesadas), 0) FROM trabajos WHERE estado IN ('En Cola', 'En Proceso') AND filas IS NOT NULL").fetchone()[0]
+        return {**{estado: conteos.get(estado, 0) for estado in estados_trabajo}, 'Filas Pendientes': pendientes}
+
+
+def formatear_trabajo(trabajo):
+    # Estado del trabajo para '/jobs': avance y filas por segundo desde que un trabajador lo tomó
+    fin = trabajo['terminado'] or time.time()
+    duracion = fin - trabajo['iniciado'] if trabajo['iniciado'] else None
+
+    def formatear_fecha(marca):
+        return datetime.fromtimestamp(marca).isoformat(timespec='seconds') if marca else None
+
+    return {
+        'Trabajo': trabajo['id'],
+        'Estado': trabajo['estado'],
+        'Filas': trabajo['filas'],
+        'Filas Procesadas': trabajo['filas_procesadas'],
+        'Filas con Error': trabajo['filas_error'],
+        'Partes': trabajo['partes'],
+        'Partes Completadas': trabajo['partes_completadas'],
+        'Avance (%)': round(trabajo['filas_procesadas'] / trabajo['filas'] * 100, 1) if trabajo['filas'] else None,
+        'Filas por Segundo': round(trabajo['filas_procesadas'] / duracion, 1) if duracion else None,
+        'Versión': trabajo['version'],
+        'Trabajador': trabajo['trabajador'],
+        'Creado': formatear_fecha(trabajo['creado']),
+        'Iniciado': formatear_fecha(trabajo['iniciado']),
+        'Terminado': formatear_fecha(trabajo['terminado']),
+        'Error': trabajo['error']
+    }
+
+
+def get_ruta_parte(directorio_trabajo, numero):
+    return os.path.join(directorio_trabajo, f'parte_{numero:05d}.csv')
+
+
+def puntuar_parte(ruta_entrada, ruta_parte, inicio, filas, lote, desplazamiento=None):
+    # Se ejecuta en el proceso de puntuación, con la versión que cargó 'inicializar_proceso'
+    version = puntuacion_lotes.version_proceso
+    df_resultados = puntuar_filas(leer_fragmento(ruta_entrada, inicio, filas, desplazamiento), version, lote)
+    df_resultados.insert(0, 'Fila', range(inicio, inicio + len(df_resultados)))
+    guardar_atomico(ruta_parte, lambda ruta_temporal: df_resultados.to_csv(ruta_temporal, index=False))
+    return len(df_resultados), int(df_resultados['Error'].notna().sum()), version.version
+
+
+class ProcesadorTrabajos:
+    # Hilos que toman trabajos de la cola. Cada hilo puntúa las partes de su trabajo en un proceso propio,
+    # por lo que el pipeline no compite por el GIL con las solicitudes interactivas de la API.
+
+    def __init__(self, cola, trabajadores=1, filas_por_parte=5000, lote=1000, usar_tabla_decision=True, intervalo=1, planificador=None):
+        self.cola = cola
+        self.planificador = planificador
+        self.trabajadores = trabajadores
+        self.filas_por_parte = filas_por_parte
+        self.lote = lote
+        self.usar_tabla_decision = usar_tabla_decision
+        self.intervalo = intervalo
+        self.aviso = threading.Event()
+        self.hilos = []
+
+    def iniciar(self):
+        for _ in range(self.trabajadores):
+            hilo = threading.Thread(target=self.trabajar, daemon=True)
+            hilo.start()
+            self.hilos.append(hilo)
+        return self
+
+    def avisar(self):
+        # Despertar a los trabajadores sin esperar al siguiente sondeo de la cola
+        self.aviso.set()
+
+    def crear_ejecutor(self):
+        # 'spawn' evita copiar en el proceso hijo el estado de los hilos de la API
+        return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=inicializar_proceso, initargs=(self.usar_tabla_decision,))
+
+    def trabajar(self):
+        ejecutor, version_ejecutor = None, None
+        while True:
+            trabajo = self.cola.reclamar(get_identificador_trabajador())
+            if trabajo is None:
+                self.aviso.wait(self.intervalo)
+                self.aviso.clear()
+                continue
+
+            # Crear el proceso de puntuación de nuevo si los artefactos cambiaron desde que se cargó
+            version = get_huella_version()
+            if ejecutor is None or version != version_ejecutor:
+                if ejecutor is not None:
+                    ejecutor.shutdown()
+                ejecutor, version_ejecutor = self.crear_ejecutor(), version
+
+            try:
+                self.procesar(trabajo, ejecutor, version)
+            except BrokenProcessPool as e:
+                ejecutor = None
+                self.cola.actualizar(trabajo['id'], estado='Error', error=f'El proceso de puntuación terminó inesperadamente: {e}', terminado=time.time())
+            except Exception as e:
+                self.cola.actualizar(trabajo['id'], estado='Error', error=str(e), terminado=time.time())
+
+    def procesar(self, trabajo, ejecutor, version):
+        # 'version': huella de los artefactos con los que se creó el proceso de puntuación
+        id_trabajo = trabajo['id']
+        directorio_trabajo = self.cola.get_directorio_trabajo(id_trabajo)
+
+        # Las partes de un trabajo interrumpido solo se reutilizan si la entrada y la versión son las mismas con las que se puntuaron
+        # (como el manifiesto de 'puntuacion_lotes.py'); si no, se descartan para que el resultado no mezcle entradas ni versiones
+        huella_entrada = calcular_huella_archivo(trabajo['ruta_entrada'])
+        if trabajo['huella_entrada'] != huella_entrada or trabajo['version'] != version:
+            for ruta_parte in glob.glob(os.path.join(directorio_trabajo, 'parte_*.csv')):
+                os.remove(ruta_parte)
+            trabajo = {**trabajo, 'filas': None, 'partes': None}
+            self.cola.actualizar(id_trabajo, huella_entrada=huella_entrada, version=version, partes_completadas=0, filas_procesadas=0, filas_error=0)
+
+        filas = trabajo['filas'] if trabajo['filas'] is not None else contar_filas(trabajo['ruta_entrada'])
+        partes = trabajo['partes'] or -(-filas // self.filas_por_parte)
+        filas_por_parte = -(-filas // partes) if partes else self.filas_por_parte
+        self.cola.actualizar(id_trabajo, filas=filas, partes=partes)
+        # Cada parte se lee desde su posición en bytes; si el recuento no coincide con el de pandas, saltando las filas anteriores
+        desplazamientos = calcular_desplazamientos(trabajo['ruta_entrada'], filas_por_parte)
+        if len(desplazamientos) != partes:
+            desplazamientos = [None] * partes
+
+        # Las partes ya puntuadas con la versión del trabajo no se vuelven a procesar
+        filas_procesadas, filas_error = 0, 0
+        for numero in range(partes):
+            ruta_parte = get_ruta_parte(directorio_trabajo, numero)
+            if os.path.exists(ruta_parte):
+                df_parte = pd.read_csv(ruta_parte, usecols=['Versión', 'Error'], dtype={'Versión': str})
+                if (df_parte['Versión'] != version).any():
+                    os.remove(ruta_parte)
+            if os.path.exists(ruta_parte):
+                filas_parte, errores_parte = len(df_parte), int(df_parte['Error'].notna().sum())
+            else:
+                # Dentro de la API cada parte espera su turno en la clase 'Masiva', para ceder la CPU a las solicitudes interactivas entre partes
+                with self.planificador.turno('Masiva', limitar_cola=False) if self.planificador is not None else nullcontext():
+                    filas_parte, errores_parte, version_parte = ejecutor.submit(
+                        puntuar_parte, trabajo['ruta_entrada'], ruta_parte, numero * filas_por_parte, filas_por_parte, self.lote, desplazamientos[numero]).result()
+
+                # Si los artefactos cambiaron antes de que el proceso los cargara, la parte no corresponde a la versión del trabajo:
+                # se descarta y el trabajo vuelve a la cola para continuar con un proceso nuevo
+                if version_parte != version:
+                    os.remove(ruta_parte)
+                    self.cola.actualizar(id_trabajo, estado='En Cola', trabajador=None)
+                    return
+
+            filas_procesadas += filas_parte
+            filas_error += errores_parte
+            self.cola.actualizar(id_trabajo, partes_completadas=numero + 1, filas_procesadas=filas_procesadas, filas_error=filas_error)
+
+        # La entrada se lee en su ubicación: si cambió mientras se puntuaba, el trabajo vuelve a la cola y sus partes se descartan al retomarlo
+        if calcular_huella_archivo(trabajo['ruta_entrada']) != huella_entrada:
+            self.cola.actualizar(id_trabajo, estado='En Cola', trabajador=None)
+            return
+
+        # Unir las partes en orden en el resultado y liberar el espacio de las partes
+        def escribir(ruta_temporal):
+            for numero in range(partes):
+                pd.read_csv(get_ruta_parte(directorio_trabajo, numero), dtype=str, keep_default_na=False).to_csv(
+                    ruta_temporal, mode='w' if numero == 0 else 'a', header=numero == 0, index=False)
+        if partes:
+            guardar_atomico(self.cola.get_ruta_resultado(id_trabajo), escribir)
+        else:
+            pd.DataFrame(columns=['Fila', 'Versión', 'Error']).to_csv(self.cola.get_ruta_resultado(id_trabajo), index=False)
+        for numero in range(partes):
+            os.remove(get_ruta_parte(directorio_trabajo, numero))
+
+        self.cola.actualizar(id_trabajo, estado='Completado', terminado=time.time())
+
+
+def cargar_procesador_trabajos(cola, planificador=None):
+    # Trabajadores dentro de la API (TRABAJOS_TRABAJADORES); con 0 los trabajos los procesa 'python trabajos.py trabajador'
+    load_dotenv()
+    trabajadores = int(os.getenv("TRABAJOS_TRABAJADORES", "1"))
+    if trabajadores <= 0:
+        return None
+    return ProcesadorTrabajos(cola, trabajadores=trabajadores, filas_por_parte=int(os.getenv("TRABAJOS_FILAS_POR_PARTE", "5000")),
+                              lote=int(os.getenv("TRABAJOS_LOTE", "1000")), usar_tabla_decision=os.getenv("USAR_TABLA_DECISION", "1") == "1",
+                              planificador=planificador).iniciar()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cola persistente de trabajos de puntuación masiva (la misma de los endpoints /jobs).')
+    parser.add_argument('accion', choices=['trabajador', 'enviar', 'estado'])
+    parser.add_argument('entrada', nargs='?', help='Con "enviar": CSV con las columnas de los perfiles. Con "estado": identificador del trabajo')
+    parser.add_argument('--directorio', default=ruta_trabajos)
+    parser.add_argument('--trabajadores', type=int, default=1)
+    parser.add_argument('--filas-por-parte', type=int, default=5000)
+    parser.add_argument('--lote', type=int, default=1000, help='Perfiles por llamada al pipeline dentro de una parte')
+    args = parser.parse_args()
+
+    cola = ColaTrabajos(args.directorio)
+
+    if args.accion == 'enviar':
+        if args.entrada is None:
+            parser.error('Se debe indicar el CSV de entrada')
+        print(cola.crear(ruta_entrada=args.entrada))
+
+    elif args.accion == 'estado':
+        estado = cola.get_trabajo(args.entrada) if args.entrada else {'Resumen': cola.get_resumen(), 'Trabajos': cola.listar()}
+        print(json.dumps(estado, ensure_ascii=False, indent=2))
+
+    else:
+        load_dotenv()
+        procesador = ProcesadorTrabajos(cola, args.trabajadores, args.filas_por_parte, args.lote, os.getenv("USAR_TABLA_DECISION", "1") == "1").iniciar()
+        print(f'{args.trabajadores} trabajadores procesando la cola de {args.directorio}', flush=True)
+        for hilo in procesador.hilos:
+            hilo.join()
@@ -1,36 +1,33 @@
 import numpy as np
-from sklearn.ensemble import GradientBoostingClassifier
-from sklearn.model_selection import train_test_split
 import pandas as pd
 
+import expert_system
 from expert_system import *
 from definitions import *
 
 
+# Las funciones del pipeline no modifican los DataFrames que reciben: cada etapa devuelve un DataFrame (o Series) nuevo.
+# Así, los mismos datos (ej. los datos de entrenamiento de una versión del servicio) se pueden procesar desde varios hilos a la vez.
+# Con Copy-on-Write, los DataFrames que devuelve cada etapa comparten las columnas que no cambian con su entrada en lugar de copiarlas.
+pd.set_option('mode.copy_on_write', True)
+
+
 def preprocess_data(df):
-    # Verificar si hay valores nulos y en caso tal reemplazarlos por 'Sin Dato'
-    if df.isnull().values.any():
-        df.fillna('Sin Dato', inplace=True)
-    
-    df.replace({'N/A': 'Sin Dato'}, inplace=True)
+    # Reemplazar los valores nulos y las respuestas 'N/A' (o 'NA') por 'Sin Dato'
+    return df.fillna('Sin Dato').replace({respuesta: 'Sin Dato' for respuesta in respuestas_sin_dato})
 
 
 
 def get_one_hot_encoding(df):
     # Separar las opciones de respuesta para cada una de las columnas categóricas y generar una lista con las respuestas
-    for col in columnas_categoricas:
-        df[col] = df[col].str.split(';')  
+    df = df.assign(**{col: df[col].str.split(';') for col in columnas_categoricas})
     # Crear columnas binarias usando 'explode' para descomponer las listas en filas
     for col in columnas_categoricas:
         df = df.explode(col)
     # Aplicar One-Hot Encoding a las columnas categóricas del DF con los datos explotados
     df_encoded = pd.get_dummies(df, columns=columnas_categoricas, prefix=columnas_categoricas)
     # Agrupar por el índice original para reconstruir el DataFrame en la forma deseada
-    df_encoded = df_encoded.groupby(df_encoded.index).max().reset_index(drop=True)
-
-    df = df_encoded.copy()
-
-    return df_encoded, df
+    return df_encoded.groupby(df_encoded.index).max().reset_index(drop=True)
 
     
 
@@ -38,27 +35,37 @@ def create_col_psicosis_paranoia(df):
     # Verificar si las columnas existen en el DataFrame
     cols_existentes = [col for col in ['Condición_Psicosis', 'Condición_Paranoia', 'Historial Familiar_Psicosis', 'Historial Familiar_Paranoia'] if col in df.columns]
 
-    if cols_existentes:
-        # Crear la nueva columna combinada basada en las columnas existentes
-        df['Condición_Psicosis/Paranoia'] = df[cols_existentes].any(axis=1)
-        # Eliminar las columnas antiguas
-        df.drop(cols_existentes, axis=1, inplace=True)
+    if not cols_existentes:
+        return df
+
+    # Crear la nueva columna combinada basada en las columnas existentes y eliminar las columnas antiguas
+    return df.drop(columns=cols_existentes).assign(**{'Condición_Psicosis/Paranoia': df[cols_existentes].any(axis=1)})
 
 
 def transform_to_bool(df):
-    # Renombrar columnas en texto a valores binarios
-    for col in cols_dependencia_abuso:
-        df[col] = df[col].map(dict_cols_binarias)
+    # Renombrar columnas en texto a valores binarios y convertirlas en booleanas (True, False)
+    return df.assign(**{col: df[col].map(dict_cols_binarias).astype(bool) for col in cols_dependencia_abuso})
+
 
-    # Convertir las columnas binarias (1,0) en booleanas (True, False)
-    for col in cols_dependencia_abuso:
-        df[col] = df[col].astype(bool)
 
+def get_columnas_duplicadas(columnas):
+    # Grupos de columnas que son formas de una misma opción y quedarían con el mismo nombre al renombrarlas
+    # (ej. 'Trastorno Bipolar', 'Trastorno Bipolar (I, II)' y 'Trastorno Bipolar (I , II)'), en el orden de las columnas
+    grupos = {}
+    for col in columnas:
+        grupos.setdefault(dict_renombrar_respuestas.get(col, col), []).append(col)
+    return [cols for cols in grupos.values() if len(cols) > 1]
 
 
 def rename_cols(df):
+    # Combinar las formas de una misma opción para que el renombrado no genere columnas duplicadas cuando varias están
+    # presentes en los datos; la primera columna de cada grupo conserva su posición
+    duplicadas = get_columnas_duplicadas(df.columns)
+    if duplicadas:
+        df = df.assign(**{cols[0]: df[cols].any(axis=1) for cols in duplicadas}).drop(columns=[col for cols in duplicadas for col in cols[1:]])
+
     # Renombrar las columnas para tener mas claridad y facil acceso
-    df.rename(columns=dict_renombrar_respuestas, inplace=True)
+    return df.rename(columns=dict_renombrar_respuestas)
 
 
 
@@ -66,18 +73,14 @@ def get_label_encoding(df_test_encoded):
     # Realizar codificación con Label Encoding para variables seleccionadas
     cols_label_encoder = [col for col in df_test_encoded.columns if 'Frecuencia' in col]
 
-    # Codificación Frecuencia de Consumo
-    for col in cols_label_encoder:
-        df_test_encoded[col] = df_test_encoded[col].map(dict_encoder_frecuencia)
-        df_test_encoded[col] = df_test_encoded[col].astype(int)
-
-    # Codificación Cantidad de Sesiones con Macrodosis
-    df_test_encoded['Sesiones Macrodosis'] = df_test_encoded['Sesiones Macrodosis'].map(dict_encoder_sesiones_macro)
-    df_test_encoded['Sesiones Macrodosis'] = df_test_encoded['Sesiones Macrodosis'].astype(int)
-
-    # Codificación Cantidad de Tratamientos con SPA
-    df_test_encoded['Cantidad Tratamientos'] = df_test_encoded['Cantidad Tratamientos'].map(dict_encoder_cantidad_tratamientos)
-    df_test_encoded['Cantidad Tratamientos'] = df_test_encoded['Cantidad Tratamientos'].astype(int)
+    return df_test_encoded.assign(
+        # Codificación Frecuencia de Consumo
+        **{col: df_test_encoded[col].map(dict_encoder_frecuencia).astype(int) for col in cols_label_encoder},
+        # Codificación Cantidad de Sesiones con Macrodosis
+        **{'Sesiones Macrodosis': df_test_encoded['Sesiones Macrodosis'].map(dict_encoder_sesiones_macro).astype(int)},
+        # Codificación Cantidad de Tratamientos con SPA
+        **{'Cantidad Tratamientos': df_test_encoded['Cantidad Tratamientos'].map(dict_encoder_cantidad_tratamientos).astype(int)}
+    )
 
 
 
@@ -86,14 +89,14 @@ def get_label_encoding(df_test_encoded):
 def transform_data(df):
     try:
         # Crear variable fusionada (Psicosis/Paranoia)
-        create_col_psicosis_paranoia(df)
+        df = create_col_psicosis_paranoia(df)
         # Transformar los datos a valores booleanos
-        transform_to_bool(df)
+        df = transform_to_bool(df)
         # Renombrar columnas necesarias
-        rename_cols(df)
+        df = rename_cols(df)
         
         # Reemplazar caracteres especiales en los nombres de las columnas
-        df.columns = df.columns.str.replace(r'[^\w\s/,\']', '_', regex=True)
+        df = df.set_axis(df.columns.str.replace(r'[^\w\s/,\']', '_', regex=True), axis=1)
 
 
     except Exception as e:
@@ -106,63 +109,51 @@ def transform_data(df):
 
 
 def divide_dataset(df_test_encoded):
-    # Generar un DF para cada sustancia
-    df_test_encoded_cannabis = df_test_encoded.copy()
-    df_test_encoded_psilocibina = df_test_encoded.copy()
-
-    for col in df_test_encoded_cannabis.columns:
-        if 'Psilocibina' in col or 'Otros' in col or 'Sin Dato' in col or 'Tipo de Dosis' in col or 'Sin Razón' in col:
-            df_test_encoded_cannabis.drop(columns=[col], inplace=True)
-
-
-    for col in df_test_encoded_psilocibina.columns:
-        if 'Cannabis' in col or 'Otros' in col or 'Sin Dato' in col or 'Sin Razón' in col:
-            df_test_encoded_psilocibina.drop(columns=[col], inplace=True)
-
-    return df_test_encoded_cannabis, df_test_encoded_psilocibina
-
-
-def execute_expert_system(df_test, df_test_encoded, target_col):
-    try: 
-        # Definir el conjunto de reglas según la sustancia
-        if 'Cannabis' in target_col:
-            riesgo_bajo = get_low_risk_cannabis(df_test)
-            riesgo_medio = get_medium_risk_cannabis(df_test)
-            riesgo_alto = get_high_risk_cannabis(df_test)
-
-        elif 'Psilocibina' in target_col:
-            riesgo_bajo = get_low_risk_psilocibina(df_test)
-            riesgo_medio = get_medium_risk_psilocibina(df_test)
-            riesgo_alto = get_high_risk_psilocibina(df_test)
-
-        # Inicializar la nueva variable con 'Riesgo Desconocido'
-        df_test_encoded[target_col] = 'Riesgo Desconocido'
-        df_test[target_col] = 'Riesgo Desconocido'
-
-        # Asignar un nivel de riesgo bajo a los casos que lo cumplan
-        df_test_encoded.loc[riesgo_bajo, target_col] = 'Riesgo Bajo'
-        df_test.loc[riesgo_bajo, target_col] = 'Riesgo Bajo'
-
-        # Asignar el nivel de riesgo medio a los casos que lo cumplan y que no tengan un valor de riesgo asociado
-        df_test_encoded.loc[(df_test_encoded[target_col] == 'Riesgo Desconocido') & riesgo_medio, 
-                    target_col] = 'Riesgo Medio'
-        df_test.loc[(df_test[target_col] == 'Riesgo Desconocido') & riesgo_medio, 
-                    target_col] = 'Riesgo Medio'
-
-        # Se añade el nivel de riesgo alto a los casos que lo cumplan y que no tengan un valor de riesgo asociado
-        df_test_encoded.loc[(df_test_encoded[target_col] == 'Riesgo Desconocido') & riesgo_alto, 
-                    target_col] = 'Riesgo Alto'
-        df_test.loc[(df_test[target_col] == 'Riesgo Desconocido') & riesgo_alto, 
-                    target_col] = 'Riesgo Alto'
-        
-    except Exception as e:
-        print(f'Ocurrió un error en la ejecución del sistema experto: {e}')
+    # Generar un DF para cada sustancia con las columnas que le corresponden
+    cols_cannabis = [col for col in df_test_encoded.columns
+                     if not ('Psilocibina' in col or 'Otros' in col or 'Sin Dato' in col or 'Tipo de Dosis' in col or 'Sin Razón' in col)]
+    cols_psilocibina = [col for col in df_test_encoded.columns
+                        if not ('Cannabis' in col or 'Otros' in col or 'Sin Dato' in col or 'Sin Razón' in col)]
+
+    return df_test_encoded[cols_cannabis], df_test_encoded[cols_psilocibina]
+
+
+def execute_expert_system(df_test, target_col, reglas=None):
+    # Devuelve el nivel de riesgo de cada perfil según el sistema experto, sin modificar 'df_test'.
+    # Usar las reglas importadas si no se recibe otro conjunto de reglas (por ejemplo, uno recargado en caliente)
+    if reglas is None:
+        reglas = expert_system
+
+    # Definir el conjunto de reglas según la sustancia
+    if 'Cannabis' in target_col:
+        riesgo_bajo = reglas.get_low_risk_cannabis(df_test)
+        riesgo_medio = reglas.get_medium_risk_cannabis(df_test)
+        riesgo_alto = reglas.get_high_risk_cannabis(df_test)
+
+    elif 'Psilocibina' in target_col:
+        riesgo_bajo = reglas.get_low_risk_psilocibina(df_test)
+        riesgo_medio = reglas.get_medium_risk_psilocibina(df_test)
+        riesgo_alto = reglas.get_high_risk_psilocibina(df_test)
+
+    # Inicializar el nivel de riesgo con 'Riesgo Desconocido'
+    riesgo = pd.Series('Riesgo Desconocido', index=df_test.index, name=target_col)
+
+    # Asignar un nivel de riesgo bajo a los casos que lo cumplan
+    riesgo[riesgo_bajo] = 'Riesgo Bajo'
+
+    # Asignar el nivel de riesgo medio a los casos que lo cumplan y que no tengan un valor de riesgo asociado
+    riesgo[(riesgo == 'Riesgo Desconocido') & riesgo_medio] = 'Riesgo Medio'
+
+    # Se añade el nivel de riesgo alto a los casos que lo cumplan y que no tengan un valor de riesgo asociado
+    riesgo[(riesgo == 'Riesgo Desconocido') & riesgo_alto] = 'Riesgo Alto'
+
+    return riesgo
 
 
 
 def encode_risk_level(df_test_encoded, target_col):
     # Codificación del Nivel de Riesgo del Tratamiento 
-    df_test_encoded[target_col] = df_test_encoded[target_col].map(dict_encoder_riesgo_tratamiento)
+    return df_test_encoded.assign(**{target_col: df_test_encoded[target_col].map(dict_encoder_riesgo_tratamiento)})
 
 
 
@@ -174,6 +165,9 @@ def filter_df(df_encoded, target_col):
 
 
 def setup_training_data(df_encoded, target_col, random_state):
+    # Importación diferida: el módulo de selección de modelos solo se necesita al dividir los datos
+    from sklearn.model_selection import train_test_split
+
     df_encoded_filtrado = df_encoded[df_encoded[target_col] != 0]
     # Definir la variable objetivo (y) y las caracteristicas (X)
     X_riesgo = df_encoded_filtrado.drop(columns=[target_col])
@@ -201,8 +195,9 @@ def setup_test_data(df_test_encoded, X_test_riesgo, target_col):
     # Definir la variable objetivo
     y_test_riesgo = df_test_encoded[target_col]
 
-    # Re ordenar el DF de prueba para que tenga el mismo formato que los datos de entrenamiento
-    df_test_encoded_model = df_test_encoded.reindex(columns=X_test_riesgo.columns)
+    # Re ordenar el DF de prueba para que tenga el mismo formato que los datos de entrenamiento;
+    # las columnas faltantes en los datos de prueba se crean con valores False
+    df_test_encoded_model = df_test_encoded.reindex(columns=X_test_riesgo.columns, fill_value=False)
     
     return df_test_encoded_model, y_test_riesgo
 
@@ -210,18 +205,6 @@ def balance_and_setup_test_data(df_encoded, df_test_encoded, target_col, random_
     # Definir los subconjuntos de entranmiento y prueba para los datos de entrenamiento
     X_riesgo, y_riesgo, X_train_riesgo, X_test_riesgo, y_train_riesgo, y_test_riesgo = setup_training_data(df_encoded, target_col, random_state)
 
-    # Convertir los nombres de las columnas en conjuntos
-    columnas_X_riesgo = set(X_riesgo.columns)
-    columnas_df_test_encoded = set(df_test_encoded.columns)
-
-    # Identificar las columnas faltantes en los datos de prueba
-    columnas_faltantes = columnas_X_riesgo - columnas_df_test_encoded
-
-    # Crear las columnas faltantes en los datos de prueba con valores False
-    for columna in columnas_faltantes:
-        df_test_encoded[columna] = False
-
-
     # Re ordenar el DF de prueba para que tenga el mismo formato que los datos de entrenamiento
     df_test_encoded_model, y_test_riesgo = setup_test_data(df_test_encoded, X_test_riesgo, target_col)
 
@@ -234,13 +217,15 @@ map_values = np.vectorize(lambda x: reverse_dict_encoder_riesgo_tratamiento.get(
 
 
 
-# def train_model(X_train, y_train, model_name, parameters):
-#     if model_name == 'Gradient Boosting Classifier':
-#         model = GradientBoostingClassifier(**parameters)
-
-#     model.fit(X_train, y_train)
+def train_model(X_train, y_train, model_name, parameters):
+    # Importación diferida: el entrenamiento no forma parte del arranque de la API
+    from sklearn.ensemble import GradientBoostingClassifier
 
-#     return model
-    
+    if model_name == 'Gradient Boosting Classifier':
+        model = GradientBoostingClassifier(**parameters)
+    else:
+        raise ValueError(f'Modelo no soportado: {model_name}')
 
+    model.fit(X_train, y_train)
 
+    return model
@@ -0,0 +1,68 @@
+from enum import Enum
+
+from definitions import columnas_df, columnas_categoricas, opciones_respuesta, respuestas_sin_dato
+
+
+# Un Enum por pregunta con las opciones de respuesta válidas de 'definitions.py' (ej. EnumRespuesta['Frecuencia Cannabis']['Diario'])
+EnumRespuesta = {
+    col: Enum(col.title().replace(' ', ''), [(str(opcion), opcion) for opcion in opciones_respuesta[col]])
+    for col in columnas_df
+}
+
+# Valores permitidos por pregunta; en las de selección múltiple, las opciones que se pueden combinar con ';'
+valores_permitidos = {col: frozenset(opcion.value for opcion in enum) for col, enum in EnumRespuesta.items()}
+
+
+def validar_valor(col, valor):
+    # Devuelve el mensaje de error del valor, o None si es válido. Los valores nulos y las respuestas 'N/A' o 'NA'
+    # equivalen a 'Sin Dato' en el preprocesamiento.
+    if valor is None or valor in respuestas_sin_dato:
+        return None
+
+    # bool es subclase de int: True no es una calificación válida
+    if isinstance(valor, bool) or not isinstance(valor, (str, int)):
+        return f'Tipo no válido ({type(valor).__name__})'
+
+    if col in columnas_categoricas:
+        if not isinstance(valor, str):
+            return f'Tipo no válido ({type(valor).__name__})'
+        desconocidas = [opcion for opcion in valor.split(';') if opcion not in valores_permitidos[col]]
+        if desconocidas:
+            return f'Opciones no válidas: {desconocidas}'
+        return None
+
+    if valor not in valores_permitidos[col]:
+        return f'Valor no válido: {valor!r}'
+    return None
+
+
+def validar_perfiles(list_data):
+    # Validar el lote completo antes de cualquier procesamiento con pandas, pregunta por pregunta.
+    # Devuelve las posiciones de los perfiles válidos y los errores de cada perfil rechazado: {posición: {pregunta: mensaje}}.
+    errores = {}
+    perfiles_completos = []
+    for i, perfil in enumerate(list_data):
+        if not isinstance(perfil, (list, tuple)):
+            errores[i] = {'Perfil': f'Se esperaba una lista de {len(columnas_df)} respuestas ({type(perfil).__name__})'}
+        elif len(perfil) != len(columnas_df):
+            errores[i] = {'Perfil': f'Se esperaban {len(columnas_df)} respuestas y se recibieron {len(perfil)}'}
+        else:
+            perfiles_completos.append(i)
+
+    # Recorrer cada pregunta sobre todos los perfiles del lote, validando una sola vez cada valor distinto
+    for j, col in enumerate(columnas_df):
+        mensajes = {}
+        for i in perfiles_completos:
+            valor = list_data[i][j]
+            clave = (type(valor), valor) if isinstance(valor, (str, int, type(None))) else id(valor)
+            if clave not in mensajes:
+                mensajes[clave] = validar_valor(col, valor)
+            if mensajes[clave] is not None:
+                errores.setdefault(i, {})[col] = mensajes[clave]
+
+    validos = [i for i in range(len(list_data)) if i not in errores]
+    return validos, errores
+
+
+def formatear_errores(errores):
+    return [{'Fila': i, 'Errores': errores_fila} for i, errores_fila in sorted(errores.items())]
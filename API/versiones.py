@@ -0,0 +1,207 @@
+import hashlib
+import importlib.util
+import os
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+from joblib import load
+from dotenv import load_dotenv
+
+import expert_system
+from tabla_decision import cargar_tabla_decision, compilar_tablas, verificar_tabla_decision
+from prediccion import calcular_prediccion
+from motores import cargar_motor
+from explicaciones import ExplicadorGradientBoosting
+from test_data import generar_perfiles_sinteticos, sujeto1, sujeto2, sujeto3, sujeto4, sujeto5, sujeto6, sujeto7, sujeto8, sujeto9, sujeto10
+
+
+# Rutas de los artefactos que componen una versión del servicio
+ruta_modelo_cannabis = '../modelos/best_model_cannabis.joblib'
+ruta_modelo_psilocibina = '../modelos/best_model_psilocibina.joblib'
+# Variantes compactas de los modelos generadas con 'compactacion.py'
+ruta_modelo_compacto_cannabis = '../modelos/best_model_cannabis_compacto.joblib'
+ruta_modelo_compacto_psilocibina = '../modelos/best_model_psilocibina_compacto.joblib'
+ruta_datos_cannabis = '../encuestas/cannabis_encoded_modelos.csv'
+ruta_datos_psilocibina = '../encuestas/psilocibina_encoded_modelos.csv'
+ruta_reglas = expert_system.__file__
+
+# Perfiles usados para calentar una versión nueva antes de activarla
+perfiles_calentamiento = [sujeto1, sujeto2, sujeto3, sujeto4, sujeto5, sujeto6, sujeto7, sujeto8, sujeto9, sujeto10]
+
+# Perfiles sintéticos (además de los de calentamiento) con los que se verifica una tabla de decisión compilada al cargar una versión
+perfiles_verificacion_tabla = 2000
+
+
+class VersionServicio:
+    # Conjunto inmutable de modelos, reglas, tabla de decisión y datos de entrenamiento con el que se atiende una solicitud.
+    # Cada solicitud toma la versión activa al iniciar y la usa hasta terminar, aunque se active otra versión mientras tanto.
+
+    def __init__(self, version, model_cannabis, model_psilocibina, df_encoded_cannabis, df_encoded_psilocibina, reglas, tabla_decision):
+        load_dotenv()
+        self.version = version
+        self.model_cannabis = model_cannabis
+        self.model_psilocibina = model_psilocibina
+        self.df_encoded_cannabis = df_encoded_cannabis
+        self.df_encoded_psilocibina = df_encoded_psilocibina
+        self.reglas = reglas
+        self.tabla_decision = tabla_decision
+        # Estructuras de los árboles precalculadas para explicar las predicciones de los modelos
+        self.explicador_cannabis = ExplicadorGradientBoosting(model_cannabis)
+        self.explicador_psilocibina = ExplicadorGradientBoosting(model_psilocibina)
+        self.random_state_cannabis = int(os.getenv("RANDOM_STATE_CANNABIS"))
+        self.random_state_psilocibina = int(os.getenv("RANDOM_STATE_PSILOCIBINA"))
+        self.target_col_cannabis = os.getenv("TARGET_COL_CANNABIS")
+        self.target_col_psilocibina = os.getenv("TARGET_COL_PSILOCIBINA")
+        # Omitir el modelo en los perfiles en los que el sistema experto es decisivo (configurable por sustancia)
+        self.cortocircuito_cannabis = os.getenv("CORTOCIRCUITO_CANNABIS", "0") == "1"
+        self.cortocircuito_psilocibina = os.getenv("CORTOCIRCUITO_PSILOCIBINA", "0") == "1"
+        # Motor con el que se preparan los perfiles antes del sistema experto y los modelos (ver 'motores.py')
+        self.motor = cargar_motor(os.getenv("MOTOR_DATAFRAMES", "pandas"))
+        self.cargada = datetime.now().isoformat(timespec='seconds')
+
+
+def calcular_huella_artefactos(rutas):
+    # La versión se identifica por el contenido de los artefactos, no por la fecha de carga
+    huella = hashlib.sha256()
+    for ruta in rutas:
+        with open(ruta, 'rb') as archivo:
+            huella.update(archivo.read())
+    return huella.hexdigest()[:12]
+
+
+def cargar_reglas(ruta=ruta_reglas):
+    # Cargar una copia nueva del módulo de reglas sin reemplazar el módulo importado por el resto de la API
+    spec = importlib.util.spec_from_file_location('expert_system', ruta)
+    reglas = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(reglas)
+    # Conservar la instrumentación activa en las reglas recargadas
+    reglas.instrumentacion_reglas = expert_system.instrumentacion_reglas
+    return reglas
+
+
+def get_rutas_modelos():
+    # Servir la variante compacta de cada sustancia si está habilitada con MODELO_COMPACTO_CANNABIS / MODELO_COMPACTO_PSILOCIBINA
+    load_dotenv()
+    compacto_cannabis = os.getenv("MODELO_COMPACTO_CANNABIS", "0") == "1"
+    compacto_psilocibina = os.getenv("MODELO_COMPACTO_PSILOCIBINA", "0") == "1"
+    return (ruta_modelo_compacto_cannabis if compacto_cannabis else ruta_modelo_cannabis,
+            ruta_modelo_compacto_psilocibina if compacto_psilocibina else ruta_modelo_psilocibina)
+
+
+def cargar_version(usar_tabla_decision, reglas=None, marcar_etapa=lambda nombre_etapa: None):
+    # Leer datos de entrenamiento
+    df_encoded_cannabis = pd.read_csv(ruta_datos_cannabis)
+    df_encoded_psilocibina = pd.read_csv(ruta_datos_psilocibina)
+    marcar_etapa('Lectura CSV')
+
+    ruta_cannabis, ruta_psilocibina = get_rutas_modelos()
+    model_psilocibina = load(ruta_psilocibina)
+    model_cannabis = load(ruta_cannabis)
+    marcar_etapa('Carga de modelos')
+
+    if reglas is None:
+        reglas = expert_system
+
+    # Cargar la tabla de decisión compilada del sistema experto si está habilitada.
+    # Si no corresponde a las reglas cargadas, se compila en memoria para esta versión y se compara con las reglas;
+    # si alguna predicción difiere, la versión evalúa las reglas directamente.
+    tabla_decision = None
+    if usar_tabla_decision:
+        tabla_decision = cargar_tabla_decision(reglas=reglas)
+        if tabla_decision is None:
+            load_dotenv()
+            target_cols = [os.getenv("TARGET_COL_CANNABIS"), os.getenv("TARGET_COL_PSILOCIBINA")]
+            tabla_decision = compilar_tablas(target_cols, reglas)
+            list_data = perfiles_calentamiento + generar_perfiles_sinteticos(perfiles_verificacion_tabla)
+            diferencias = verificar_tabla_decision(tabla_decision, target_cols, list_data, reglas, firmas=False)
+            if any(resultado['Diferencias en perfiles'] for resultado in diferencias.values()):
+                print(f'La tabla de decisión compilada no es equivalente a las reglas, se evaluarán las reglas directamente: {diferencias}')
+                tabla_decision = None
+    marcar_etapa('Tabla de decisión')
+
+    version = calcular_huella_artefactos([ruta_cannabis, ruta_psilocibina, ruta_datos_cannabis, ruta_datos_psilocibina, reglas.__file__])
+    return VersionServicio(version, model_cannabis, model_psilocibina, df_encoded_cannabis, df_encoded_psilocibina, reglas, tabla_decision)
+
+
+def calentar_version(version):
+    # Ejecutar la versión con los perfiles de prueba para detectar errores y llenar cachés antes de activarla.
+    # Los perfiles de prueba no son tráfico real, por lo que no se registran en el monitor de deriva.
+    for perfil in perfiles_calentamiento:
+        calcular_prediccion([perfil], version, monitorear=False)
+
+
+class RegistroVersiones:
+    # Mantiene la versión activa del servicio y la reemplaza de forma atómica al recargar los artefactos
+
+    def __init__(self, version, usar_tabla_decision):
+        self.lock = threading.Lock()
+        self.lock_recarga = threading.Lock()
+        self.actual = version
+        self.usar_tabla_decision = usar_tabla_decision
+        self.estado = {'Estado': 'Activa', 'Recargas': 0, 'Errores': 0, 'Último Error': None}
+        self.vigilancia = None
+
+    def get_actual(self):
+        return self.actual
+
+    def recargar(self):
+        # Cargar y calentar la versión nueva fuera del lock; solo el reemplazo de la referencia es atómico
+        if not self.lock_recarga.acquire(blocking=False):
+            return False
+
+        try:
+            self.estado['Estado'] = 'Recargando'
+            nueva_version = cargar_version(self.usar_tabla_decision, reglas=cargar_reglas())
+            calentar_version(nueva_version)
+
+            with self.lock:
+                version_anterior = self.actual
+                self.actual = nueva_version
+                self.estado['Recargas'] += 1
+
+            print(f'Versión activa: {nueva_version.version} (anterior: {version_anterior.version if version_anterior else None})')
+            return True
+        except Exception as e:
+            self.estado['Errores'] += 1
+            self.estado['Último Error'] = str(e)
+            print(f'Ocurrió un error en la recarga de la versión, se mantiene la versión activa: {e}')
+            return False
+        finally:
+            self.estado['Estado'] = 'Activa'
+            self.lock_recarga.release()
+
+    def recargar_en_segundo_plano(self):
+        hilo = threading.Thread(target=self.recargar, daemon=True)
+        hilo.start()
+        return hilo
+
+    def get_estado(self):
+        version = self.actual
+        return {
+            'Versión': version.version if version else None,
+            'Cargada': version.cargada if version else None,
+            'Tabla de Decisión': version is not None and version.tabla_decision is not None,
+            'Motor DataFrames': version.motor.nombre if version else None,
+            **self.estado
+        }
+
+    def iniciar_vigilancia(self, intervalo):
+        # Revisar periódicamente la fecha de modificación de los artefactos y recargar cuando alguno cambie
+        rutas = [*get_rutas_modelos(), ruta_datos_cannabis, ruta_datos_psilocibina, ruta_reglas]
+
+        def get_fechas():
+            return [os.path.getmtime(ruta) if os.path.exists(ruta) else None for ruta in rutas]
+
+        def vigilar():
+            fechas = get_fechas()
+            while True:
+                time.sleep(intervalo)
+                fechas_nuevas = get_fechas()
+                if fechas_nuevas != fechas:
+                    fechas = fechas_nuevas
+                    self.recargar()
+
+        self.vigilancia = threading.Thread(target=vigilar, daemon=True)
+        self.vigilancia.start()